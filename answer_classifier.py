@@ -0,0 +1,203 @@
+# answer_classifier.py
+"""
+Local, in-process classifier for replies to the yes/no screening questions.
+
+Most replies are things like "yes", "nope" or "not really", which do not need
+a Gemini round-trip to interpret. `node_parse_response` asks this classifier
+first and only escalates to the LLM when it is not confident enough.
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+YES_PHRASES = {
+    "yes", "y", "yeah", "yea", "yep", "yup", "ya", "yes please", "sure", "of course",
+    "definitely", "absolutely", "certainly", "indeed", "totally", "exactly", "correct",
+    "true", "right", "agree", "i agree", "i do", "i do agree", "i would agree",
+    "very much", "very much so", "always", "often", "mostly", "usually", "that's me",
+    "that's true", "that's right", "that's correct", "it does", "it is", "i was", "they do",
+    "yes i do", "yes definitely", "yes absolutely", "yes always", "for sure", "pretty much",
+    "100%", "affirmative", "strongly agree", "mostly yes", "i think so", "i believe so",
+    "no doubt", "without a doubt",
+}
+
+NO_PHRASES = {
+    "no", "n", "nope", "nah", "no way", "not really", "not at all", "never", "rarely",
+    "hardly", "hardly ever", "definitely not", "absolutely not", "certainly not", "not me",
+    "not true", "false", "incorrect", "disagree", "i disagree", "i don't", "i do not",
+    "i don't agree", "i do not agree", "i wouldn't say so", "i wouldn't", "that's not me",
+    "that's not true", "it doesn't", "it does not", "i wasn't", "i was not", "they don't",
+    "nobody", "no one", "none", "no i don't", "no never", "strongly disagree", "mostly no",
+    "i don't think so", "not that i know of", "not that i'm aware of",
+    "no not really", "no not at all", "no not me", "nope not really", "nah not really",
+}
+
+UNSURE_PHRASES = {
+    "maybe", "perhaps", "not sure", "i'm not sure", "im not sure", "unsure", "idk",
+    "i don't know", "dont know", "don't know", "no idea", "sometimes", "it depends",
+    "depends", "hard to say", "kind of", "kinda", "sort of", "50/50", "yes and no",
+    "i can't remember", "i don't remember", "can't say", "not really sure", "not certain",
+}
+
+# Words that signal a hedge after an otherwise clear "yes"/"no" opener.
+CONTRAST_WORDS = {"but", "although", "though", "however", "except", "unless", "sometimes", "depends", "maybe"}
+# Words that can turn an opener around ("yeah, no", "yes, sadly not"). Any
+# word ending in "n't" counts too.
+NEGATORS = {
+    "no", "not", "never", "nope", "nah", "none", "nothing", "nobody", "neither", "nor", "cannot",
+    "dont", "doesnt", "didnt", "isnt", "wasnt", "wont", "cant", "disagree",
+}
+# One-word answers of each polarity, e.g. "definitely" in "no, definitely yes"
+_YES_WORDS = frozenset(phrase for phrase in YES_PHRASES if " " not in phrase)
+_NO_WORDS = frozenset(phrase for phrase in NO_PHRASES if " " not in phrase)
+# Openers ending in an auxiliary ("i don't", "it is not") take their meaning
+# from what follows ("I don't mind it"), so they only count as exact matches.
+_AUXILIARIES = {"do", "don't", "does", "doesn't", "is", "isn't", "was", "wasn't", "would", "wouldn't"}
+
+EXACT_CONFIDENCE = 0.99
+LEADING_CONFIDENCE = 0.9
+HEDGED_CONFIDENCE = 0.5
+# A clear opener only counts if the rest of the reply is short.
+MAX_TRAILING_WORDS = 6
+
+DEFAULT_THRESHOLD = float(os.getenv("LOCAL_PARSER_THRESHOLD", "0.85"))
+
+_UNSURE_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(p) for p in sorted(UNSURE_PHRASES, key=len, reverse=True)) + r")(?!\w)"
+)
+
+
+def _is_open_ended(phrase: str) -> bool:
+    words = phrase.split()
+    if words[-1] == "not" and len(words) > 1:
+        words = words[:-1]
+    return words[-1] in _AUXILIARIES
+
+
+_LEADING_PHRASES = sorted(
+    [(phrase, "yes") for phrase in YES_PHRASES if not _is_open_ended(phrase)]
+    + [(phrase, "no") for phrase in NO_PHRASES if not _is_open_ended(phrase)],
+    key=lambda item: -len(item[0]),
+)
+
+
+def _turns_around(rest: List[str], label: str) -> bool:
+    """Whether the words after a `label` opener negate it or answer the other way."""
+    opposite = _NO_WORDS if label == "yes" else _YES_WORDS
+    return any(word in NEGATORS or word.endswith("n't") or word in opposite for word in rest)
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace("’", "'").replace("‘", "'")
+    text = re.sub(r"[^\w'%/ ]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def classify_answer(user_response: str) -> Tuple[str, float]:
+    """
+    Classifies a reply as "yes", "no" or "unsure" and returns the label with a
+    confidence in [0, 1]. Exact lexicon matches are near-certain; a clear opener
+    followed by a short remainder that neither hedges, negates nor answers the
+    other way ("yeah, no") is fairly confident; anything else comes back as
+    "unsure" or below the local threshold.
+    """
+    text = _normalize(user_response)
+    if not text:
+        return "unsure", 0.0
+    if text in YES_PHRASES:
+        return "yes", EXACT_CONFIDENCE
+    if text in NO_PHRASES:
+        return "no", EXACT_CONFIDENCE
+    if text in UNSURE_PHRASES:
+        return "unsure", EXACT_CONFIDENCE
+    if _UNSURE_PATTERN.search(text):
+        return "unsure", HEDGED_CONFIDENCE
+
+    words = text.split()
+    for phrase, label in _LEADING_PHRASES:
+        phrase_words = phrase.split()
+        if words[:len(phrase_words)] == phrase_words:
+            rest = words[len(phrase_words):]
+            if CONTRAST_WORDS.intersection(rest) or len(rest) > MAX_TRAILING_WORDS or _turns_around(rest, label):
+                return label, HEDGED_CONFIDENCE
+            return label, LEADING_CONFIDENCE
+    return "unsure", 0.0
+
+
+_NUMBER_LIST = r"\d+(?:\s*(?:,|and|&|/)\s*\d+)*"
+_ANSWER_TO_NUMBERS = re.compile(r"\b(yes|no)\s+(?:to|for|on)\s+(?:questions?\s+|numbers?\s+|#)?(" + _NUMBER_LIST + r")\b")
+_ANSWER_TO_REST = re.compile(r"\b(yes|no)\s+(?:to|for|on)\s+(?:all\s+)?(?:the\s+)?(?:others|other ones|rest|remaining|all)\b")
+_NUMBERED_SEGMENT = re.compile(r"(?:^|\s)(\d+)\s*[:.)\-]?\s+(.*?)(?=\s\d+\s*[:.)\-]?\s|$)")
+
+
+def classify_group_reply(user_response: str, n_questions: int) -> List[str]:
+    """
+    Deterministic reading of one reply to `n_questions` numbered questions,
+    used when the group parser LLM is unavailable. Understands "yes to 1 and
+    3, no to the others", "1 yes 2 no ...", and a single answer for all of
+    them. Questions it cannot place come back "unsure".
+    """
+    text = _normalize(user_response)
+    answers: Dict[int, str] = {}
+    for label, numbers in _ANSWER_TO_NUMBERS.findall(text):
+        for number in re.findall(r"\d+", numbers):
+            answers.setdefault(int(number), label)
+    if not answers:
+        for number, segment in _NUMBERED_SEGMENT.findall(text):
+            answer, _ = classify_answer(segment)
+            answers.setdefault(int(number), answer)
+    rest = _ANSWER_TO_REST.search(text)
+    if rest is not None:
+        default = rest.group(1)
+    elif not answers:
+        default, _ = classify_answer(text)
+    else:
+        default = "unsure"
+    return [answers.get(i, default) for i in range(1, n_questions + 1)]
+
+
+class AnswerClassifier:
+    """
+    Local fast path in front of the LLM parser. Keeps counters of how many
+    replies it answered locally versus escalated, so the saved LLM traffic can
+    be watched in production.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._local_hits = {"yes": 0, "no": 0}
+        self._escalations = 0
+
+    def try_classify(self, user_response: str) -> Optional[str]:
+        """
+        Returns "yes" or "no" when the local classifier is confident enough,
+        or None when the reply should be escalated to the LLM. A local "unsure"
+        is always escalated, since PARSER_PROMPT asks the LLM to resolve the
+        user's tendency rather than give up.
+        """
+        answer, confidence = classify_answer(user_response)
+        accepted = answer != "unsure" and confidence >= self.threshold
+        with self._lock:
+            if accepted:
+                self._local_hits[answer] += 1
+            else:
+                self._escalations += 1
+        return answer if accepted else None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            local_hits = sum(self._local_hits.values())
+            total = local_hits + self._escalations
+            return {
+                "threshold": self.threshold,
+                "total": total,
+                "local_yes": self._local_hits["yes"],
+                "local_no": self._local_hits["no"],
+                "escalated": self._escalations,
+                "hit_rate": local_hits / total if total else 0.0,
+            }
+
+
+answer_classifier = AnswerClassifier()
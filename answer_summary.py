@@ -0,0 +1,98 @@
+# answer_summary.py
+"""
+A compact record of the screening for the final summary prompt.
+
+The conversation history holds every phrasing, every "let's try that one
+again" and every unsure retry, so a prompt built from it grows with how much
+the user hedged. Instead, each stored answer appends one entry (question key,
+parsed answer and a short quote of the user's reply) to `answer_summary` in
+the conversation state. `render_answer_summary` turns the entries into the
+prompt text within a fixed token budget, dropping detail in a fixed order
+until it fits:
+
+1. every answer with its question and the user's quote,
+2. quotes only for the most recent answers,
+3. no quotes,
+4. answers only, as many as fit,
+5. that list cut to the budget, for a budget too small for even one answer.
+
+With at most twelve answers, the final prompt therefore has the same bounded
+size however long the conversation ran.
+"""
+import os
+from typing import Dict, Iterable, List
+
+from prompts import QUESTIONS
+
+# Token budget of the answer summary in the final prompt
+FINAL_PROMPT_SUMMARY_TOKENS = int(os.getenv("FINAL_PROMPT_SUMMARY_TOKENS", "400"))
+# Rough size of a token for English text; only used to enforce the budget
+CHARS_PER_TOKEN = 4
+# Longest quote of a user's reply kept per answer
+QUOTE_MAX_CHARS = 120
+# Quotes kept at the second detail level
+RECENT_QUOTES = 3
+# Longest question text shown per answer
+QUESTION_MAX_CHARS = 90
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1].rsplit(" ", 1)[0] + "…"
+
+
+def summary_entries(keys: Iterable[str], answers: Dict[str, str], user_response: str) -> List[Dict[str, str]]:
+    """One entry per stored yes/no answer in `answers`, quoting the reply they were read from."""
+    quote = _shorten(user_response, QUOTE_MAX_CHARS)
+    return [
+        {"key": key, "answer": answers[key], "quote": quote}
+        for key in keys if answers.get(key) in ('yes', 'no')
+    ]
+
+
+def _line(entry: Dict[str, str], question: bool, quote: bool) -> str:
+    line = f"- {entry['key']}"
+    if question:
+        line += f" ({_shorten(QUESTIONS.get(entry['key'], ''), QUESTION_MAX_CHARS)})"
+    line += f": {entry['answer']}"
+    if quote and entry.get('quote'):
+        line += f' - "{entry["quote"]}"'
+    return line
+
+
+def render_answer_summary(summary: List[Dict[str, str]], max_tokens: int = FINAL_PROMPT_SUMMARY_TOKENS) -> str:
+    """The summary as prompt text of at most `max_tokens` (estimated) tokens."""
+    if not summary:
+        return _cut("(No answers were recorded.)", max_tokens * CHARS_PER_TOKEN)
+    recent = len(summary) - RECENT_QUOTES
+    levels = (
+        [_line(entry, True, True) for entry in summary],
+        [_line(entry, True, i >= recent) for i, entry in enumerate(summary)],
+        [_line(entry, True, False) for entry in summary],
+    )
+    for lines in levels:
+        text = "\n".join(lines)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+    lines = []
+    for i, entry in enumerate(summary):
+        line = _line(entry, False, False)
+        more = f"- ({len(summary) - i} more answers)"
+        if estimate_tokens("\n".join(lines + [line, more])) > max_tokens:
+            lines.append(more)
+            break
+        lines.append(line)
+    return _cut("\n".join(lines), max_tokens * CHARS_PER_TOKEN)
+
+
+def _cut(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1].rstrip() + "…" if max_chars > 0 else ""
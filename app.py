@@ -1,11 +1,37 @@
 # app.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect as ws_connect
 import json
+import os
+import re
+import time
+import uuid
 
 # --- Configuration ---
-# URL of your running FastAPI backend
-API_URL = "https://autism-detection-1-gxzu.onrender.com/turn"
+# Base URL of your running FastAPI backend
+API_BASE_URL = os.getenv("API_BASE_URL", "https://autism-detection-1-gxzu.onrender.com").rstrip("/")
+API_URL = API_BASE_URL + "/turn"
+# Same turn endpoint, answered as Server-Sent Events so the final summary streams in
+STREAM_API_URL = API_URL + "/stream"
+# "http" sends every turn as a request with the whole state; "websocket" keeps
+# one connection per screening, with the state held by the backend
+API_TRANSPORT = os.getenv("API_TRANSPORT", "http").lower()
+WS_URL = re.sub(r"^http", "ws", API_BASE_URL) + "/ws"
+
+# (connect, read) timeouts in seconds. The read timeout has to cover a whole
+# turn before the first byte, including two LLM calls.
+API_TIMEOUT = (float(os.getenv("API_CONNECT_TIMEOUT", "5")), float(os.getenv("API_READ_TIMEOUT", "60")))
+# Retries for connection errors and 502/503/504, e.g. while the backend wakes up.
+# Every turn carries an Idempotency-Key, so the backend answers a retry with
+# the first run's result instead of running the turn (and its LLM calls) again.
+API_RETRIES = int(os.getenv("API_RETRIES", "2"))
+API_BACKOFF_SECONDS = float(os.getenv("API_BACKOFF_SECONDS", "0.5"))
+# Shows the per-turn latency panel in the sidebar by default
+SHOW_LATENCY_PANEL = os.getenv("SHOW_LATENCY_PANEL", "0").lower() in ("1", "true", "yes", "on")
 
 # Define the options for the dropdowns. These should match the data your model was trained on.
 # These values are derived from your notebook's analysis.
@@ -23,6 +49,203 @@ COUNTRY_OPTIONS = [
 ]
 
 
+def turn_idempotency_key(payload: dict) -> str:
+    """
+    The Idempotency-Key of the turn `payload` starts. It is made once and reused
+    until the turn succeeds, so resubmitting the same answer after an error
+    gets the first run's result instead of running the turn again.
+    """
+    pending = st.session_state.get("pending_turn")
+    if pending is None or pending["payload"] != payload:
+        pending = st.session_state.pending_turn = {"payload": payload, "key": str(uuid.uuid4())}
+    return pending["key"]
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    One pooled HTTP session per Streamlit server process, shared by every
+    browser session and rerun. Connections to the backend are kept alive, so
+    only the first turn pays for the TCP and TLS handshakes.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=API_RETRIES, connect=API_RETRIES, read=0, status=API_RETRIES,
+        backoff_factor=API_BACKOFF_SECONDS, status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+    return session
+
+
+SERVER_TIMING = re.compile(r"app;dur=([\d.]+)")
+
+
+def record_turn_latency(response, start: float, first_token: float = None):
+    """
+    Keeps the timings of a turn for the latency panel. `server_ms` is what the
+    backend reports in Server-Timing, so `network_ms` is the rest of the time
+    to the response headers: round trips, handshakes and queueing. WebSocket
+    turns have no response, so only their total and first-token times are kept.
+    """
+    end = time.perf_counter()
+    headers_ms = response.elapsed.total_seconds() * 1000 if response is not None else None
+    match = SERVER_TIMING.search(response.headers.get("Server-Timing", "")) if response is not None else None
+    server_ms = float(match.group(1)) if match else None
+    st.session_state.turn_latencies.append({
+        "turn": len(st.session_state.turn_latencies) + 1,
+        "total_ms": round((end - start) * 1000, 1),
+        "headers_ms": round(headers_ms, 1) if headers_ms is not None else None,
+        "server_ms": server_ms,
+        "network_ms": round(headers_ms - server_ms, 1) if server_ms is not None else None,
+        "first_token_ms": round((first_token - start) * 1000, 1) if first_token else None,
+    })
+
+
+def show_latency_panel():
+    with st.sidebar:
+        if not st.checkbox("Show turn latency", value=SHOW_LATENCY_PANEL):
+            return
+        st.caption(f"Backend: {WS_URL if API_TRANSPORT == 'websocket' else API_BASE_URL}")
+        latencies = st.session_state.turn_latencies
+        if not latencies:
+            st.write("No turns yet.")
+            return
+        st.dataframe(latencies, hide_index=True)
+        measured = [t for t in latencies if t["network_ms"] is not None]
+        if measured:
+            network = sum(t["network_ms"] for t in measured)
+            total = sum(t["total_ms"] for t in measured)
+            st.metric("Network share of turn time", f"{network / total:.0%}" if total else "n/a")
+
+
+def iter_sse_events(response):
+    """Yields (event, data) pairs from a Server-Sent Events response."""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def socket_connect(first_frame: dict):
+    """
+    Opens the conversation WebSocket, sends `start` or `resume` and keeps the
+    connection and session id in the browser session.
+    """
+    ws = ws_connect(WS_URL, open_timeout=API_TIMEOUT[0])
+    ws.send(json.dumps(first_frame))
+    frame = json.loads(ws.recv(timeout=API_TIMEOUT[1]))
+    if frame["type"] == "error":
+        ws.close()
+        raise requests.exceptions.RequestException(frame["detail"])
+    st.session_state.ws = ws
+    st.session_state.session_id = frame["session_id"]
+    return ws
+
+
+def socket_close():
+    ws = st.session_state.pop("ws", None)
+    if ws is not None:
+        ws.close()
+
+
+def socket_frames(ws):
+    """
+    Yields the backend's frames for one turn, up to and including its last,
+    and remembers the turn of the question the conversation is waiting on.
+    """
+    while True:
+        frame = json.loads(ws.recv(timeout=API_TIMEOUT[1]))
+        if frame["type"] == "message":
+            st.session_state.ws_turn = frame.get("turn")
+        yield frame
+        if frame["type"] in ("message", "done", "error"):
+            return
+
+
+def socket_start(initial_data: dict) -> dict:
+    """Starts a screening over a new WebSocket and returns its first question as a turn result."""
+    try:
+        ws = socket_connect({"type": "start", "initial_data": initial_data})
+        frame = next(socket_frames(ws))
+    except (WebSocketException, OSError) as e:
+        socket_close()
+        raise requests.exceptions.RequestException(e)
+    if frame["type"] == "error":
+        raise requests.exceptions.RequestException(frame["detail"])
+    return {"state": None, "is_finished": False, "ai_message": frame["text"]}
+
+
+def socket_reply(text: str):
+    """
+    Sends a reply and yields the frames of the turn. A connection lost before
+    the turn's first frame is reopened with `resume` (the backend parks the
+    conversation when a connection drops) and the reply is sent again, unless
+    the backend had already taken it.
+    """
+    turn = st.session_state.get("ws_turn")
+    for attempt in range(API_RETRIES + 1):
+        try:
+            ws = st.session_state.get("ws")
+            resumed = None
+            if ws is None:
+                ws = socket_connect({"type": "resume", "session_id": st.session_state.session_id})
+                # The backend repeats the question it is waiting on
+                for resumed in socket_frames(ws):
+                    pass
+            if resumed is not None and resumed["type"] == "message" and turn is not None and resumed["turn"] != turn:
+                # The reply was taken before the connection dropped; the resumed question is its result
+                frames, first = iter(()), resumed
+            else:
+                ws.send(json.dumps({"type": "reply", "text": text, "turn": turn}))
+                frames = socket_frames(ws)
+                first = next(frames)
+        except (WebSocketException, OSError) as e:
+            st.session_state.pop("ws", None)
+            if attempt == API_RETRIES:
+                raise requests.exceptions.RequestException(e)
+            time.sleep(API_BACKOFF_SECONDS * 2 ** attempt)
+            continue
+
+        try:
+            yield first
+            yield from frames
+        except (WebSocketException, OSError) as e:
+            st.session_state.pop("ws", None)
+            raise requests.exceptions.RequestException(e)
+        return
+
+
+def iter_socket_events(text: str):
+    """
+    Yields one WebSocket turn as the same (event, data) pairs as
+    `iter_sse_events`, so both transports share the chat code.
+    """
+    for frame in socket_reply(text):
+        kind = frame["type"]
+        if kind == "message":
+            yield "token", {"text": frame["text"]}
+            yield "done", {"state": None, "is_finished": False, "ai_message": frame["text"]}
+        elif kind == "done":
+            # The backend closes the connection after the summary
+            socket_close()
+            yield "done", {
+                "state": None, "is_finished": True, "ai_message": frame["text"],
+                "prediction": frame["prediction"], "confidence": frame["confidence"],
+            }
+        else:
+            yield kind, frame
+
+
 # --- Main App Logic ---
 def main():
     st.set_page_config(page_title="Autism Screening Assistant", layout="centered")
@@ -49,6 +272,11 @@ def main():
         st.session_state.prediction = None
     if 'confidence' not in st.session_state: # <<< NEW
         st.session_state.confidence = None
+    if 'turn_latencies' not in st.session_state:
+        st.session_state.turn_latencies = []
+
+    http = get_http_session()
+    show_latency_panel()
 
 
     # --- Section 1: Initial Data Collection Form ---
@@ -78,14 +306,24 @@ def main():
                 # Make the first API call to start the conversation
                 try:
                     with st.spinner("Initializing the conversation..."):
-                        response = requests.post(
-                            API_URL,
-                            json={"initial_data": initial_data}
-                        )
-                        response.raise_for_status() # Raises an exception for 4XX/5XX errors
+                        start = time.perf_counter()
+                        if API_TRANSPORT == "websocket":
+                            data = socket_start(initial_data)
+                            record_turn_latency(None, start)
+                        else:
+                            payload = {"initial_data": initial_data}
+                            response = http.post(
+                                API_URL,
+                                json=payload,
+                                headers={"Idempotency-Key": turn_idempotency_key(payload)},
+                                timeout=API_TIMEOUT
+                            )
+                            response.raise_for_status() # Raises an exception for 4XX/5XX errors
+                            record_turn_latency(response, start)
+                            data = response.json()
+                            st.session_state.pop("pending_turn", None)
 
                     # Process the successful response
-                    data = response.json()
                     st.session_state.langgraph_state = data['state']
                     st.session_state.messages.append({"role": "assistant", "content": data['ai_message']})
                     st.session_state.screening_started = True
@@ -147,15 +385,46 @@ def main():
                     "user_response": prompt
                 }
 
-                # Call the backend to get the next step in the conversation
+                # Call the backend to get the next step in the conversation.
+                # The reply is streamed: on the last turn the prediction arrives
+                # first and the summary is rendered while it is being written.
                 try:
-                    with st.spinner("AI is thinking..."):
-                        response = requests.post(API_URL, json=payload)
-                        response.raise_for_status()
+                    start = time.perf_counter()
+                    if API_TRANSPORT == "websocket":
+                        response, events = None, iter_socket_events(prompt)
+                    else:
+                        with st.spinner("AI is thinking..."):
+                            response = http.post(STREAM_API_URL, json=payload, stream=True, timeout=API_TIMEOUT,
+                                                 headers={"Idempotency-Key": turn_idempotency_key(payload)})
+                            response.raise_for_status()
+                        events = iter_sse_events(response)
+
+                    turn = {}
+
+                    def stream_ai_message():
+                        for event, event_data in events:
+                            if event == "token":
+                                turn.setdefault("first_token", time.perf_counter())
+                                yield event_data["text"]
+                            elif event == "prediction":
+                                # Keep the result even if the summary fails later on
+                                st.session_state.prediction = event_data["prediction"]
+                                st.session_state.confidence = event_data["confidence"]
+                            elif event == "done":
+                                turn["result"] = event_data
+                            elif event == "error":
+                                raise requests.exceptions.RequestException(event_data["detail"])
 
-                    data = response.json()
+                    with st.chat_message("assistant"):
+                        st.write_stream(stream_ai_message())
 
-                    # Update state and display AI's response
+                    if "result" not in turn:
+                        raise requests.exceptions.RequestException("The connection closed before the turn finished.")
+                    data = turn["result"]
+                    record_turn_latency(response, start, turn.get("first_token"))
+                    st.session_state.pop("pending_turn", None)
+
+                    # Update state and store the AI's response
                     st.session_state.langgraph_state = data['state']
                     st.session_state.is_finished = data['is_finished']
                     # <<< MODIFIED: Store prediction and confidence when finished >>>
@@ -163,9 +432,6 @@ def main():
                         st.session_state.prediction = data.get('prediction')
                         st.session_state.confidence = data.get('confidence')
 
-
-                    with st.chat_message("assistant"):
-                        st.markdown(data['ai_message'])
                     st.session_state.messages.append({"role": "assistant", "content": data['ai_message']})
 
                     # Rerun to update the UI (this will also show the slider if finished)
@@ -0,0 +1,14 @@
+# benchmarks/__init__.py
+"""
+Offline benchmarks for the screening backend. None of them call Gemini.
+
+- `fake_gemini`: a configurable stand-in for `genai.GenerativeModel`.
+- `load`: full scripted screenings against the API at a chosen concurrency.
+- `micro`: timings of feature encoding, SVM scoring and `preprocess_and_predict`.
+- `batching`: concurrent single predictions with and without the prediction batcher.
+- `fake_server`: the real app served over HTTP with the fake model.
+
+Run the modules from the repository root, e.g. `python -m benchmarks.load`.
+Results are written as JSON to benchmarks/results/.
+"""
+from benchmarks.fake_gemini import FakeGenerativeModel, LatencyProfile
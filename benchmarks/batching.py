@@ -0,0 +1,127 @@
+# benchmarks/batching.py
+"""
+Throughput and latency of concurrent single predictions, with and without the
+prediction batcher.
+
+Bursts of `--concurrency` predictions are started at once, as when many
+screenings finish together, and each caller scores a different user so every
+prediction reaches the model (the prediction cache is disabled and a
+prediction table is not used). Each setting of the batcher is run on the event
+loop (`apreprocess_and_predict`) and from a thread pool
+(`preprocess_and_predict`).
+
+    python -m benchmarks.batching --concurrency 64 --bursts 50
+
+Reported per setting: predictions per second, p50/p99 latency per call, and
+the mean batch size.
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# Every prediction has to reach the model
+os.environ["PREDICTION_CACHE_SIZE"] = "0"
+os.environ["PREDICTION_TABLE"] = "0"
+
+import model_pipeline  # noqa: E402
+from benchmarks.micro import sample_users  # noqa: E402
+from benchmarks.results import summarize, write_results  # noqa: E402
+from metrics import PREDICTION_BATCH_SIZE  # noqa: E402
+from prediction_batcher import PredictionBatcher  # noqa: E402
+
+
+def _batch_stats() -> Tuple[int, float]:
+    counts = PREDICTION_BATCH_SIZE._values.get((), None)
+    return (sum(counts[:-1]), counts[-1]) if counts else (0, 0.0)
+
+
+def _use_batcher(max_batch_size: int, max_wait_ms: float) -> Optional[PredictionBatcher]:
+    if model_pipeline.prediction_batcher is not None:
+        model_pipeline.prediction_batcher.close()
+    model_pipeline.prediction_batcher = PredictionBatcher(
+        model_pipeline._score_batched, max_batch_size, max_wait_ms / 1000
+    ) if max_batch_size > 1 else None
+    return model_pipeline.prediction_batcher
+
+
+async def _run_async(users: List[dict], concurrency: int) -> List[float]:
+    latencies = []
+
+    async def one(user):
+        start = time.perf_counter()
+        await model_pipeline.apreprocess_and_predict(dict(user))
+        latencies.append(time.perf_counter() - start)
+
+    for i in range(0, len(users), concurrency):
+        await asyncio.gather(*(one(user) for user in users[i:i + concurrency]))
+    return latencies
+
+
+def _run_threads(users: List[dict], concurrency: int) -> List[float]:
+    def one(user):
+        start = time.perf_counter()
+        model_pipeline.preprocess_and_predict(dict(user))
+        return time.perf_counter() - start
+
+    latencies = []
+    with ThreadPoolExecutor(concurrency) as pool:
+        for i in range(0, len(users), concurrency):
+            latencies.extend(pool.map(one, users[i:i + concurrency]))
+    return latencies
+
+
+def run_setting(users: List[dict], concurrency: int, mode: str, max_batch_size: int, max_wait_ms: float) -> Dict:
+    _use_batcher(max_batch_size, max_wait_ms)
+    batches_before, rows_before = _batch_stats()
+    start = time.perf_counter()
+    if mode == "async":
+        latencies = asyncio.run(_run_async(users, concurrency))
+    else:
+        latencies = _run_threads(users, concurrency)
+    elapsed = time.perf_counter() - start
+    batches, rows = _batch_stats()
+    batches, rows = batches - batches_before, rows - rows_before
+    return {
+        "mode": mode,
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "predictions_per_second": len(users) / elapsed,
+        "mean_batch_size": rows / batches if batches else 1.0,
+        "latency": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent single predictions with and without batching.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Predictions started together in each burst.")
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--batch-sizes", default="1,8,32,64", help="Batcher size limits to try (1 = no batching).")
+    parser.add_argument("--wait-ms", type=float, default=2.0, help="Batcher wait limit in milliseconds.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/).")
+    args = parser.parse_args()
+
+    users = sample_users(args.concurrency * args.bursts, seed=3)
+    # Loads the model and warms the engine outside the timed runs
+    model_pipeline.preprocess_and_predict(dict(users[0]))
+
+    results = []
+    print(f"{'mode':<8}{'batch':>6}{'wait ms':>9}{'pred/s':>10}{'mean batch':>12}{'p50 ms':>9}{'p99 ms':>9}")
+    for mode in ("async", "threads"):
+        for max_batch_size in (int(size) for size in args.batch_sizes.split(",")):
+            result = run_setting(users, args.concurrency, mode, max_batch_size, args.wait_ms)
+            results.append(result)
+            latency = result["latency"]
+            print(f"{mode:<8}{max_batch_size:>6}{args.wait_ms:>9.1f}{result['predictions_per_second']:>10,.0f}"
+                  f"{result['mean_batch_size']:>12.1f}{latency['p50_ms']:>9.2f}{latency['p99_ms']:>9.2f}")
+    _use_batcher(1, 0)
+
+    path = write_results("batching", {"concurrency": args.concurrency, "bursts": args.bursts, "runs": results},
+                         args.output)
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# benchmarks/fake_gemini.py
+"""
+A local stand-in for `genai.GenerativeModel`, so the full conversation flow can
+be load-tested without spending Gemini quota.
+
+It recognises the prompts the backend sends (SYSTEM_PROMPT to phrase a
+question, PARSER_PROMPT and GROUP_PARSER_PROMPT to classify a reply,
+FINAL_RESPONSE_PROMPT for the summary), waits for a latency drawn from a per-prompt distribution, and
+answers from a template filled in with the fields of the prompt.
+
+Latencies and templates can be overridden with a JSON config file:
+
+    {
+      "seed": 0,
+      "unsure_rate": 0.05,
+      "latency": {"ask": {"distribution": "lognormal", "median_ms": 400, "sigma": 0.3}},
+      "templates": {"ask": "Quick one: {question} Does that sound like you?"},
+      "stream_chunk_words": 8,
+      "stream_chunk_ms": 30
+    }
+"""
+import asyncio
+import json
+import random
+import re
+import string
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from prompts import FINAL_RESPONSE_PROMPT, GROUP_PARSER_PROMPT, PARSER_PROMPT, SYSTEM_PROMPT
+
+PROMPTS = {
+    "ask": SYSTEM_PROMPT, "parse": PARSER_PROMPT, "parse_group": GROUP_PARSER_PROMPT, "final": FINAL_RESPONSE_PROMPT,
+}
+
+DEFAULT_TEMPLATES = {
+    # Must quote the question verbatim, like the real model is told to
+    "ask": "Here's the next one. {question} Would you say that applies to you?",
+    "parse": '```json\n{{\n  "answer": "{answer}"\n}}\n```',
+    # {answers} is the JSON object of per-question answers
+    "parse_group": '```json\n{answers}\n```',
+    "final": (
+        "Thank you so much for taking the time to answer these questions. "
+        "Based on your answers, the screening model suggests that {prediction}, "
+        "with a confidence of {confidence_score}. "
+        "Please remember that this is a screening tool, not a diagnostic tool, and the result is not a medical diagnosis. "
+        "If you have any concerns, a qualified healthcare professional such as a psychologist or psychiatrist "
+        "can carry out a formal evaluation and talk through what this means for you. "
+        "Thank you again for your openness, and take good care of yourself."
+    ),
+}
+
+DEFAULT_LATENCY = {
+    "ask": {"distribution": "lognormal", "median_ms": 450, "sigma": 0.35},
+    "parse": {"distribution": "lognormal", "median_ms": 350, "sigma": 0.35},
+    "parse_group": {"distribution": "lognormal", "median_ms": 500, "sigma": 0.35},
+    "final": {"distribution": "lognormal", "median_ms": 1800, "sigma": 0.3},
+}
+
+GROUP_QUESTION_ID = re.compile(r"\[(\w+)\]\s*$", re.MULTILINE)
+NEGATIVE_WORDS = re.compile(r"\b(no|not|never|nope|don't|dont|disagree|rarely|hardly)\b", re.IGNORECASE)
+
+
+class LatencyProfile:
+    """Draws simulated upstream latencies, in seconds."""
+
+    def __init__(self, distribution: str = "lognormal", median_ms: float = 400.0, sigma: float = 0.3,
+                 spread_ms: float = 0.0):
+        if distribution not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution!r}")
+        self.distribution = distribution
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.spread_ms = spread_ms
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "fixed":
+            ms = self.median_ms
+        elif self.distribution == "uniform":
+            ms = rng.uniform(self.median_ms - self.spread_ms, self.median_ms + self.spread_ms)
+        else:
+            ms = rng.lognormvariate(0.0, self.sigma) * self.median_ms
+        return max(ms, 0.0) / 1000
+
+
+class FakeUsage:
+    """Token counts in the shape of Gemini's `usage_metadata`, estimated at ~4 characters per token."""
+
+    def __init__(self, prompt: str, text: str):
+        self.prompt_token_count = max(1, len(prompt) // 4)
+        self.candidates_token_count = max(1, len(text) // 4)
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class FakeResponse:
+    """The part of a Gemini response the backend reads."""
+
+    def __init__(self, text: str, usage_metadata: Optional[FakeUsage] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _FakeStream:
+    def __init__(self, chunks, chunk_delay: float, usage: FakeUsage):
+        self._chunks = chunks
+        self._chunk_delay = chunk_delay
+        self._usage = usage
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self._chunks):
+            await asyncio.sleep(self._chunk_delay)
+            # Like Gemini, the last chunk carries the usage totals
+            yield FakeResponse(chunk, self._usage if i == len(self._chunks) - 1 else None)
+
+
+class _PromptMatcher:
+    """Recognises a formatted prompt template and recovers the values of its fields."""
+
+    def __init__(self, template: str):
+        pattern = []
+        for literal, field, _, _ in string.Formatter().parse(template):
+            pattern.append(re.escape(literal))
+            if field is not None:
+                pattern.append(f"(?P<{field}>.*?)")
+        self._regex = re.compile("".join(pattern) + r"\Z", re.DOTALL)
+
+    def match(self, prompt: str) -> Optional[Dict[str, str]]:
+        match = self._regex.match(prompt)
+        return match.groupdict() if match else None
+
+
+class FakeGenerativeModel:
+    """
+    Implements `generate_content` and `generate_content_async` (including
+    `stream=True`) with simulated latency and templated answers.
+    """
+
+    model_name = "fake-gemini"
+
+    def __init__(self, latency: Optional[Dict[str, dict]] = None, templates: Optional[Dict[str, str]] = None,
+                 unsure_rate: float = 0.0, stream_chunk_words: int = 8, stream_chunk_ms: float = 30.0,
+                 seed: Optional[int] = None):
+        self.latency = {kind: LatencyProfile(**{**DEFAULT_LATENCY[kind], **(latency or {}).get(kind, {})})
+                        for kind in PROMPTS}
+        self.templates = {**DEFAULT_TEMPLATES, **(templates or {})}
+        self.unsure_rate = unsure_rate
+        self.stream_chunk_words = stream_chunk_words
+        self.stream_chunk_delay = stream_chunk_ms / 1000
+        self.calls = Counter()
+        self._matchers = {kind: _PromptMatcher(template) for kind, template in PROMPTS.items()}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, path: str) -> "FakeGenerativeModel":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        if stream:
+            raise NotImplementedError("The backend only streams through generate_content_async.")
+        delay, text = self._answer(prompt)
+        time.sleep(delay)
+        return FakeResponse(text, FakeUsage(prompt, text))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        delay, text = self._answer(prompt)
+        await asyncio.sleep(delay)
+        if not stream:
+            return FakeResponse(text, FakeUsage(prompt, text))
+        words = text.split(" ")
+        size = self.stream_chunk_words
+        chunks = [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                  for i in range(0, len(words), size)]
+        return _FakeStream(chunks, self.stream_chunk_delay, FakeUsage(prompt, text))
+
+    def _answer(self, prompt: str):
+        for kind, matcher in self._matchers.items():
+            fields = matcher.match(prompt)
+            if fields is not None:
+                break
+        else:
+            kind, fields = "ask", {"question": prompt.strip().splitlines()[-1]}
+
+        with self._lock:
+            self.calls[kind] += 1
+            delay = self.latency[kind].sample(self._rng)
+            if kind == "parse":
+                fields["answer"] = self._parse_answer(fields["user_response"])
+            elif kind == "parse_group":
+                fields["answers"] = json.dumps({
+                    key: self._parse_answer(fields["user_response"])
+                    for key in GROUP_QUESTION_ID.findall(fields["questions"])
+                }, indent=2)
+        return delay, self.templates[kind].format(**fields)
+
+    def _parse_answer(self, user_response: str) -> str:
+        if self._rng.random() < self.unsure_rate:
+            return "unsure"
+        return "no" if NEGATIVE_WORDS.search(user_response) else "yes"
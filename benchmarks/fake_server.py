@@ -0,0 +1,36 @@
+# benchmarks/fake_server.py
+"""
+Runs the real FastAPI app with Gemini replaced by `FakeGenerativeModel`, so a
+load test can go through HTTP and real worker processes without spending quota:
+
+    python -m benchmarks.fake_server --port 8000
+    python -m benchmarks.load --url http://127.0.0.1:8000 --endpoint stream
+"""
+import argparse
+
+import uvicorn
+
+from benchmarks.fake_gemini import FakeGenerativeModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with a fake Gemini model.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake-config", help="JSON file with FakeGenerativeModel latencies and templates.")
+    parser.add_argument("--no-phrasing-pool", action="store_true",
+                        help="Ignore phrasing_pool.json so every question is phrased by the fake LLM.")
+    args = parser.parse_args()
+
+    import graph
+    import main as backend
+
+    backend.gateway.model = FakeGenerativeModel.from_config(args.fake_config) if args.fake_config \
+        else FakeGenerativeModel()
+    if args.no_phrasing_pool:
+        graph.phrasing_pool.clear()
+    uvicorn.run(backend.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
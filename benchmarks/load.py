@@ -0,0 +1,319 @@
+# benchmarks/load.py
+"""
+Scripted-conversation load generator for the screening API.
+
+Each simulated user starts a session and answers every question until the
+screening finishes. Many users run at once. By default the FastAPI app runs
+in this process with Gemini replaced by `FakeGenerativeModel`, so no quota is
+spent. Use `--url` to target a running server instead, for example one started
+with `python -m benchmarks.fake_server`.
+
+    python -m benchmarks.load --sessions 200 --concurrency 20 --endpoint session
+
+`--endpoint websocket` runs each screening over one `/ws` connection and
+needs `--url`, since the in-process transport only speaks HTTP.
+
+Reported per run: p50/p95/p99 latency of question turns, final turns and
+whole sessions, sessions per second, and the number of fake LLM calls. Results
+are also written to benchmarks/results/ as JSON.
+
+In-process runs share one event loop and one CPU between the client and the
+server, and the ASGI test transport buffers whole responses, so `stream`
+first-token latencies are only reported with `--url`.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+from websockets.asyncio.client import connect as ws_connect
+from websockets.exceptions import WebSocketException
+
+from benchmarks.fake_gemini import FakeGenerativeModel
+from benchmarks.results import summarize, write_results
+
+ENDPOINTS = ("turn", "session", "stream", "websocket")
+
+# Replies the local answer classifier settles on its own...
+CLEAR_REPLIES = ["yes", "no", "yeah", "nope", "definitely", "not really", "absolutely", "no way"]
+# ...and ones it hands to the LLM parser
+AMBIGUOUS_REPLIES = [
+    "I suppose that happens from time to time",
+    "depends on the day honestly, but mostly I'd say it fits",
+    "hmm, I have never really thought about it that way",
+    "my friends would probably say so",
+    "not when I'm tired, otherwise I think so",
+]
+
+ETHNICITIES = ["White-European", "Asian", "Middle Eastern", "Black", "South Asian", "Hispanic", "Others"]
+COUNTRIES = ["United States", "United Kingdom", "India", "Australia", "Canada", "New Zealand", "Others"]
+
+# Guards against a conversation that never finishes (e.g. a fake that only answers "unsure")
+MAX_TURNS_PER_SESSION = 60
+
+
+class ConversationScript:
+    """Picks the initial data and replies of each simulated user."""
+
+    def __init__(self, ambiguous_rate: float, seed: int):
+        self.ambiguous_rate = ambiguous_rate
+        self._rng = random.Random(seed)
+
+    def initial_data(self) -> dict:
+        return {
+            "age": self._rng.randint(18, 64),
+            "gender": self._rng.randint(0, 1),
+            "ethnicity": self._rng.choice(ETHNICITIES),
+            "country_of_residence": self._rng.choice(COUNTRIES),
+        }
+
+    def reply(self) -> str:
+        replies = AMBIGUOUS_REPLIES if self._rng.random() < self.ambiguous_rate else CLEAR_REPLIES
+        return self._rng.choice(replies)
+
+
+class LoadStats:
+    def __init__(self, measure_first_token: bool = True):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.completed = 0
+        self.failed = 0
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.turns: List[int] = []
+        self.degraded_turns = 0
+        # Off in-process, where the ASGI transport only hands over complete responses
+        self.measure_first_token = measure_first_token
+
+    def record(self, name: str, seconds: float):
+        self.latencies[name].append(seconds)
+
+
+async def _post_turn(client: httpx.AsyncClient, endpoint: str, payload: dict, stats: LoadStats) -> dict:
+    """Sends one turn, records its latency as a question or final turn, and returns the response body."""
+    start = time.perf_counter()
+    if endpoint == "stream":
+        body, first_token = None, None
+        async with client.stream("POST", "/turn/stream", json=payload) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif event == "done":
+                        body = json.loads(line[len("data: "):])
+                    elif event == "error":
+                        raise RuntimeError(json.loads(line[len("data: "):])["detail"])
+        if body is None:
+            raise RuntimeError("The stream ended without a done event.")
+    else:
+        path = "/session/turn" if endpoint == "session" else "/turn"
+        response = await client.post(path, json=payload)
+        response.raise_for_status()
+        body = response.json()
+        first_token = None
+
+    elapsed = time.perf_counter() - start
+    kind = "final_turn" if body["is_finished"] else "question_turn"
+    stats.degraded_turns += bool(body.get("degraded"))
+    stats.record(kind, elapsed)
+    if first_token is not None and stats.measure_first_token:
+        stats.record(f"{kind}_first_token", first_token)
+    return body
+
+
+async def _socket_turn(ws, frame: dict, stats: LoadStats) -> dict:
+    """Sends one frame over the conversation socket and records the turn like `_post_turn`."""
+    start = time.perf_counter()
+    await ws.send(json.dumps(frame))
+    first_token = None
+    while True:
+        reply = json.loads(await ws.recv())
+        if reply["type"] in ("message", "token") and first_token is None:
+            first_token = time.perf_counter() - start
+        if reply["type"] == "error":
+            raise RuntimeError(reply["detail"])
+        if reply["type"] in ("message", "done"):
+            break
+
+    elapsed = time.perf_counter() - start
+    kind = "final_turn" if reply["type"] == "done" else "question_turn"
+    stats.degraded_turns += bool(reply.get("degraded"))
+    stats.record(kind, elapsed)
+    stats.record(f"{kind}_first_token", first_token)
+    return reply
+
+
+async def _run_socket_session(base_url: str, first_turn: dict, script: ConversationScript, stats: LoadStats) -> int:
+    """Runs one screening over a single `/ws` connection and returns its number of turns."""
+    url = base_url.rstrip("/").replace("http", "ws", 1) + "/ws"
+    async with ws_connect(url) as ws:
+        await ws.send(json.dumps({"type": "start", **first_turn}))
+        if json.loads(await ws.recv())["type"] != "session":
+            raise RuntimeError("The server did not open a session.")
+        # The first question is pushed without a reply to wait on
+        start = time.perf_counter()
+        reply = json.loads(await ws.recv())
+        if reply["type"] != "message":
+            raise RuntimeError(reply.get("detail", "Unexpected first frame."))
+        stats.record("question_turn", time.perf_counter() - start)
+        turns = 1
+        while reply["type"] != "done" and turns < MAX_TURNS_PER_SESSION:
+            reply, turns = await _socket_turn(ws, {"type": "reply", "text": script.reply()}, stats), turns + 1
+    if reply["type"] != "done":
+        raise RuntimeError(f"The session did not finish within {MAX_TURNS_PER_SESSION} turns.")
+    return turns
+
+
+async def run_session(client: httpx.AsyncClient, endpoint: str, script: ConversationScript, stats: LoadStats,
+                      group_size: Optional[int] = None, early_stopping: Optional[bool] = None):
+    """Drives one user through the whole screening."""
+    start = time.perf_counter()
+    first_turn = {"initial_data": script.initial_data()}
+    if group_size:
+        first_turn["question_group_size"] = group_size
+    if early_stopping is not None:
+        first_turn["early_stopping"] = early_stopping
+    if endpoint == "websocket":
+        turns = await _run_socket_session(str(client.base_url), first_turn, script, stats)
+        stats.record("session", time.perf_counter() - start)
+        stats.turns.append(turns)
+        return
+
+    body, turns = await _post_turn(client, endpoint, first_turn, stats), 1
+    while not body["is_finished"] and turns < MAX_TURNS_PER_SESSION:
+        if endpoint == "session":
+            payload = {"session_id": body["session_id"], "user_response": script.reply(), "turn": body["turn"]}
+        else:
+            payload = {"state": body["state"], "user_response": script.reply()}
+        body, turns = await _post_turn(client, endpoint, payload, stats), turns + 1
+
+    if not body["is_finished"]:
+        raise RuntimeError(f"The session did not finish within {MAX_TURNS_PER_SESSION} turns.")
+    stats.record("session", time.perf_counter() - start)
+    stats.turns.append(turns)
+
+
+async def run_load(client: httpx.AsyncClient, endpoint: str, sessions: int, concurrency: int,
+                   script: ConversationScript, measure_first_token: bool = True,
+                   group_size: Optional[int] = None, early_stopping: Optional[bool] = None) -> dict:
+    stats = LoadStats(measure_first_token)
+    remaining = iter(range(sessions))
+
+    async def worker():
+        for _ in remaining:
+            try:
+                await run_session(client, endpoint, script, stats, group_size, early_stopping)
+                stats.completed += 1
+            except (httpx.HTTPError, WebSocketException, OSError, RuntimeError, KeyError) as e:
+                stats.failed += 1
+                stats.errors[type(e).__name__] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "endpoint": endpoint,
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "completed": stats.completed,
+        "failed": stats.failed,
+        "errors": dict(stats.errors),
+        "elapsed_seconds": elapsed,
+        "sessions_per_second": stats.completed / elapsed if elapsed else 0.0,
+        "question_group_size": group_size,
+        "early_stopping": early_stopping,
+        "turns_per_session": sum(stats.turns) / len(stats.turns) if stats.turns else 0.0,
+        "degraded_turns": stats.degraded_turns,
+        "latency": {name: summarize(values) for name, values in sorted(stats.latencies.items())},
+    }
+
+
+async def run_in_process(args, fake: FakeGenerativeModel) -> dict:
+    import graph
+    import main
+
+    main.gateway.model = fake
+    if args.no_phrasing_pool:
+        graph.phrasing_pool.clear()
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            return await run_load(client, args.endpoint, args.sessions, args.concurrency,
+                                  ConversationScript(args.ambiguous_rate, args.seed), measure_first_token=False,
+                                  group_size=args.group_size, early_stopping=args.early_stopping)
+
+
+async def run_remote(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await run_load(client, args.endpoint, args.sessions, args.concurrency,
+                              ConversationScript(args.ambiguous_rate, args.seed), group_size=args.group_size,
+                              early_stopping=args.early_stopping)
+
+
+def _print_report(results: dict):
+    print(f"{results['completed']}/{results['sessions']} sessions via /{results['endpoint']} "
+          f"at concurrency {results['concurrency']} in {results['elapsed_seconds']:.1f} s "
+          f"({results['sessions_per_second']:.2f} sessions/s)")
+    print(f"Turns per session: {results['turns_per_session']:.1f}")
+    if results.get("degraded_turns"):
+        print(f"Degraded turns (local fallbacks): {results['degraded_turns']}")
+    if results["failed"]:
+        print(f"Failed sessions: {results['failed']} {results['errors']}")
+    print(f"{'':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, summary in results["latency"].items():
+        if summary["count"]:
+            print(f"{name:<26}{summary['count']:>7}{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}"
+                  f"{summary['p99_ms']:>10.1f}{summary['max_ms']:>10.1f}")
+    if "llm_calls" in results:
+        per_session = sum(results["llm_calls"].values()) / max(results["completed"], 1)
+        print(f"Fake LLM calls: {results['llm_calls']} ({per_session:.1f} per session)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Drive full scripted screenings against the API.")
+    parser.add_argument("--sessions", type=int, default=100, help="Conversations to run in total.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once.")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="turn",
+                        help="/turn (client-held state), /session/turn, /turn/stream, or /ws (needs --url).")
+    parser.add_argument("--ambiguous-rate", type=float, default=0.3,
+                        help="Share of replies the local classifier cannot settle, so they reach the LLM parser.")
+    parser.add_argument("--group-size", type=int,
+                        help="Questions per turn (multi-question mode); default is the server's QUESTION_GROUP_SIZE.")
+    parser.add_argument("--early-stopping", action=argparse.BooleanOptionalAction,
+                        help="Ask for adaptive early stopping; default is the server's EARLY_STOPPING.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Target a running server instead of the in-process app.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout with --url.")
+    parser.add_argument("--fake-config", help="JSON file with FakeGenerativeModel latencies and templates.")
+    parser.add_argument("--no-phrasing-pool", action="store_true",
+                        help="Ignore phrasing_pool.json so every question is phrased by the (fake) LLM.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/).")
+    args = parser.parse_args(argv)
+
+    if args.endpoint == "websocket" and not args.url:
+        parser.error("--endpoint websocket needs --url")
+    if args.url:
+        results = asyncio.run(run_remote(args))
+        results["target"] = args.url
+    else:
+        fake = FakeGenerativeModel.from_config(args.fake_config) if args.fake_config else FakeGenerativeModel(seed=args.seed)
+        results = asyncio.run(run_in_process(args, fake))
+        results["target"] = "in-process"
+        results["llm_calls"] = dict(fake.calls)
+    results["ambiguous_rate"] = args.ambiguous_rate
+
+    _print_report(results)
+    print(f"Wrote {write_results('load', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/micro.py
+"""
+Micro-benchmarks for the model pipeline: feature encoding, SVM scoring and the
+end-to-end `preprocess_and_predict`, for single rows and batches. Repeating
+one user, `preprocess_and_predict` is served from the prediction cache (or the
+prediction table when saved_model/ has one); `table_lookup_one` times a lookup
+in a table built in memory.
+
+Run with:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --compare benchmarks/results/micro-<earlier run>.json
+
+Each case is timed with `timeit` in several rounds; the per-call median and
+minimum are reported and written to benchmarks/results/ as JSON.
+"""
+import argparse
+import random
+import statistics
+import timeit
+from typing import Callable, Dict, List
+
+from benchmarks.results import load_results, write_results
+from prompts import ANSWER_MAPPING, QUESTIONS
+
+ETHNICITIES = ['White-European', 'Asian', 'Middle Eastern', 'Black', 'South Asian',
+               'Hispanic', 'Latino', 'Pasifika', 'Turkish', 'Others']
+COUNTRIES = ['United States', 'United Kingdom', 'India', 'Australia', 'Canada', 'New Zealand',
+             'United Arab Emirates', 'Jordan', 'Sri Lanka', 'Malaysia', 'Netherlands', 'Ireland',
+             'Afghanistan', 'Others']
+
+
+def sample_users(count: int, seed: int = 0) -> List[dict]:
+    """Random but reproducible completed questionnaires."""
+    rng = random.Random(seed)
+    users = []
+    for _ in range(count):
+        user = {
+            'age': rng.randint(18, 64),
+            'gender': rng.randint(0, 1),
+            'ethnicity': rng.choice(ETHNICITIES),
+            'country_of_residence': rng.choice(COUNTRIES),
+            'jundice': rng.choice([0, 1, 'unsure']),
+            'austim': rng.randint(0, 1),
+        }
+        for key in QUESTIONS:
+            if key.startswith('A'):
+                user[key] = ANSWER_MAPPING[key][rng.choice(['yes', 'no'])]
+        users.append(user)
+    return users
+
+
+def build_cases(batch_size: int, include_reference: bool) -> Dict[str, Callable[[], object]]:
+    from model_pipeline import (
+        _preprocess_dataframe, encoder, engine, preprocess_and_predict, preprocess_and_predict_batch,
+    )
+    from prediction_table import build_table
+
+    user = sample_users(1)[0]
+    users = sample_users(batch_size, seed=1)
+    row = encoder.encode(encoder.prepare(dict(user))).reshape(1, -1)
+    rows = encoder.encode_records(users)
+    table = build_table(encoder, engine)
+
+    cases = {
+        "encode_one": lambda: encoder.encode(encoder.prepare(dict(user))),
+        "score_one": lambda: engine.predict_with_confidence(row),
+        "preprocess_and_predict": lambda: preprocess_and_predict(dict(user)),
+        "table_lookup_one": lambda: table.lookup(encoder.prepare(dict(user))),
+        f"encode_batch_{batch_size}": lambda: encoder.encode_records(users),
+        f"score_batch_{batch_size}": lambda: engine.predict_with_confidence(rows),
+        f"predict_batch_{batch_size}": lambda: preprocess_and_predict_batch(users),
+    }
+    if include_reference:
+        cases["pandas_reference_one"] = lambda: _preprocess_dataframe(dict(user))
+    return cases
+
+
+def time_case(fn: Callable[[], object], rounds: int) -> Dict[str, float]:
+    """Per-call timings in microseconds over `rounds` rounds of an auto-sized loop."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    per_call = [total / number * 1e6 for total in timer.repeat(repeat=rounds, number=number)]
+    return {
+        "median_us": statistics.median(per_call),
+        "min_us": min(per_call),
+        "stdev_us": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        "loops_per_round": number,
+        "rounds": rounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time feature encoding and SVM scoring.")
+    parser.add_argument("--rounds", type=int, default=7, help="Timing rounds per case.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows in the batch cases.")
+    parser.add_argument("--include-reference", action="store_true", help="Also time the slow pandas reference path.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/).")
+    parser.add_argument("--compare", help="An earlier micro-benchmark JSON file to compare against.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in build_cases(args.batch_size, args.include_reference).items():
+        results[name] = time_case(fn, args.rounds)
+        print(f"{name:<28} {results[name]['median_us']:12.2f} us/call (min {results[name]['min_us']:.2f})")
+
+    path = write_results("micro", results, args.output)
+    print(f"Wrote {path}")
+
+    if args.compare:
+        previous = load_results(args.compare)["results"]
+        print(f"\nChange against {args.compare} (median, lower is better):")
+        for name, result in results.items():
+            if name in previous:
+                ratio = result["median_us"] / previous[name]["median_us"]
+                print(f"{name:<28} {previous[name]['median_us']:12.2f} -> {result['median_us']:10.2f} us  ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
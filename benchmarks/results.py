@@ -0,0 +1,68 @@
+# benchmarks/results.py
+"""Latency summaries and the JSON result files the benchmarks write, so runs can be compared."""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(seconds: Sequence[float]) -> Dict[str, float]:
+    """Count, mean and p50/p95/p99/max of a list of durations, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1e3
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(ms.max()),
+    }
+
+
+def run_metadata() -> dict:
+    """What a result depends on besides the code: when, where and on which commit it ran."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(kind: str, results: dict, path: Optional[str] = None) -> str:
+    """
+    Writes `results` with the run metadata as JSON and returns the path. By
+    default each run gets its own timestamped file under benchmarks/results/.
+    """
+    metadata = run_metadata()
+    if path is None:
+        stamp = metadata["timestamp"].replace(":", "").replace("-", "")
+        path = os.path.join(RESULTS_DIR, f"{kind}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"kind": kind, "metadata": metadata, "results": results}, f, indent=2)
+    return path
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
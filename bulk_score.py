@@ -0,0 +1,205 @@
+# bulk_score.py
+"""
+Scores a whole questionnaire dataset from the command line.
+
+    python bulk_score.py answers.csv --output scored.csv --workers 4
+    python bulk_score.py answers.parquet --output scored.parquet --chunk-size 50000
+
+The input (CSV or Parquet) is read in chunks of `--chunk-size` rows and every
+chunk is scored in a pool of worker processes with the same preprocessing as
+the API: `encoder.encode_columns`, i.e. the `result` score, the jaundice mode
+for unsure answers, and top-75 category folding. Scored chunks are appended to
+the output in input order as soon as they are ready. Only a few chunks are in
+flight at a time, so memory stays flat however large the input is.
+
+Columns may use the names of the original dataset (`contry_of_res`,
+`A1_Score` ... `A10_Score`), and `jundice`/`austim`/`gender` may be given as
+yes/no and m/f. The output has every input column plus `prediction` and
+`confidence`.
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from prompts import QUESTIONS
+
+DEFAULT_CHUNK_SIZE = 20000
+
+# Column names used by the original dataset -> the names the pipeline expects
+COLUMN_ALIASES = {
+    'contry_of_res': 'country_of_residence',
+    **{f"{key}_Score": key for key in QUESTIONS if key.startswith('A')},
+}
+VALUE_MAPPINGS = {
+    'jundice': {'yes': 1, 'no': 0, 'unsure': 'unsure'},
+    'austim': {'yes': 1, 'no': 0},
+    'gender': {'m': 1, 'f': 0},
+}
+REQUIRED_COLUMNS = ['age', 'gender', 'ethnicity', 'country_of_residence', *QUESTIONS]
+
+
+def _format(path: str, explicit: Optional[str]) -> str:
+    if explicit:
+        return explicit
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def read_chunks(path: str, fmt: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Yields the input `chunk_size` rows at a time without reading the whole file."""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, skipinitialspace=True)
+
+
+def normalize_chunk(chunk: pd.DataFrame) -> dict:
+    """
+    Returns the chunk as pipeline columns (column name -> list), with dataset
+    aliases renamed and yes/no, m/f values mapped. A missing jaundice answer
+    counts as unsure.
+    """
+    chunk = chunk.rename(columns={alias: name for alias, name in COLUMN_ALIASES.items() if name not in chunk})
+    missing = [name for name in REQUIRED_COLUMNS if name not in chunk and name != 'jundice']
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    columns = {}
+    for name in REQUIRED_COLUMNS:
+        if name not in chunk:
+            columns[name] = ['unsure'] * len(chunk)
+            continue
+        values = chunk[name]
+        mapping = VALUE_MAPPINGS.get(name)
+        if mapping is not None and not pd.api.types.is_numeric_dtype(values):
+            values = values.map(lambda v: mapping.get(v.strip().lower(), v) if isinstance(v, str) else v)
+        if name == 'jundice':
+            values = values.where(values.notna(), 'unsure')
+        columns[name] = values.tolist()
+    return columns
+
+
+def score_chunk(chunk: pd.DataFrame):
+    """Runs in a worker: returns the predictions and confidences of one chunk."""
+    from model_pipeline import registry
+
+    version = registry.active
+    features = version.encoder.encode_columns(normalize_chunk(chunk))
+    if np.isnan(features).any():
+        bad_row = int(np.flatnonzero(np.isnan(features).any(axis=1))[0])
+        raise ValueError(f"Row {chunk.index[bad_row]} has a missing or non-numeric value.")
+    predictions, confidences = version.engine.predict_with_confidence(features)
+    return predictions.astype(np.int64), confidences.astype(np.float64)
+
+
+def _load_model():
+    import model_pipeline  # noqa: F401  (each worker loads the memory-mapped model once)
+
+
+class ResultWriter:
+    """Appends scored chunks to a CSV or Parquet file."""
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self._parquet = None
+        self._header = True
+
+    def write(self, chunk: pd.DataFrame):
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table.cast(self._parquet.schema))
+        else:
+            chunk.to_csv(self.path, mode="w" if self._header else "a", header=self._header, index=False)
+            self._header = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def score_file(input_path: str, output_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               workers: Optional[int] = None, input_format: Optional[str] = None,
+               output_format: Optional[str] = None, progress: bool = True) -> dict:
+    """
+    Scores `input_path` into `output_path` and returns the row count and
+    timings. At most two chunks per worker are read ahead of the writer.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = ResultWriter(output_path, _format(output_path, output_format))
+    chunks = read_chunks(input_path, _format(input_path, input_format), chunk_size)
+    in_flight = deque()
+    rows = 0
+    start = time.perf_counter()
+
+    def write_oldest():
+        nonlocal rows
+        chunk, future = in_flight.popleft()
+        predictions, confidences = future.result()
+        writer.write(chunk.assign(prediction=predictions, confidence=confidences))
+        rows += len(chunk)
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"\r{rows:,} rows ({rows / elapsed:,.0f} rows/s)", end="", file=sys.stderr, flush=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_model) as pool:
+            for chunk in chunks:
+                in_flight.append((chunk, pool.submit(score_chunk, chunk)))
+                if len(in_flight) >= 2 * workers:
+                    write_oldest()
+            while in_flight:
+                write_oldest()
+    finally:
+        writer.close()
+        if progress:
+            print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed else 0.0,
+        "workers": workers,
+        "chunk_size": chunk_size,
+        # ru_maxrss is in KiB on Linux; for children it is the largest single worker
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV or Parquet questionnaire dataset in chunks.")
+    parser.add_argument("input", help="CSV or Parquet file with one completed questionnaire per row.")
+    parser.add_argument("--output", required=True, help="Where to write the scored rows (CSV or Parquet).")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk.")
+    parser.add_argument("--workers", type=int, help="Scoring processes (default: one per CPU).")
+    parser.add_argument("--input-format", choices=("csv", "parquet"), help="Default: from the file extension.")
+    parser.add_argument("--output-format", choices=("csv", "parquet"), help="Default: from the file extension.")
+    parser.add_argument("--quiet", action="store_true", help="Do not print progress.")
+    args = parser.parse_args(argv)
+
+    stats = score_file(args.input, args.output, args.chunk_size, args.workers,
+                       args.input_format, args.output_format, progress=not args.quiet)
+    print(f"Scored {stats['rows']:,} rows in {stats['seconds']:.1f} s ({stats['rows_per_second']:,.0f} rows/s) "
+          f"with {stats['workers']} workers; peak RSS {stats['peak_rss_mib']:.0f} MiB "
+          f"(largest worker {stats['peak_worker_rss_mib']:.0f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+# check_pipeline.py
+"""
+Sanity checks for the fast model pipeline.
+
+Run with `python check_pipeline.py` from the repository root. It checks that the
+precompiled FeatureEncoder produces exactly the same rows as the reference pandas
+preprocessing for every category value, that batch scoring agrees with one-by-one
+scoring, that the memory-mapped model artifact scores exactly like the joblib
+files it was built from, that the early-stopping bounds match scoring every
+completion of a partial questionnaire one by one, that the precomputed
+prediction table agrees with the engine, that the single-pass SVMEngine agrees with sklearn's
+predict/predict_proba for the saved model and for every kernel it supports, that
+the local answer classifier leaves replies that turn their opener around to the
+LLM, that a profiled turn survives a graph node run on a worker thread, that
+batch scoring rejects records with missing or non-finite values, that the
+final prompt's answer summary never exceeds its token budget, that the LLM
+gateway coalesces, retries and trips its circuit breaker as documented
+(against the fake Gemini model), and times each path.
+"""
+import asyncio
+import itertools
+import random
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import model_pipeline
+from benchmarks.fake_gemini import FakeGenerativeModel
+from early_stopping import EarlyStopper
+from google.api_core.exceptions import ServiceUnavailable
+from answer_classifier import AnswerClassifier
+from answer_summary import FINAL_PROMPT_SUMMARY_TOKENS, estimate_tokens, render_answer_summary, summary_entries
+from llm_gateway import CircuitBreaker, CircuitOpenError, LLMGateway, TurnBudget, use_budget
+from model_artifact import load_joblib_model
+from prediction_batcher import PredictionBatcher
+from prediction_table import CONFIDENCE_TOLERANCE, build_table
+from model_pipeline import (
+    FeatureEncoder, SVMEngine, encoder, engine, _preprocess_dataframe, preprocess_and_predict,
+    preprocess_and_predict_batch,
+)
+from prompts import QUESTIONS, ANSWER_MAPPING
+
+# The unpickled sklearn objects, which serving no longer loads when the artifact exists
+model, reference_scaler, reference_columns, reference_data_info = load_joblib_model(model_pipeline.MODEL_DIR)
+
+# Every category the model knows about, plus the options the front end offers
+# and a value neither has ever seen.
+ETHNICITIES = sorted(set(model_pipeline.data_info['ethnicity_top_75']) | {
+    'Others', 'White-European', 'Asian', 'Middle Eastern', 'Black', 'South Asian',
+    'Hispanic', 'Latino', 'Pasifika', 'Turkish', 'Unknown',
+})
+COUNTRIES = sorted(set(model_pipeline.data_info['country_top_75']) | {
+    'Others', 'United States', 'United Kingdom', 'India', 'Australia', 'Canada',
+    'New Zealand', 'United Arab Emirates', 'Jordan', 'Sri Lanka', 'Malaysia',
+    'Netherlands', 'Ireland', 'Afghanistan', 'Atlantis',
+})
+SCORE_KEYS = [key for key in QUESTIONS if key.startswith('A')]
+# The engine reimplements sklearn's floating-point work in NumPy, so it agrees to
+# rounding error rather than bit for bit.
+ENGINE_TOLERANCE = 1e-9
+
+
+def sample_users():
+    """Yields user-data dicts covering every combination of the categorical inputs."""
+    rng = random.Random(0)
+    for ethnicity, country, jundice, austim, gender in itertools.product(
+        ETHNICITIES, COUNTRIES, [0, 1, 'unsure'], [0, 1], [0, 1]
+    ):
+        user = {
+            'age': rng.randint(18, 64),
+            'gender': gender,
+            'ethnicity': ethnicity,
+            'country_of_residence': country,
+            'jundice': jundice,
+            'austim': austim,
+        }
+        for key in SCORE_KEYS:
+            user[key] = ANSWER_MAPPING[key][rng.choice(['yes', 'no'])]
+        yield user
+
+
+def check_encoder_parity() -> int:
+    """Returns the number of users whose encoded row differs from the pandas one."""
+    mismatches = 0
+    for user in sample_users():
+        expected = _preprocess_dataframe(dict(user)).to_numpy(dtype=np.float64)[0]
+        actual = encoder.encode(encoder.prepare(dict(user)))
+        if not np.array_equal(expected, actual):
+            mismatches += 1
+            print(f"Encoder mismatch for {user}:\n  pandas:  {expected}\n  encoder: {actual}")
+    return mismatches
+
+
+def check_batch_parity() -> int:
+    """Returns the number of rows where batch scoring differs from single-row scoring."""
+    users = list(sample_users())
+    expected = [preprocess_and_predict(dict(user)) for user in users]
+    columnar = {key: [user[key] for user in users] for key in users[0]}
+    # Single predictions served from a prediction table carry float16 confidences
+    tolerance = CONFIDENCE_TOLERANCE if model_pipeline.registry.active.table is not None else ENGINE_TOLERANCE
+
+    mismatches = 0
+    for name, batch in (('records', users), ('columns', columnar)):
+        predictions, confidences = preprocess_and_predict_batch(batch)
+        for user, single, batched in zip(users, expected, zip(predictions, confidences)):
+            if single[0] != batched[0] or abs(single[1] - batched[1]) > tolerance:
+                mismatches += 1
+                print(f"Batch ({name}) mismatch for {user}: single {single}, batch {batched}")
+    return mismatches
+
+
+def check_batch_validation() -> int:
+    """
+    Returns the number of malformed batches that `preprocess_and_predict_batch`
+    scores instead of rejecting with the index of the bad record.
+    """
+    users = [dict(user) for user, _ in zip(sample_users(), range(3))]
+
+    def with_record_1(drop: str = None, **changes):
+        records = [dict(user) for user in users]
+        records[1].update(changes)
+        records[1].pop(drop, None)
+        return records
+
+    def as_columns(records):
+        return {key: [record.get(key) for record in records] for key in records[0]}
+
+    batches = {
+        "missing age": with_record_1(drop="age"),
+        "missing A3": with_record_1(drop="A3"),
+        "missing jundice": with_record_1(drop="jundice"),
+        "null austim": with_record_1(austim=None),
+        "empty gender": with_record_1(gender=''),
+        "NaN age": with_record_1(age=float('nan')),
+        "infinite A7": with_record_1(A7=float('inf')),
+        "columnar null A1": as_columns(with_record_1(A1=None)),
+        "columnar NaN age": as_columns(with_record_1(age=float('nan'))),
+    }
+    failures = 0
+    for label, records in batches.items():
+        try:
+            result = preprocess_and_predict_batch(records)
+        except Exception as e:
+            if not isinstance(e, ValueError) or "Record 1 " not in str(e):
+                failures += 1
+                print(f"Batch validation ({label}): error does not name record 1: {e}")
+            continue
+        failures += 1
+        print(f"Batch validation ({label}): scored instead of rejected: {result}")
+    return failures
+
+
+def check_artifact_parity() -> int:
+    """Returns the number of rows the serving encoder/engine score differently from the joblib files."""
+    reference_encoder = FeatureEncoder(reference_columns, reference_data_info, reference_scaler)
+    reference_engine = SVMEngine(model)
+    features = reference_encoder.encode_records(list(sample_users()))
+    noise = np.random.default_rng(1).normal(scale=3.0, size=(2000, encoder.n_features))
+
+    mismatches = int(np.sum(np.any(encoder.encode_records(list(sample_users())) != features, axis=1)))
+    for rows in (np.vstack([features, noise]), features[:1]):
+        for actual, expected in zip(engine.predict_with_confidence(rows), reference_engine.predict_with_confidence(rows)):
+            mismatches += int(np.sum(actual != expected))
+    if mismatches:
+        print(f"Artifact mismatch: {mismatches} values differ from the joblib model")
+    return mismatches
+
+
+def check_table_parity() -> int:
+    """
+    Returns the number of users the prediction table (built in memory for every
+    age in the samples) scores differently from encoding and scoring them,
+    allowing for float16 confidences, plus any cached result that differs.
+    """
+    users = list(sample_users())
+    ages = [user['age'] for user in users]
+    table = build_table(encoder, engine, min(ages), max(ages))
+    rows = encoder.encode_records(users)
+    predictions, confidences = engine.predict_with_confidence(rows)
+    mismatches = 0
+    for user, prediction, confidence in zip(users, predictions, confidences):
+        hit = table.lookup(encoder.prepare(dict(user)))
+        if hit is None or hit[0] != prediction or abs(hit[1] - confidence) > CONFIDENCE_TOLERANCE:
+            mismatches += 1
+            print(f"Table mismatch for {user}: table {hit}, engine {(prediction, confidence)}")
+
+    version = model_pipeline.registry.active
+    if version.cache is not None:
+        for user in users[:50]:
+            first, second = version.predict_one(encoder.prepare(dict(user))), version.predict_one(encoder.prepare(dict(user)))
+            if first != second:
+                mismatches += 1
+                print(f"Cached prediction differs for {user}: {first} then {second}")
+    return mismatches
+
+
+def check_early_stop_parity(n_users: int = 40) -> int:
+    """
+    Returns the number of partial questionnaires where the early stopper's
+    bounds, settled flag or worst-case confidence differ from encoding and
+    scoring every completion of the open questions one by one.
+    """
+    stopper = EarlyStopper(encoder, engine)
+    rng = random.Random(2)
+    keys = list(QUESTIONS)
+    users = list(sample_users())
+    mismatches = 0
+    for user in rng.sample(users, n_users):
+        unanswered = rng.sample(keys, rng.randint(0, 8))
+        known = {key: value for key, value in user.items() if key not in unanswered}
+        completions = [{**known, **dict(zip(unanswered, bits))}
+                       for bits in itertools.product([0, 1], repeat=len(unanswered))]
+        rows = encoder.encode_records(completions)
+        decision = engine.decision_function(rows)
+        classes, confidence = engine.predict_with_confidence(rows)
+
+        bounds = stopper.analyze(known, unanswered)
+        settled = bool(np.all(classes == classes[0]))
+        # Scored in batches of a different size, so equal up to rounding
+        expected = (decision.min(), decision.max(), confidence.min() if settled else np.nan)
+        actual = (bounds.decision_min, bounds.decision_max,
+                  bounds.min_confidence if bounds.settled else np.nan)
+        if bounds.settled != settled or not np.allclose(actual, expected, rtol=0, atol=ENGINE_TOLERANCE,
+                                                        equal_nan=True):
+            mismatches += 1
+            print(f"Early-stop mismatch for {known} with {unanswered} open:\n  expected {expected}\n  actual   {actual}")
+    return mismatches
+
+
+def check_batcher_parity(threads: int = 16) -> int:
+    """
+    Scores every sample row from many threads at once through a prediction
+    batcher and returns the number of rows whose result differs from scoring
+    the row on its own, plus one if no batch held more than one row.
+    """
+    version = model_pipeline.registry.active
+    rows = [version.encoder.encode(version.encoder.prepare(dict(user))).reshape(1, -1) for user in sample_users()]
+    batch_sizes = []
+
+    def score(items):
+        batch_sizes.append(len(items))
+        return model_pipeline._score_batched(items)
+
+    batcher = PredictionBatcher(score, max_batch_size=16, max_wait_seconds=0.005)
+    with ThreadPoolExecutor(threads) as pool:
+        batched = [result for result, _ in pool.map(lambda row: batcher.predict((version, row)), rows)]
+    batcher.close()
+
+    mismatches = 0
+    for row, result in zip(rows, batched):
+        single = version.score_rows(row)[0]
+        if single[0] != result[0] or abs(single[1] - result[1]) > ENGINE_TOLERANCE:
+            mismatches += 1
+            print(f"Batcher mismatch: single {single}, batched {result}")
+    if max(batch_sizes) < 2:
+        mismatches += 1
+        print("The batcher never scored more than one row at a time.")
+    return mismatches
+
+
+# Replies and the answer the local classifier may settle on its own (None: it
+# must escalate to the LLM). The first group open with a clear yes or no and
+# then turn it around.
+CLASSIFIER_CASES = [
+    ("yeah no", None), ("Yeah, no.", None), ("often not", None), ("right, not really", None),
+    ("yes, sadly not", None), ("no, definitely yes", None), ("I don't disagree", None),
+    ("I don't mind it", None), ("never mind, yes", None),
+    ("yes", "yes"), ("nope", "no"), ("Yes, I do that a lot", "yes"), ("No, I hate that", "no"),
+    ("no, not at all", "no"), ("Absolutely, every day", "yes"), ("I don't", "no"),
+]
+
+
+def check_answer_classifier() -> int:
+    """Returns the number of CLASSIFIER_CASES the local classifier settles differently."""
+    classifier = AnswerClassifier()
+    mismatches = 0
+    for reply, expected in CLASSIFIER_CASES:
+        answer = classifier.try_classify(reply)
+        if answer != expected:
+            mismatches += 1
+            print(f"Classifier mismatch for {reply!r}: expected {expected}, got {answer}")
+    return mismatches
+
+
+def check_profiled_worker_node() -> int:
+    """
+    Profiles a turn that runs a graph node on a worker thread, as main.py runs
+    `check_early_stop`, and returns 1 if the node fails under the profiler or
+    its section is missing from the saved profile.
+    """
+    from starlette.concurrency import run_in_threadpool
+    from graph import node_check_early_stop
+    from profiling import profile_turn
+
+    user = next(sample_users())
+    state = {
+        "initial_user_data": {key: value for key, value in user.items() if key not in SCORE_KEYS},
+        "collected_data": {key: user[key] for key in SCORE_KEYS[:4]},
+        "question_keys_to_ask": SCORE_KEYS[4:],
+    }
+
+    async def turn():
+        with profile_turn("check") as profile:
+            await run_in_threadpool(node_check_early_stop, state)
+        return profile
+
+    try:
+        profile = asyncio.run(turn())
+        with tempfile.TemporaryDirectory() as directory:
+            profile.save(directory)
+    except Exception as e:
+        print(f"Profiled worker node failed: {e!r}")
+        return 1
+    if not any(section["name"] == "check_early_stop" and section["thread"] == "worker" for section in profile.sections):
+        print(f"Profiled worker node has no worker section: {profile.sections}")
+        return 1
+    return 0
+
+
+class FlakyModel(FakeGenerativeModel):
+    """The fake Gemini model with a fixed latency, failing its first `failures` calls with a retryable error."""
+
+    def __init__(self, latency_ms: float = 50, failures: int = 0):
+        super().__init__(latency={"ask": {"distribution": "fixed", "median_ms": latency_ms}})
+        self.failures = failures
+        self.attempts = 0
+
+    def _attempt(self):
+        with self._lock:
+            self.attempts += 1
+            if self.failures:
+                self.failures -= 1
+                raise ServiceUnavailable("Injected failure")
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self._attempt()
+        return super().generate_content(prompt, stream, **kwargs)
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        self._attempt()
+        return await super().generate_content_async(prompt, stream, **kwargs)
+
+
+def _generate_in_threads(gateway: LLMGateway, prompt: str, budgets: list):
+    """Calls `generate_sync` once per budget (seconds, or None) from its own thread; returns each result or error."""
+    def call(i):
+        time.sleep(0.005 * i)  # the first caller leads the shared call
+        try:
+            if budgets[i] is None:
+                return gateway.generate_sync(prompt).text
+            with use_budget(TurnBudget(budgets[i])):
+                return gateway.generate_sync(prompt).text
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(len(budgets)) as pool:
+        return list(pool.map(call, range(len(budgets))))
+
+
+async def _generate_concurrently(gateway: LLMGateway, prompt: str, budgets: list):
+    async def call(i):
+        await asyncio.sleep(0.005 * i)
+        try:
+            if budgets[i] is None:
+                return (await gateway.generate(prompt)).text
+            with use_budget(TurnBudget(budgets[i])):
+                return (await gateway.generate(prompt)).text
+        except Exception as e:
+            return e
+
+    return await asyncio.gather(*(call(i) for i in range(len(budgets))))
+
+
+def check_llm_gateway() -> int:
+    """Returns the number of gateway behaviours (coalescing, budgets, retries, breaker) that do not hold."""
+    failures = 0
+
+    def expect(ok: bool, label: str, detail):
+        nonlocal failures
+        if not ok:
+            failures += 1
+            print(f"Gateway mismatch ({label}): {detail}")
+
+    # Identical concurrent prompts share one upstream call, on the event loop and from threads
+    model = FlakyModel()
+    results = asyncio.run(_generate_concurrently(LLMGateway(model), "Coalesced async?", [None] * 8))
+    expect(model.attempts == 1 and len(set(results)) == 1, "async coalescing", (model.attempts, results))
+    model = FlakyModel()
+    results = _generate_in_threads(LLMGateway(model), "Coalesced sync?", [None] * 8)
+    expect(model.attempts == 1 and len(set(results)) == 1, "sync coalescing", (model.attempts, results))
+
+    # The first caller's budget must not cut the shared call short for the others
+    for label, run in (("async", lambda g: asyncio.run(_generate_concurrently(g, "Budgets?", [0.02, 5]))),
+                       ("sync", lambda g: _generate_in_threads(g, "Budgets?", [0.02, 5]))):
+        model = FlakyModel(latency_ms=100)
+        first, second = run(LLMGateway(model))
+        expect(isinstance(first, Exception) and isinstance(second, str) and model.attempts == 1,
+               f"{label} budget isolation", (first, second, model.attempts))
+
+    # Retryable failures are retried up to max_retries, then raised
+    for label, generate in (("async", lambda g: asyncio.run(g.generate("Retried?"))),
+                            ("sync", lambda g: g.generate_sync("Retried?"))):
+        model = FlakyModel(latency_ms=1, failures=2)
+        gateway = LLMGateway(model, max_retries=2, backoff_seconds=0.001)
+        try:
+            generate(gateway)
+            expect(gateway.stats()["retries"] == 2 and model.attempts == 3, f"{label} retries", gateway.stats())
+        except Exception as e:
+            expect(False, f"{label} retries", repr(e))
+        model = FlakyModel(latency_ms=1, failures=5)
+        try:
+            generate(LLMGateway(model, max_retries=1, backoff_seconds=0.001))
+            expect(False, f"{label} retries exhausted", "no error raised")
+        except ServiceUnavailable:
+            expect(model.attempts == 2, f"{label} retries exhausted", model.attempts)
+
+    # The breaker opens after consecutive failures, rejects without calling, then lets a trial through
+    model = FlakyModel(latency_ms=1, failures=2)
+    gateway = LLMGateway(model, max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=0.05))
+    for _ in range(2):
+        try:
+            gateway.generate_sync("Breaker?")
+        except ServiceUnavailable:
+            pass
+    try:
+        gateway.generate_sync("Breaker?")
+        expect(False, "breaker open", "call was let through")
+    except CircuitOpenError:
+        expect(model.attempts == 2, "breaker open", model.attempts)
+    time.sleep(0.06)
+    try:
+        gateway.generate_sync("Breaker?")
+        expect(gateway.breaker.state == "closed", "breaker trial", gateway.breaker.state)
+    except Exception as e:
+        expect(False, "breaker trial", repr(e))
+    return failures
+
+
+def check_answer_summary_budget() -> int:
+    """
+    Renders the answer summary of a long-winded screening (every question,
+    each answered with a long reply) at every budget up to twice the default,
+    and returns the number of budgets it exceeds.
+    """
+    reply = "Well, it depends on the day and the situation, but if I am honest with myself then yes, mostly. " * 5
+    summary = []
+    for key in QUESTIONS:
+        summary += summary_entries([key], {key: 'yes'}, reply)
+    over = [budget for budget in range(1, 2 * FINAL_PROMPT_SUMMARY_TOKENS + 1)
+            if estimate_tokens(render_answer_summary(summary, budget)) > budget]
+    if over:
+        print(f"Answer summary over budget at {len(over)} budgets, e.g. {over[:5]}")
+    return len(over)
+
+
+def check_reload_parity() -> int:
+    """
+    Reloads the live model through the registry and returns the number of
+    validation rows the reloaded version scores differently from the original.
+    """
+    registry = model_pipeline.registry
+    original = registry.active
+    reloaded = registry.reload()
+    mismatches = 0
+    if reloaded is original or registry.active is not reloaded:
+        print("Reload did not swap in a new model version.")
+        mismatches += 1
+    if registry.last_reload["validation"]["agreement"] != 1.0:
+        print(f"Reloaded model disagrees with the original: {registry.last_reload['validation']}")
+        mismatches += 1
+    return mismatches
+
+
+@contextmanager
+def plain_rows():
+    """
+    Silences sklearn's feature-name warning while the reference model scores
+    encoded NumPy rows, which are laid out exactly as `model_columns`.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+        yield
+
+
+def _engine_mismatches(svm, svm_engine, features: np.ndarray, label: str) -> int:
+    with plain_rows():
+        expected_pred = svm.predict(features)
+        expected_conf = svm.predict_proba(features)[np.arange(len(features)), expected_pred]
+    predictions, confidences = svm_engine.predict_with_confidence(features)
+    # Single rows take the scalar coupling path, so score a slice of them one by one too.
+    for i in range(min(len(features), 50)):
+        predictions[i], confidences[i] = (v[0] for v in svm_engine.predict_with_confidence(features[i:i + 1]))
+
+    mismatches = int(np.sum(predictions != expected_pred))
+    mismatches += int(np.sum(np.abs(confidences - expected_conf) > ENGINE_TOLERANCE))
+    if mismatches:
+        print(f"Engine mismatch ({label}): {mismatches} rows differ from sklearn")
+    return mismatches
+
+
+def check_engine_parity() -> int:
+    """Returns the number of rows where SVMEngine disagrees with sklearn."""
+    from sklearn.svm import SVC
+
+    rng = np.random.default_rng(0)
+    features = encoder.encode_records(list(sample_users()))
+    noise = rng.normal(scale=3.0, size=(2000, encoder.n_features))
+    mismatches = _engine_mismatches(model, engine, np.vstack([features, noise]), 'saved model')
+
+    # Fit a small model per kernel so the linear and polynomial paths are covered too.
+    train = rng.normal(size=(300, 6))
+    labels = (train[:, 0] + train[:, 1] ** 2 > 1).astype(int)
+    for kernel in ('linear', 'rbf', 'poly', 'sigmoid'):
+        svm = SVC(kernel=kernel, probability=True, random_state=0).fit(train, labels)
+        mismatches += _engine_mismatches(svm, SVMEngine(svm), rng.normal(size=(500, 6)), kernel)
+    return mismatches
+
+
+def time_per_call(fn, user: dict, repeat: int) -> float:
+    """Returns the mean wall time of `fn(copy of user)` in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(dict(user))
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def benchmark_encoding(repeat: int = 2000):
+    user = next(sample_users())
+    pandas_us = time_per_call(_preprocess_dataframe, user, repeat // 10)
+    encoder_us = time_per_call(lambda u: encoder.encode(encoder.prepare(u)), user, repeat)
+    print(f"Encoding: pandas {pandas_us:.1f} us/call, encoder {encoder_us:.1f} us/call "
+          f"({pandas_us / encoder_us:.0f}x faster)")
+
+
+def benchmark_scoring(repeat: int = 2000, n_rows: int = 20000):
+    row = encoder.encode(encoder.prepare(next(sample_users()))).reshape(1, -1)
+    with plain_rows():
+        sklearn_us = time_per_call(lambda _: (model.predict(row), model.predict_proba(row)), {}, repeat)
+    engine_us = time_per_call(lambda _: engine.predict_with_confidence(row), {}, repeat)
+    print(f"Scoring one row: sklearn {sklearn_us:.1f} us/call, engine {engine_us:.1f} us/call "
+          f"({sklearn_us / engine_us:.1f}x faster)")
+
+    rows = np.repeat(row, n_rows, axis=0)
+    with plain_rows():
+        start = time.perf_counter()
+        model.predict(rows), model.predict_proba(rows)
+        sklearn_s = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.predict_with_confidence(rows)
+    engine_s = time.perf_counter() - start
+    print(f"Scoring {n_rows} rows: sklearn {sklearn_s * 1e3:.1f} ms, engine {engine_s * 1e3:.1f} ms "
+          f"({sklearn_s / engine_s:.1f}x faster)")
+
+
+def benchmark_batch(n_rows: int = 20000):
+    users = list(itertools.islice(itertools.cycle(sample_users()), n_rows))
+    start = time.perf_counter()
+    preprocess_and_predict_batch(users)
+    elapsed = time.perf_counter() - start
+    print(f"Batch scoring: {n_rows} rows in {elapsed:.2f} s ({n_rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    failures = 0
+    checks = (
+        ('Encoder', check_encoder_parity), ('Batch', check_batch_parity), ('Batch validation', check_batch_validation),
+        ('Artifact', check_artifact_parity), ('Table', check_table_parity), ('Early stop', check_early_stop_parity),
+        ('Engine', check_engine_parity), ('Batcher', check_batcher_parity), ('Reload', check_reload_parity),
+        ('Answer classifier', check_answer_classifier), ('Profiled worker node', check_profiled_worker_node),
+        ('Answer summary budget', check_answer_summary_budget), ('LLM gateway', check_llm_gateway),
+    )
+    for name, check in checks:
+        mismatches = check()
+        print(f"{name} parity: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+        failures += mismatches
+    benchmark_encoding()
+    benchmark_scoring()
+    benchmark_batch()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,143 @@
+# early_stopping.py
+"""
+Adaptive early stopping for the screening.
+
+Every question is a binary feature. After each stored answer, the decision
+function is evaluated over every possible completion of the unanswered
+questions, with each completion encoded exactly as the model would see it:
+the question's own column (if the model uses one), the derived `result`
+score, and scaling. If every completion gives the same class, the remaining
+questions cannot change the outcome, and the conversation can go straight to
+the prediction. Optionally the worst-case confidence must also reach
+EARLY_STOP_MIN_CONFIDENCE.
+
+There are at most 2^12 completions, but many encode to the same row (the
+answers mostly enter the model through their sum), so only the distinct rows
+are scored. The same table is used to reorder the remaining questions so the
+ones most likely to settle the outcome are asked first.
+
+Enabled per conversation with `"early_stopping": true` on the first request,
+or for every conversation with EARLY_STOPPING=1. The model is only loaded
+when the first adaptive conversation needs it.
+"""
+import functools
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from prompts import QUESTIONS
+
+EARLY_STOPPING_DEFAULT = os.getenv("EARLY_STOPPING", "0").lower() in ("1", "true", "yes", "on")
+MIN_CONFIDENCE = float(os.getenv("EARLY_STOP_MIN_CONFIDENCE", "0"))
+REORDER_QUESTIONS = os.getenv("EARLY_STOP_REORDER", "1").lower() in ("1", "true", "yes", "on")
+
+SCORE_KEYS = [key for key in QUESTIONS if key.startswith('A')]
+
+
+class CompletionBounds(NamedTuple):
+    decision_min: float
+    decision_max: float
+    settled: bool
+    # Set when settled: the class every completion agrees on, the lowest
+    # confidence among them, and the answers that produce that lowest confidence
+    prediction: Optional[int]
+    min_confidence: Optional[float]
+    worst_case_answers: Dict[str, int]
+
+
+class _Completions(NamedTuple):
+    bits: np.ndarray          # (2^k, k) answer of each unanswered question in each completion
+    decision: np.ndarray      # (2^k,) decision value of each completion
+    classes: np.ndarray       # (2^k,)
+    confidence: np.ndarray    # (2^k,)
+
+
+class EarlyStopper:
+    """Bounds the SVM decision over all completions of the unanswered questions."""
+
+    def __init__(self, encoder, engine, min_confidence: float = MIN_CONFIDENCE):
+        self.encoder = encoder
+        self.engine = engine
+        self.min_confidence = min_confidence
+
+    def analyze(self, known: dict, unanswered: List[str]) -> CompletionBounds:
+        """
+        `known` is the user data collected so far (demographics and answered
+        questions), `unanswered` the question keys still open.
+        """
+        completions = self._completions(known, unanswered)
+        decision, classes, confidence = completions.decision, completions.classes, completions.confidence
+
+        settled = bool(np.all(classes == classes[0])) and float(confidence.min()) >= self.min_confidence
+        if not settled:
+            return CompletionBounds(float(decision.min()), float(decision.max()), False, None, None, {})
+
+        worst = int(np.argmin(confidence))
+        worst_case_answers = {key: int(completions.bits[worst, j]) for j, key in enumerate(unanswered)}
+        return CompletionBounds(
+            float(decision.min()), float(decision.max()), True,
+            int(classes[0]), float(confidence[worst]), worst_case_answers,
+        )
+
+    def order_questions(self, known: dict, unanswered: List[str]) -> List[str]:
+        """
+        Orders `unanswered` so the most decisive question comes first: the one
+        with the most answers that would settle the outcome, then the one that
+        narrows the decision range the most on average. Ties keep
+        questionnaire order.
+        """
+        if len(unanswered) < 2:
+            return list(unanswered)
+        completions = self._completions(known, unanswered)
+
+        def decisiveness(j: int):
+            settled_branches, ranges = 0, []
+            for value in (0, 1):
+                branch = completions.bits[:, j] == value
+                classes = completions.classes[branch]
+                if np.all(classes == classes[0]) and completions.confidence[branch].min() >= self.min_confidence:
+                    settled_branches += 1
+                decision = completions.decision[branch]
+                ranges.append(decision.max() - decision.min())
+            return -settled_branches, float(np.mean(ranges))
+
+        order = sorted(range(len(unanswered)), key=lambda j: (decisiveness(j), j))
+        return [unanswered[j] for j in order]
+
+    def _completions(self, known: dict, unanswered: List[str]) -> _Completions:
+        encoder = self.encoder
+        user_data = {key: value for key, value in known.items() if key not in unanswered}
+        # Encoded without the open questions, so their columns (and their share of `result`) start at 0
+        base = encoder.encode(encoder.prepare(user_data), scale=False)
+
+        k = len(unanswered)
+        bits = ((np.arange(2 ** k)[:, None] >> np.arange(k)) & 1).astype(np.float64)
+        rows = np.repeat(base[None, :], 2 ** k, axis=0)
+        for j, key in enumerate(unanswered):
+            index = encoder.passthrough.get(key)
+            if index is not None:
+                rows[:, index] = bits[:, j]
+        result_index = encoder.passthrough.get('result')
+        score_columns = [j for j, key in enumerate(unanswered) if key in SCORE_KEYS]
+        if result_index is not None and score_columns:
+            rows[:, result_index] += bits[:, score_columns].sum(axis=1)
+        encoder.scale_rows(rows)
+
+        unique_rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        decision = self.engine.decision_function(unique_rows)
+        classes, confidence = self.engine.predict_with_confidence(unique_rows)
+        return _Completions(bits, decision[inverse], classes[inverse], confidence[inverse])
+
+
+def get_early_stopper() -> EarlyStopper:
+    """The stopper for the live model version; a hot-reloaded model gets a new one."""
+    from model_pipeline import registry
+
+    return _stopper_for(registry.active)
+
+
+@functools.lru_cache(maxsize=2)
+def _stopper_for(version) -> EarlyStopper:
+    return EarlyStopper(version.encoder, version.engine)
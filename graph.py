@@ -1,21 +1,28 @@
 # graph.py
-import os
 import json
-from typing import TypedDict, List
+from typing import Dict, TypedDict, List
 from dotenv import load_dotenv
 
-import google.generativeai as genai
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 
-from prompts import QUESTIONS, ANSWER_MAPPING, SYSTEM_PROMPT, PARSER_PROMPT
+from prompts import QUESTIONS, ANSWER_MAPPING, SYSTEM_PROMPT, PARSER_PROMPT, GROUP_PARSER_PROMPT
+from phrasing_pool import load_pool, pick_phrasing
+from answer_classifier import answer_classifier, classify_answer, classify_group_reply
+from answer_summary import summary_entries
+from llm_gateway import DEGRADABLE_ERRORS, gateway, mark_degraded
+from metrics import PARSED_ANSWERS, timed_node
 
 load_dotenv()
 
 # --- LLM and State Definition ---
-# Configure the Gemini API
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-llm = genai.GenerativeModel('gemini-2.5-flash-lite-preview-06-17')
+# All Gemini calls go through the shared gateway (see llm_gateway.py). When a
+# call cannot be made in time (turn budget spent, circuit open, upstream
+# failing), each node falls back to a local answer and marks the turn degraded:
+# the raw question text, the answer lexicon, or a templated summary (main.py).
+
+# Pre-generated question phrasings (see phrasing_pool.py); stale keys are left out.
+phrasing_pool = load_pool()
 
 class GraphState(TypedDict):
     initial_user_data: dict
@@ -27,33 +34,68 @@ class GraphState(TypedDict):
     final_prediction: int
     prediction_confidence: float # New field for confidence
     conversation_history: List[str]
+    # One entry per stored answer (key, yes/no, short quote), for the final summary prompt
+    answer_summary: List[Dict[str, str]]
+    # Multi-question mode: the questions presented together this turn and their parsed answers
+    question_group_size: int
+    current_question_keys: List[str]
+    parsed_answers: Dict[str, str]
+    # Adaptive mode: stop once the remaining answers cannot change the prediction
+    early_stopping: bool
+    assumed_answers: Dict[str, int]
 
 
 # --- Graph Nodes ---
 
+def phrase_question(key: str) -> str:
+    """Returns a conversational phrasing of the question for `key`."""
+    # Use a pre-generated phrasing when the pool has a fresh one for this key
+    phrasing = pick_phrasing(phrasing_pool, key)
+    if phrasing is None:
+        prompt = SYSTEM_PROMPT.format(question=QUESTIONS[key])
+        try:
+            phrasing = gateway.generate_sync(prompt, purpose="ask_question", question_key=key).text
+        except DEGRADABLE_ERRORS as e:
+            mark_degraded("ask_question", e)
+            phrasing = QUESTIONS[key]
+    return phrasing
+
+
+async def aphrase_question(key: str) -> str:
+    """Async version of `phrase_question`."""
+    phrasing = pick_phrasing(phrasing_pool, key)
+    if phrasing is None:
+        prompt = SYSTEM_PROMPT.format(question=QUESTIONS[key])
+        try:
+            phrasing = (await gateway.generate(prompt, purpose="ask_question", question_key=key)).text
+        except DEGRADABLE_ERRORS as e:
+            mark_degraded("ask_question", e)
+            phrasing = QUESTIONS[key]
+    return phrasing
+
+
+@timed_node("ask_question")
 def node_ask_question(state: GraphState):
     """This node's ONLY job is to ask the next question."""
-    key = state['current_question_key']
-    question_text = QUESTIONS[key]
+    ai_message = phrase_question(state['current_question_key'])
+    return {"conversation_history": state['conversation_history'] + [f"AI: {ai_message}"]}
 
-    prompt = SYSTEM_PROMPT.format(question=question_text)
-    response = llm.generate_content(prompt)
 
-    return {"conversation_history": state['conversation_history'] + [f"AI: {response.text}"]}
+@timed_node("ask_question")
+async def anode_ask_question(state: GraphState):
+    """Async version of `node_ask_question`."""
+    ai_message = await aphrase_question(state['current_question_key'])
+    return {"conversation_history": state['conversation_history'] + [f"AI: {ai_message}"]}
 
 
-def node_parse_response(state: GraphState):
-    """Parses the user's latest response to determine if it's yes/no/unsure."""
-    key = state['current_question_key']
-    question_text = QUESTIONS[key]
-    user_response = state['user_response']
-
-    prompt = PARSER_PROMPT.format(
-        question=question_text, user_response=user_response
+def _parser_prompt(state: GraphState) -> str:
+    return PARSER_PROMPT.format(
+        question=QUESTIONS[state['current_question_key']], user_response=state['user_response']
     )
 
-    response = llm.generate_content(prompt)
 
+def _read_parsed_answer(response) -> str:
+    """Extracts yes/no/unsure from the parser LLM's fenced JSON reply."""
     try:
         cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
         parsed_json = json.loads(cleaned_response)
@@ -65,9 +107,55 @@ def node_parse_response(state: GraphState):
     except (json.JSONDecodeError, AttributeError):
         parsed_answer = "unsure"
 
-    return {"parsed_answer": parsed_answer}
+    return parsed_answer
+
 
+def _parsed(state: GraphState, answer: str, parser: str) -> dict:
+    PARSED_ANSWERS.inc(question_key=state['current_question_key'], answer=answer, parser=parser)
+    return {"parsed_answer": answer}
+
+
+def _parsed_locally(state: GraphState, error: BaseException) -> dict:
+    """Degraded parse: the lexicon's best reading, however hedged; no reading means unsure."""
+    mark_degraded("parse_response", error)
+    answer, _ = classify_answer(state['user_response'])
+    return _parsed(state, answer, "fallback")
+
+
+@timed_node("parse_response")
+def node_parse_response(state: GraphState):
+    """Parses the user's latest response to determine if it's yes/no/unsure."""
+    # Clear-cut replies ("yes", "nope", ...) are handled locally without the LLM
+    local_answer = answer_classifier.try_classify(state['user_response'])
+    if local_answer is not None:
+        return _parsed(state, local_answer, "local")
+
+    try:
+        response = gateway.generate_sync(
+            _parser_prompt(state), purpose="parse_response", question_key=state['current_question_key']
+        )
+    except DEGRADABLE_ERRORS as e:
+        return _parsed_locally(state, e)
+    return _parsed(state, _read_parsed_answer(response), "llm")
 
+
+@timed_node("parse_response")
+async def anode_parse_response(state: GraphState):
+    """Async version of `node_parse_response`."""
+    local_answer = answer_classifier.try_classify(state['user_response'])
+    if local_answer is not None:
+        return _parsed(state, local_answer, "local")
+
+    try:
+        response = await gateway.generate(
+            _parser_prompt(state), purpose="parse_response", question_key=state['current_question_key']
+        )
+    except DEGRADABLE_ERRORS as e:
+        return _parsed_locally(state, e)
+    return _parsed(state, _read_parsed_answer(response), "llm")
+
+
+@timed_node("store_answer")
 def node_store_answer(state: GraphState):
     """Stores the parsed answer and updates the list of questions to ask."""
     key = state['current_question_key']
@@ -78,14 +166,19 @@ def node_store_answer(state: GraphState):
 
     remaining_keys = state['question_keys_to_ask'][1:]
     next_question_key = remaining_keys[0] if remaining_keys else None
+    answer_summary = state.get('answer_summary', []) + summary_entries(
+        [key], {key: parsed_answer}, state.get('user_response', '')
+    )
 
     return {
         "collected_data": state['collected_data'],
         "question_keys_to_ask": remaining_keys,
-        "current_question_key": next_question_key
+        "current_question_key": next_question_key,
+        "answer_summary": answer_summary,
     }
 
 
+@timed_node("handle_unsure")
 def node_handle_unsure(state: GraphState):
     """Handles an 'unsure' response by preparing to re-ask the question."""
     ai_message = "I see. Let's try that one again just to be sure."
@@ -93,19 +186,190 @@ def node_handle_unsure(state: GraphState):
     return {"conversation_history": state['conversation_history'] + [f"AI: {ai_message}"]}
 
 
+def _final_user_data(state: GraphState) -> dict:
+    # Questions skipped by early stopping are filled with their least favourable answers
+    final_data = {**state['initial_user_data'], **state.get('assumed_answers', {}), **state['collected_data']}
+
+    if 'jundice' not in final_data:
+        final_data['jundice'] = 'unsure'
+    return final_data
+
+
+@timed_node("make_prediction")
 def node_make_prediction(state: GraphState):
     """Prepares the final data and calls the SVM model pipeline."""
     from model_pipeline import preprocess_and_predict
 
-    final_data = {**state['initial_user_data'], **state['collected_data']}
+    prediction, confidence = preprocess_and_predict(_final_user_data(state))
+    return {"final_prediction": prediction, "prediction_confidence": confidence}
+
 
-    if 'jundice' not in final_data:
-        final_data['jundice'] = 'unsure'
+@timed_node("make_prediction")
+async def anode_make_prediction(state: GraphState):
+    """Async version of `node_make_prediction`: waits for the prediction batcher without holding a thread."""
+    from model_pipeline import apreprocess_and_predict
 
-    prediction, confidence = preprocess_and_predict(final_data)
+    prediction, confidence = await apreprocess_and_predict(_final_user_data(state))
     return {"final_prediction": prediction, "prediction_confidence": confidence}
 
 
+# --- Multi-Question Nodes ---
+# With question_group_size > 1, several questions are presented in one message
+# and all of their answers are read from the reply with a single parser call.
+
+GROUP_INTRO = ("Please tell me whether each of these applies to you. You can answer in your own words, "
+               "for example \"yes to 1 and 3, no to the others\".")
+GROUP_REASK_INTRO = "Thanks! I wasn't sure about your answer to some of these, so let's go over them again."
+
+
+def next_question_group(keys_to_ask: List[str], group_size: int) -> List[str]:
+    """The next questions to present together, in questionnaire order."""
+    return keys_to_ask[:max(group_size, 1)]
+
+
+def group_message(keys: List[str], reask: bool = False) -> str:
+    """Presents a group of questions verbatim as one numbered message, without an LLM call."""
+    lines = [GROUP_REASK_INTRO if reask else GROUP_INTRO]
+    lines += [f"{i}. {QUESTIONS[key]}" for i, key in enumerate(keys, start=1)]
+    return "\n".join(lines)
+
+
+@timed_node("ask_question_group")
+def node_ask_question_group(state: GraphState):
+    """Asks every question in `current_question_keys` in one message."""
+    keys = state['current_question_keys']
+    reask = any(state.get('parsed_answers', {}).get(key) == 'unsure' for key in keys)
+    ai_message = group_message(keys, reask=reask)
+    return {"conversation_history": state['conversation_history'] + [f"AI: {ai_message}"]}
+
+
+def _group_parser_prompt(state: GraphState) -> str:
+    questions = "\n".join(
+        f"{i}. {QUESTIONS[key]} [{key}]" for i, key in enumerate(state['current_question_keys'], start=1)
+    )
+    return GROUP_PARSER_PROMPT.format(questions=questions, user_response=state['user_response'])
+
+
+def _read_parsed_answers(response, keys: List[str]) -> Dict[str, str]:
+    """Extracts a yes/no/unsure answer per key from the group parser's JSON reply; missing keys are unsure."""
+    try:
+        cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
+        parsed_json = json.loads(cleaned_response)
+    except (json.JSONDecodeError, AttributeError, ValueError):
+        parsed_json = {}
+    if not isinstance(parsed_json, dict):
+        parsed_json = {}
+
+    answers = {}
+    for key in keys:
+        answer = str(parsed_json.get(key, "unsure")).lower()
+        answers[key] = answer if answer in ("yes", "no") else "unsure"
+        PARSED_ANSWERS.inc(question_key=key, answer=answers[key], parser="llm_group")
+    return answers
+
+
+def _group_parsed_locally(state: GraphState, error: BaseException) -> dict:
+    """Degraded group parse: numbered answers read with the lexicon."""
+    mark_degraded("parse_group_response", error)
+    keys = state['current_question_keys']
+    answers = dict(zip(keys, classify_group_reply(state['user_response'], len(keys))))
+    for key, answer in answers.items():
+        PARSED_ANSWERS.inc(question_key=key, answer=answer, parser="fallback")
+    return {"parsed_answers": answers}
+
+
+@timed_node("parse_group_response")
+def node_parse_group_response(state: GraphState):
+    """Parses the answers to every question of the current group with one LLM call."""
+    try:
+        response = gateway.generate_sync(
+            _group_parser_prompt(state), purpose="parse_group_response", question_key=state['current_question_key']
+        )
+    except DEGRADABLE_ERRORS as e:
+        return _group_parsed_locally(state, e)
+    return {"parsed_answers": _read_parsed_answers(response, state['current_question_keys'])}
+
+
+@timed_node("parse_group_response")
+async def anode_parse_group_response(state: GraphState):
+    """Async version of `node_parse_group_response`."""
+    try:
+        response = await gateway.generate(
+            _group_parser_prompt(state), purpose="parse_group_response", question_key=state['current_question_key']
+        )
+    except DEGRADABLE_ERRORS as e:
+        return _group_parsed_locally(state, e)
+    return {"parsed_answers": _read_parsed_answers(response, state['current_question_keys'])}
+
+
+@timed_node("store_group_answers")
+def node_store_group_answers(state: GraphState):
+    """
+    Stores the group's yes/no answers. Only the questions that came back unsure
+    are asked again; once there are none, the next group is presented.
+    """
+    answers = state['parsed_answers']
+    collected_data = state['collected_data']
+    for key in state['current_question_keys']:
+        if answers.get(key, 'unsure') != 'unsure':
+            collected_data[key] = ANSWER_MAPPING[key][answers[key]]
+
+    remaining_keys = [key for key in state['question_keys_to_ask'] if key not in collected_data]
+    unsure_keys = [key for key in state['current_question_keys'] if key not in collected_data]
+    group = unsure_keys or next_question_group(remaining_keys, state['question_group_size'])
+    answer_summary = state.get('answer_summary', []) + summary_entries(
+        state['current_question_keys'], answers, state.get('user_response', '')
+    )
+
+    return {
+        "answer_summary": answer_summary,
+        "collected_data": collected_data,
+        "question_keys_to_ask": remaining_keys,
+        "current_question_keys": group,
+        "current_question_key": group[0] if group else None,
+    }
+
+
+# --- Adaptive Early Stopping ---
+# See early_stopping.py. Runs after the answer (or group of answers) is stored.
+
+@timed_node("check_early_stop")
+def node_check_early_stop(state: GraphState):
+    """
+    Ends the questioning when no completion of the unanswered questions can
+    change the predicted class; otherwise moves the most decisive remaining
+    question to the front. A group whose unsure answers are being re-asked is
+    kept as it is.
+    """
+    from early_stopping import REORDER_QUESTIONS, get_early_stopper
+
+    early_stopper = get_early_stopper()
+    remaining_keys = state['question_keys_to_ask']
+    if not remaining_keys:
+        return {}
+    known = {**state['initial_user_data'], **state['collected_data']}
+    bounds = early_stopper.analyze(known, remaining_keys)
+    if bounds.settled:
+        return {
+            "question_keys_to_ask": [],
+            "current_question_key": None,
+            "current_question_keys": [],
+            "assumed_answers": bounds.worst_case_answers,
+        }
+    if not REORDER_QUESTIONS:
+        return {}
+
+    group_size = state.get('question_group_size', 1)
+    current_group = state.get('current_question_keys') or []
+    if group_size > 1 and any(state.get('parsed_answers', {}).get(key) == 'unsure' for key in current_group):
+        return {}
+    ordered_keys = early_stopper.order_questions(known, remaining_keys)
+    update = {"question_keys_to_ask": ordered_keys, "current_question_key": ordered_keys[0]}
+    if group_size > 1:
+        update["current_question_keys"] = next_question_group(ordered_keys, group_size)
+    return update
+
+
 # --- Conditional Edges ---
 
 def edge_decide_after_parse(state: GraphState):
@@ -122,7 +386,9 @@ def create_graph():
 
     # We now have two distinct graphs that we will call from main.py
     # Graph 1: Process a user's response
-    workflow.add_node("parse_response", node_parse_response)
+    # The LLM-bound nodes, and make_prediction (which may wait on the prediction
+    # batcher), carry an async implementation for `ainvoke`
+    workflow.add_node("parse_response", RunnableLambda(node_parse_response, afunc=anode_parse_response))
     workflow.add_node("store_answer", node_store_answer)
     workflow.add_node("handle_unsure", node_handle_unsure)
 
@@ -139,8 +405,20 @@ def create_graph():
 
     # Graph 2: Ask a question (and maybe predict)
     # This part is now mostly handled in main.py, but we keep the nodes.
-    workflow.add_node("ask_question", node_ask_question)
-    workflow.add_node("make_prediction", node_make_prediction)
+    workflow.add_node("ask_question", RunnableLambda(node_ask_question, afunc=anode_ask_question))
+    workflow.add_node("make_prediction", RunnableLambda(node_make_prediction, afunc=anode_make_prediction))
+
+    # Multi-question mode, driven from main.py in the same way
+    workflow.add_node(
+        "parse_group_response", RunnableLambda(node_parse_group_response, afunc=anode_parse_group_response)
+    )
+    workflow.add_node("store_group_answers", node_store_group_answers)
+    workflow.add_node("ask_question_group", node_ask_question_group)
+    workflow.add_edge("parse_group_response", "store_group_answers")
+    workflow.add_edge("store_group_answers", END)
+    workflow.add_edge("ask_question_group", END)
+    workflow.add_node("check_early_stop", node_check_early_stop)
+    workflow.add_edge("check_early_stop", END)
     workflow.add_edge("ask_question", END)
     workflow.add_edge("make_prediction", END)
 
@@ -0,0 +1,124 @@
+# idempotency.py
+"""
+Deduplication of retried turns.
+
+A client or proxy that retries a turn after a timeout would otherwise run the
+turn again: new LLM calls, and in session mode a second answer stored for the
+next question. Each turn therefore has an idempotency key, sent by the client
+as an `Idempotency-Key` header or derived by main.py from the request. The
+first request with a key runs the turn; a retry with the same key either waits
+for that run to finish or, once it has, gets its stored result back without
+running anything.
+
+Results are kept for IDEMPOTENCY_TTL_SECONDS after they complete, and at most
+IDEMPOTENCY_MAX_ENTRIES keys are remembered (oldest dropped first). A key is
+bound to the request it was first used with: reusing it for a different
+request raises `IdempotencyConflict`. A run that fails is forgotten, so its
+retry runs the turn again.
+
+The cache lives in one worker's event loop and is not thread-safe. With
+several uvicorn workers, a retry that reaches another worker is not
+deduplicated.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "2048"))
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyEntry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.future = future
+        # Set once the result is stored; in-flight entries do not expire
+        self.expires_at: Optional[float] = None
+
+
+class IdempotencyCache:
+    """In-flight and completed turns by idempotency key, bounded in size and age."""
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(max_entries, 1)
+        self._entries: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        """
+        The entry for `key` and whether the caller owns it. The owner runs the
+        turn and must `complete` or `fail` the entry; anyone else `wait`s on it.
+        """
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            return entry, False
+        entry = self._entries[key] = IdempotencyEntry(fingerprint, asyncio.get_running_loop().create_future())
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry, True
+
+    def complete(self, key: str, entry: IdempotencyEntry, result: Any):
+        if not entry.future.done():
+            entry.future.set_result(result)
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+
+    def fail(self, key: str, entry: IdempotencyEntry):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        # Waiting retries see the cancellation and run the turn themselves
+        entry.future.cancel()
+
+    async def wait(self, entry: IdempotencyEntry) -> Tuple[bool, Any]:
+        """Waits for an in-flight turn: (True, its result), or (False, None) if it failed."""
+        await asyncio.wait({entry.future})
+        if entry.future.cancelled():
+            return False, None
+        return True, entry.future.result()
+
+    async def run(self, key: str, fingerprint: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """
+        The result of the turn under `key`, running `compute` only if no run
+        of it is stored or in flight. Also returns where the result came from:
+        "new", "completed" (stored) or "in_flight" (waited for).
+        """
+        while True:
+            entry, owner = self.claim(key, fingerprint)
+            if owner:
+                break
+            in_flight = not entry.future.done()
+            done, result = await self.wait(entry)
+            if done:
+                return result, "in_flight" if in_flight else "completed"
+
+        try:
+            result = await compute()
+        except BaseException:
+            self.fail(key, entry)
+            raise
+        self.complete(key, entry, result)
+        return result, "new"
+
+    def _expire(self):
+        # Entries are in the order their turns started, which is close enough to
+        # the order they expire in; a turn still in flight at the front only
+        # delays the expiry of the ones behind it
+        now = time.monotonic()
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry.expires_at is None or entry.expires_at > now:
+                break
+            self._entries.popitem(last=False)
@@ -0,0 +1,603 @@
+# llm_gateway.py
+"""
+The single entry point for every Gemini call made by the backend.
+
+Gemini used to be reached through separately configured module-level
+`GenerativeModel` objects, none of which had a timeout, retry or concurrency
+bound, so one slow upstream could stall every worker. The gateway wraps one
+model and adds:
+
+- a bound on concurrent upstream calls,
+- a deadline per attempt and jittered exponential-backoff retries,
+- single-flight coalescing of identical in-flight prompts,
+- an optional content-addressed response cache with TTL/LRU eviction,
+- per-call metrics (see metrics.py), tagged with the caller's `purpose` and
+  `question_key`,
+- a circuit breaker that stops calling an upstream that keeps failing,
+- an optional per-turn latency budget (`TurnBudget`) shared by every call made
+  while it is active. No caller waits past it. A `generate` or
+  `generate_sync` call may be shared by several turns, so it runs to the
+  gateway's own deadline and each turn stops waiting at its own; for streams
+  no retry is started that cannot finish inside the budget. When the budget
+  or the breaker rules a call out, `LLMUnavailable` is raised, and callers
+  fall back to a local answer (see `DEGRADABLE_ERRORS`).
+
+Any object with Gemini's `generate_content` / `generate_content_async`
+methods can be wrapped, which is how the gateway is exercised with a local
+fake model instead of the real API. The real Gemini model is only built (and
+`google.generativeai`, a slow import, only loaded) on first use.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
+
+from metrics import (
+    DEGRADED_STEPS, LLM_CACHE_HITS, LLM_CIRCUIT_REJECTED, LLM_CIRCUIT_TRANSITIONS, LLM_COALESCED, LLM_DURATION,
+    LLM_FIRST_CHUNK, LLM_PROMPT_CHARS, LLM_RESPONSE_CHARS, LLM_RETRIES, LLM_UPSTREAM_ATTEMPTS,
+    record_response_usage, record_token_usage,
+)
+
+load_dotenv()
+
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite-preview-06-17")
+
+# Upstream failures worth another attempt; anything else (bad request, auth,
+# safety block) fails straight away.
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    concurrent.futures.TimeoutError,
+    ConnectionError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.TooManyRequests,
+)
+
+
+class LLMUnavailable(Exception):
+    """The call was not made: the turn's budget is spent or the circuit is open."""
+
+    reason = "unavailable"
+
+
+class BudgetExhausted(LLMUnavailable):
+    reason = "budget"
+
+
+class CircuitOpenError(LLMUnavailable):
+    reason = "circuit_open"
+
+
+# Errors a caller can answer with a local fallback instead of failing the turn
+DEGRADABLE_ERRORS = RETRYABLE_ERRORS + (LLMUnavailable,)
+
+
+def degraded_reason(error: BaseException) -> str:
+    if isinstance(error, LLMUnavailable):
+        return error.reason
+    if isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError)):
+        return "timeout"
+    return "upstream_error"
+
+
+class TurnBudget:
+    """
+    The time left for the LLM calls of one turn, and the steps of the turn
+    that fell back to a local answer. Activate it with `use_budget`; a budget
+    of 0 seconds means no limit.
+    """
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds if seconds > 0 else None
+        self.degraded_steps: List[str] = []
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def mark_degraded(self, step: str, reason: str):
+        if step not in self.degraded_steps:
+            self.degraded_steps.append(step)
+        DEGRADED_STEPS.inc(step=step, reason=reason)
+
+
+_current_budget: ContextVar[Optional[TurnBudget]] = ContextVar("llm_turn_budget", default=None)
+
+
+@contextmanager
+def use_budget(budget: TurnBudget):
+    """Makes `budget` apply to every gateway call in this context, including tasks and threads started from it."""
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def current_budget() -> Optional[TurnBudget]:
+    return _current_budget.get()
+
+
+def mark_degraded(step: str, error: BaseException):
+    """Records that `step` answered locally because of `error`."""
+    budget = current_budget()
+    if budget is not None:
+        budget.mark_degraded(step, degraded_reason(error))
+    else:
+        DEGRADED_STEPS.inc(step=step, reason=degraded_reason(error))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and rejects
+    calls for `reset_seconds`. After that one trial call is let through: if it
+    succeeds the circuit closes again, otherwise it stays open for another
+    `reset_seconds`. A trial that never reports back (e.g. it was cancelled)
+    is replaced by a new one after `reset_seconds`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._transition("half_open")
+            now = time.monotonic()
+            if self.state == "half_open" and (
+                self._trial_started is None or now - self._trial_started >= self.reset_seconds
+            ):
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_started = None
+            if self.state != "closed":
+                self._transition("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started = None
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition("open")
+
+    def _transition(self, state: str):
+        self.state = state
+        LLM_CIRCUIT_TRANSITIONS.inc(state=state)
+
+
+class _ResponseCache:
+    """Content-addressed LRU of LLM responses with a TTL."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class _LoopState:
+    """Async primitives are bound to an event loop, so each loop gets its own."""
+
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.inflight: Dict[str, asyncio.Task] = {}
+        # Callers still waiting on each in-flight call
+        self.waiters: Dict[asyncio.Task, int] = {}
+
+
+class LLMGateway:
+    """Bounded, deadline-aware, retrying and coalescing front for one LLM model."""
+
+    def __init__(
+        self,
+        model=None,
+        model_factory: Optional[Callable[[], object]] = None,
+        model_name: Optional[str] = None,
+        max_concurrency: int = 8,
+        timeout_seconds: float = 30.0,
+        max_retries: int = 2,
+        backoff_seconds: float = 0.5,
+        cache_ttl_seconds: float = 0.0,
+        cache_max_entries: int = 1024,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        if model is None and model_factory is None:
+            raise ValueError("Either a model or a model_factory is required.")
+        self._model = model
+        self._model_factory = model_factory
+        self._model_lock = threading.Lock()
+        # Part of the cache key, so cached responses never leak across models
+        self.model_name = model_name or getattr(model, "model_name", None) or type(model).__name__
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.cache = _ResponseCache(cache_ttl_seconds, cache_max_entries) if cache_ttl_seconds > 0 else None
+        self.breaker = breaker or CircuitBreaker(failure_threshold=0)
+
+        self._loop_states = weakref.WeakKeyDictionary()
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._sync_inflight: Dict[str, concurrent.futures.Future] = {}
+        self._sync_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        # Runs the retry loop of each shared blocking call; its attempts go to `_executor`
+        self._sync_calls = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency,
+                                                                 thread_name_prefix="llm-call")
+
+        self._counters_lock = threading.Lock()
+        self._counters = {"calls": 0, "upstream_attempts": 0, "retries": 0, "timeouts": 0,
+                          "failures": 0, "cache_hits": 0, "coalesced": 0, "circuit_rejected": 0}
+
+    # --- Public API ---
+
+    @property
+    def model(self):
+        """The wrapped model, built by `model_factory` the first time it is needed."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._model_factory()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    async def generate(self, prompt: str, *, cache: bool = True, purpose: str = "other",
+                       question_key: str = "", **kwargs):
+        """
+        Returns the model's response to `prompt`. Identical concurrent prompts
+        share one upstream call, and with the cache enabled repeated prompts are
+        answered locally. Pass `cache=False` for calls that need a fresh sample.
+        `purpose` and `question_key` only tag the call's metrics.
+        """
+        labels = {"purpose": purpose, "question_key": question_key}
+        start, outcome = time.perf_counter(), "error"
+        try:
+            response = await self._generate(prompt, kwargs, cache, labels)
+            outcome = "ok"
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_DURATION.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+    async def stream(self, prompt: str, *, purpose: str = "other", question_key: str = "",
+                     **kwargs) -> AsyncIterator[str]:
+        """
+        Yields the response text chunk by chunk. The deadline applies to each
+        chunk, and the call is only retried if it fails before the first one.
+        The turn's budget only limits the wait for the first chunk, so a
+        summary that has started is allowed to finish. Streams are never
+        coalesced or cached.
+        """
+        self._count("calls")
+        labels = {"purpose": purpose, "question_key": question_key}
+        start, outcome = time.perf_counter(), "error"
+        try:
+            async with self._loop_state().semaphore:
+                for attempt in range(self.max_retries + 1):
+                    started = False
+                    try:
+                        self._start_attempt(prompt, labels)
+                        response = await asyncio.wait_for(
+                            self.model.generate_content_async(prompt, stream=True, **kwargs), self._attempt_timeout()
+                        )
+                        chunks = response.__aiter__()
+                        response_chars, usage = 0, None
+                        while True:
+                            try:
+                                timeout = self.timeout_seconds if started else self._attempt_timeout()
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                            except StopAsyncIteration:
+                                break
+                            # Gemini reports the running token usage on the chunks; the last one has the totals
+                            usage = getattr(chunk, "usage_metadata", None) or usage
+                            try:
+                                text = chunk.text
+                            except ValueError:
+                                # A chunk without text parts, e.g. one that only carries the finish reason
+                                continue
+                            if text:
+                                if not started:
+                                    LLM_FIRST_CHUNK.observe(time.perf_counter() - start, **labels)
+                                started = True
+                                response_chars += len(text)
+                                yield text
+                        LLM_RESPONSE_CHARS.observe(response_chars, **labels)
+                        record_token_usage(usage, **labels)
+                        self.breaker.record_success()
+                        outcome = "ok"
+                        return
+                    except RETRYABLE_ERRORS as e:
+                        self.breaker.record_failure()
+                        backoff = self._backoff(attempt)
+                        if started or not self._should_retry(e, attempt, labels, backoff):
+                            raise
+                        await asyncio.sleep(backoff)
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_DURATION.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+    def generate_sync(self, prompt: str, *, cache: bool = True, purpose: str = "other",
+                      question_key: str = "", **kwargs):
+        """Blocking version of `generate`, for code that does not run on an event loop."""
+        labels = {"purpose": purpose, "question_key": question_key}
+        start, outcome = time.perf_counter(), "error"
+        try:
+            response = self._generate_sync(prompt, kwargs, cache, labels)
+            outcome = "ok"
+            return response
+        finally:
+            LLM_DURATION.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+    def stats(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return {**self._counters, "circuit_state": self.breaker.state}
+
+    # --- Internals ---
+
+    async def _generate(self, prompt: str, kwargs: dict, cache: bool, labels: dict):
+        self._count("calls")
+        key = self._cache_key(prompt, kwargs)
+        cached = self._cached(key, cache, labels)
+        if cached is not None:
+            return cached
+
+        budget = current_budget()
+        remaining = budget.remaining() if budget is not None else None
+        if remaining is not None and remaining <= 0:
+            raise BudgetExhausted("The turn's LLM budget is spent.")
+
+        state = self._loop_state()
+        task = state.inflight.get(key)
+        if task is None:
+            # The call is shared by every caller of the prompt, so it runs in an
+            # empty context: no caller's budget applies to it, only the gateway's
+            # own deadline and retries, and each caller bounds its own wait below
+            task = contextvars.Context().run(
+                asyncio.ensure_future, self._generate_with_retries(prompt, kwargs, key, cache, labels)
+            )
+            state.inflight[key] = task
+            task.add_done_callback(lambda _: state.inflight.pop(key, None))
+            # Every waiter may have given up (budget spent), so nobody else is sure to read the error
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self._count("coalesced")
+            LLM_COALESCED.inc(**labels)
+        # Shielded so one caller going away (or running out of budget) does not
+        # cancel the call for the others; once the last one has gone, nobody
+        # needs the response and the call is cancelled to free its slot
+        state.waiters[task] = state.waiters.get(task, 0) + 1
+        try:
+            if remaining is None:
+                return await asyncio.shield(task)
+            waiter = asyncio.shield(task)
+            # The call and the wait can end together at the deadline; the waiter's error is then never read
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+            return await asyncio.wait_for(waiter, budget.remaining())
+        finally:
+            state.waiters[task] -= 1
+            if not state.waiters[task]:
+                del state.waiters[task]
+                task.cancel()
+
+    def _generate_sync(self, prompt: str, kwargs: dict, cache: bool, labels: dict):
+        self._count("calls")
+        key = self._cache_key(prompt, kwargs)
+        cached = self._cached(key, cache, labels)
+        if cached is not None:
+            return cached
+
+        budget = current_budget()
+        remaining = budget.remaining() if budget is not None else None
+        if remaining is not None and remaining <= 0:
+            raise BudgetExhausted("The turn's LLM budget is spent.")
+
+        with self._sync_lock:
+            future = self._sync_inflight.get(key)
+            leader = future is None
+            if leader:
+                # As in `_generate`: the call is shared, so it runs in an empty
+                # context (on its own pool, so every caller, the first one
+                # included, can stop waiting at its own budget)
+                future = self._sync_calls.submit(
+                    contextvars.Context().run, self._generate_sync_with_retries, prompt, kwargs, key, cache, labels
+                )
+                self._sync_inflight[key] = future
+        if leader:
+            future.add_done_callback(lambda f: self._forget_sync_call(key, f))
+        else:
+            self._count("coalesced")
+            LLM_COALESCED.inc(**labels)
+        return future.result(timeout=None if remaining is None else budget.remaining())
+
+    def _forget_sync_call(self, key: str, future: concurrent.futures.Future):
+        with self._sync_lock:
+            if self._sync_inflight.get(key) is future:
+                del self._sync_inflight[key]
+
+    async def _generate_with_retries(self, prompt: str, kwargs: dict, key: str, cache: bool, labels: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._loop_state().semaphore:
+                    self._start_attempt(prompt, labels)
+                    response = await asyncio.wait_for(
+                        self.model.generate_content_async(prompt, **kwargs), self._attempt_timeout()
+                    )
+                self.breaker.record_success()
+                record_response_usage(response, **labels)
+                self._store(key, response, cache)
+                return response
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                backoff = self._backoff(attempt)
+                if not self._should_retry(e, attempt, labels, backoff):
+                    raise
+                await asyncio.sleep(backoff)
+
+    def _generate_sync_with_retries(self, prompt: str, kwargs: dict, key: str, cache: bool, labels: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._sync_semaphore:
+                    self._start_attempt(prompt, labels)
+                    # Run on the gateway's pool so the caller can give up at the deadline
+                    call = self._executor.submit(self.model.generate_content, prompt, **kwargs)
+                    response = call.result(timeout=self._attempt_timeout())
+                self.breaker.record_success()
+                record_response_usage(response, **labels)
+                self._store(key, response, cache)
+                return response
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                backoff = self._backoff(attempt)
+                if not self._should_retry(e, attempt, labels, backoff):
+                    raise
+                time.sleep(backoff)
+
+    def _start_attempt(self, prompt: str, labels: dict):
+        """Checks the budget and the breaker, then counts one upstream attempt."""
+        self._attempt_timeout()
+        if not self.breaker.allow():
+            self._count("circuit_rejected")
+            LLM_CIRCUIT_REJECTED.inc(**labels)
+            raise CircuitOpenError("The LLM circuit breaker is open.")
+        self._count("upstream_attempts")
+        LLM_UPSTREAM_ATTEMPTS.inc(**labels)
+        LLM_PROMPT_CHARS.observe(len(prompt), **labels)
+
+    def _attempt_timeout(self) -> float:
+        """The per-attempt deadline, cut short by the turn's remaining budget."""
+        budget = current_budget()
+        remaining = budget.remaining() if budget is not None else None
+        if remaining is None:
+            return self.timeout_seconds
+        if remaining <= 0:
+            raise BudgetExhausted("The turn's LLM budget is spent.")
+        return min(self.timeout_seconds, remaining)
+
+    def _should_retry(self, error: BaseException, attempt: int, labels: dict, backoff: float = 0.0) -> bool:
+        if isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError)):
+            self._count("timeouts")
+        budget = current_budget()
+        remaining = budget.remaining() if budget is not None else None
+        if attempt >= self.max_retries or (remaining is not None and remaining <= backoff):
+            self._count("failures")
+            return False
+        self._count("retries")
+        LLM_RETRIES.inc(error=type(error).__name__, **labels)
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _loop_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._loop_states.get(loop)
+        if state is None:
+            state = self._loop_states[loop] = _LoopState(self.max_concurrency)
+        return state
+
+    def _cache_key(self, prompt: str, kwargs: dict) -> str:
+        payload = json.dumps([self.model_name, prompt, kwargs], sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str, use_cache: bool, labels: dict):
+        if self.cache is None or not use_cache:
+            return None
+        response = self.cache.get(key)
+        if response is not None:
+            self._count("cache_hits")
+            LLM_CACHE_HITS.inc(**labels)
+        return response
+
+    def _store(self, key: str, response, use_cache: bool):
+        if self.cache is not None and use_cache:
+            self.cache.put(key, response)
+
+    def _count(self, name: str):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+
+def _create_gemini_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+def create_gateway(model=None) -> LLMGateway:
+    """
+    Builds a gateway configured from the environment. Without `model`, the
+    Gemini API is configured (once, here) and MODEL_NAME is wrapped lazily.
+    """
+    return LLMGateway(
+        model,
+        model_factory=_create_gemini_model,
+        model_name=MODEL_NAME,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        timeout_seconds=float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        backoff_seconds=float(os.getenv("LLM_BACKOFF_SECONDS", "0.5")),
+        cache_ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "0")),
+        cache_max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+        ),
+    )
+
+
+gateway = create_gateway()
@@ -1,20 +1,186 @@
 # main.py
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 import uvicorn
 from typing import List, Dict, Optional
+import asyncio
+import csv
+import hashlib
+import io
+import json
 import os
-import google.generativeai as genai
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.websockets import WebSocketState
 
-from graph import create_graph, QUESTIONS
+from graph import create_graph, aphrase_question, next_question_group, QUESTIONS
+from answer_classifier import answer_classifier
+from session_store import create_session_store, new_session_id
+from llm_gateway import DEGRADABLE_ERRORS, TurnBudget, current_budget, gateway, mark_degraded, use_budget
+from metrics import IDEMPOTENT_TURNS, NODE_DURATION, registry as metrics_registry
 from prompts import FINAL_RESPONSE_PROMPT
+from early_stopping import EARLY_STOPPING_DEFAULT
+from answer_summary import render_answer_summary
+from idempotency import IdempotencyCache, IdempotencyConflict
+from profiling import PROFILE_SAMPLE_RATE, list_profiles, profile_path, profile_report, profile_turn, tag_profile
+
+# Questions presented per turn when a client does not choose (1 = one at a time).
+# Larger groups are answered in one message and parsed with a single LLM call.
+DEFAULT_QUESTION_GROUP_SIZE = int(os.getenv("QUESTION_GROUP_SIZE", "1"))
+
+# Seconds a turn may spend waiting on the LLM before each remaining step falls
+# back to its local answer (0 = no budget). See llm_gateway.TurnBudget.
+TURN_BUDGET_SECONDS = float(os.getenv("TURN_BUDGET_SECONDS", "20"))
+
+# --- Startup Lifecycle ---
+# "blocking" (default) loads and warms everything before the server accepts
+# traffic, "background" starts serving at once and reports not-ready on
+# /readyz until warm-up finishes, and "off" leaves loading to the first request.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "blocking").lower()
+
+# Seconds a WebSocket conversation may wait for the user's next reply before
+# the server parks its state in the session store and closes the connection.
+WEBSOCKET_IDLE_SECONDS = float(os.getenv("WEBSOCKET_IDLE_SECONDS", "600"))
+
+# --- Model Hot Reload ---
+# Set ADMIN_TOKEN to enable the /admin/model endpoints (send it as X-Admin-Token).
+# They only reach the worker that serves the request, so with several workers
+# set MODEL_RELOAD_POLL_SECONDS instead: every worker then reloads on its own
+# when the files in saved_model/ change.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+MODEL_RELOAD_POLL_SECONDS = float(os.getenv("MODEL_RELOAD_POLL_SECONDS", "0"))
+
+# What /readyz reports for each component: pending, ready, lazy or failed: <error>
+startup_status = {"model": "pending", "llm_client": "pending"}
+
+# A complete, valid questionnaire used for the warm-up prediction
+WARMUP_USER_DATA = {
+    "age": 30, "gender": 0, "ethnicity": "Others", "country_of_residence": "Others",
+    **{key: 0 for key in QUESTIONS if key.startswith("A")},
+    "jundice": "unsure", "austim": 0,
+}
+
+
+def _warm_up():
+    """Loads the SVM pipeline, runs one dummy prediction and builds the Gemini client."""
+    try:
+        from model_pipeline import preprocess_and_predict
+        preprocess_and_predict(dict(WARMUP_USER_DATA))
+        startup_status["model"] = "ready"
+    except Exception as e:
+        startup_status["model"] = f"failed: {e}"
+
+    try:
+        gateway.model
+        startup_status["llm_client"] = "ready"
+    except Exception as e:
+        startup_status["llm_client"] = f"failed: {e}"
+
+
+async def _poll_model_files(interval: float):
+    """Reloads the model whenever its files change on disk, once the model has been loaded."""
+    while True:
+        await asyncio.sleep(interval)
+        model_pipeline = sys.modules.get("model_pipeline")
+        if model_pipeline is None or not model_pipeline.registry.source_changed():
+            continue
+        try:
+            await asyncio.wrap_future(model_pipeline.registry.reload_in_background())
+        except Exception as e:
+            print(f"Model reload failed, keeping version {model_pipeline.registry.active.number}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_task = None
+    if STARTUP_WARMUP == "blocking":
+        await run_in_threadpool(_warm_up)
+    elif STARTUP_WARMUP == "background":
+        warm_up_task = asyncio.create_task(run_in_threadpool(_warm_up))
+    else:
+        startup_status.update({name: "lazy" for name in startup_status})
+    poll_task = asyncio.create_task(_poll_model_files(MODEL_RELOAD_POLL_SECONDS)) if MODEL_RELOAD_POLL_SECONDS > 0 else None
+    yield
+    if poll_task is not None:
+        poll_task.cancel()
+    if warm_up_task is not None:
+        await warm_up_task
+
+
+class ServerTimingMiddleware:
+    """
+    Adds `Server-Timing: app;dur=<ms>`, the time the server spent before it
+    started the response, so a client can tell its own network time apart.
+    For `/turn/stream` this covers the turn up to the first event.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                duration = f"app;dur={(time.perf_counter() - start) * 1000:.1f}"
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", duration.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a share of conversation turns (PROFILE_SAMPLE_RATE), and any turn
+    sent with `X-Profile: 1` plus a valid `X-Admin-Token`. The profile covers
+    the whole request, including a streamed summary, and its id is returned in
+    an `X-Profile-Id` header. See profiling.py and `GET /admin/profiles`.
+    """
+
+    PROFILED_PATHS = ("/turn", "/turn/stream", "/session/turn")
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wanted(self, scope) -> bool:
+        if scope["type"] != "http" or scope["path"] not in self.PROFILED_PATHS:
+            return False
+        headers = dict(scope["headers"])
+        if ADMIN_TOKEN and headers.get(b"x-profile") == b"1" and headers.get(b"x-admin-token") == ADMIN_TOKEN.encode():
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if not self._wanted(scope):
+            return await self.app(scope, receive, send)
+
+        with profile_turn(scope["path"]) as profile:
+            if profile is None:  # another turn is being profiled
+                return await self.app(scope, receive, send)
+
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+                await send(message)
+
+            await self.app(scope, receive, send_with_profile_id)
+        await run_in_threadpool(profile.save)
+
 
 # Initialize the app and graph
 app = FastAPI(
     title="Autism Screening Chatbot",
     description="An interactive chatbot to gather data for an ASD screening model.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Define the origins that are allowed to connect.
@@ -31,14 +197,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # Allows all methods (GET, POST, etc.)
     allow_headers=["*"], # Allows all headers
+    expose_headers=["Server-Timing", "X-Profile-Id", "Idempotent-Replayed"],
 )
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# The client-held state grows every turn, so JSON bodies are compressed.
+# Starlette never compresses text/event-stream, so streamed tokens are not held back.
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 graph_app = create_graph()
 nodes = graph_app.nodes
 
-# Configure Gemini API for final response
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-final_response_model = genai.GenerativeModel('gemini-2.5-flash-lite-preview-06-17')
+# Server-held conversation state for session mode (see /session/turn)
+session_store = create_session_store()
+
+# Results of recent turns by idempotency key, so retried turns are not run twice
+idempotency_cache = IdempotencyCache()
 
 # --- Pydantic Models for the API ---
 class InitialData(BaseModel):
@@ -53,11 +227,20 @@ class StateForAPI(BaseModel):
     question_keys_to_ask: List[str] = Field(default_factory=list)
     current_question_key: str = ""
     conversation_history: List[str] = Field(default_factory=list)
+    # Stored answers with a short quote each; the final summary prompt is built from these
+    answer_summary: List[Dict[str, str]] = Field(default_factory=list)
+    question_group_size: int = 1
+    current_question_keys: List[str] = Field(default_factory=list)
+    early_stopping: bool = False
 
 class ApiRequest(BaseModel):
     state: Optional[StateForAPI] = None
     user_response: str = ""
     initial_data: Optional[InitialData] = None
+    question_group_size: Optional[int] = Field(None, ge=1, description="Questions per turn, set on the first turn.")
+    early_stopping: Optional[bool] = Field(
+        None, description="Stop asking once the remaining answers cannot change the prediction; first turn only."
+    )
 
 class ApiResponse(BaseModel):
     state: StateForAPI
@@ -65,97 +248,874 @@ class ApiResponse(BaseModel):
     is_finished: bool
     prediction: Optional[int] = None
     confidence: Optional[float] = None
+    degraded: bool = False
+    degraded_steps: List[str] = Field(default_factory=list)
+
+class SessionTurnRequest(BaseModel):
+    session_id: Optional[str] = None
+    user_response: str = ""
+    turn: Optional[int] = Field(
+        None, ge=0, description="The `turn` of the previous response; makes a retried reply safe to resend."
+    )
+    initial_data: Optional[InitialData] = None
+    question_group_size: Optional[int] = Field(None, ge=1, description="Questions per turn, set on the first turn.")
+    early_stopping: Optional[bool] = Field(
+        None, description="Stop asking once the remaining answers cannot change the prediction; first turn only."
+    )
+
+class SessionTurnResponse(BaseModel):
+    session_id: str
+    ai_message: str
+    is_finished: bool
+    turn: int = 0
+    current_question_key: str = ""
+    current_question_keys: List[str] = Field(default_factory=list)
+    questions_remaining: int = 0
+    prediction: Optional[int] = None
+    confidence: Optional[float] = None
+    degraded: bool = False
+    degraded_steps: List[str] = Field(default_factory=list)
+
+class BatchPredictionResponse(BaseModel):
+    predictions: List[int]
+    confidences: List[float]
+
+# --- Health Endpoints ---
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the model is loaded and warmed, so screenings can be served at full speed."""
+    ready = all(status in ("ready", "lazy") for status in startup_status.values())
+    body = {"status": "ready" if ready else "not ready", "components": startup_status}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 
 # --- Main API Endpoint ---
 @app.post("/turn", response_model=ApiResponse)
-def take_turn(request: ApiRequest):
+async def take_turn(request: ApiRequest, response: Response, idempotency_key: Optional[str] = Header(default=None)):
     """
     Handles a single turn by directly invoking the necessary nodes one by one
-    and explicitly merging the state after each step.
+    and explicitly merging the state after each step. A retry of a turn (same
+    `Idempotency-Key`, or the same state and reply) gets the first run's
+    response instead of running the turn again.
+    """
+    key, fingerprint = _turn_idempotency_key(request, idempotency_key)
+    return await _run_idempotent("turn", key, fingerprint, response, lambda: _take_turn(request))
+
+
+async def _take_turn(request: ApiRequest) -> ApiResponse:
+    with use_budget(TurnBudget(TURN_BUDGET_SECONDS)):
+        current_state = await _advance_conversation(
+            request.state.dict() if request.state else None, request.user_response, request.initial_data,
+            request.question_group_size, request.early_stopping
+        )
+
+        if "final_prediction" in current_state:
+            # Generate the final empathetic response
+            prediction_text = await _format_final_response(
+                current_state['final_prediction'],
+                current_state['prediction_confidence'],
+                current_state.get('answer_summary', [])
+            )
+            current_state['conversation_history'] += [f"AI: {prediction_text}"]
+            return _build_api_response(current_state, is_finished=True)
+
+        return _build_api_response(current_state, is_finished=False)
+
+
+@app.post("/turn/stream")
+async def take_turn_stream(request: ApiRequest, idempotency_key: Optional[str] = Header(default=None)):
+    """
+    Same as `/turn`, but answers with Server-Sent Events so the slow final
+    summary can be shown while Gemini is still writing it. Events, in order:
+
+    - `prediction`: `{"prediction": ..., "confidence": ...}`, final turn only
+    - `token`: `{"text": ...}`, one or more chunks of the AI message
+    - `done`: the complete `ApiResponse` for the turn
+    - `error`: `{"detail": ...}` if the summary fails mid-stream
+
+    Retries are deduplicated like `/turn`. A retry that arrives while the
+    first run is still streaming waits for it, then gets the whole message as
+    one `token` event.
+    """
+    key, fingerprint = _turn_idempotency_key(request, idempotency_key)
+    claim = None
+    if key is not None:
+        key = f"turn/stream:{key}"
+        while True:
+            entry, owner = _claim_idempotency_key("turn/stream", key, fingerprint)
+            if owner:
+                claim = key, entry
+                break
+            in_flight = not entry.future.done()
+            done, result = await idempotency_cache.wait(entry)
+            if done:
+                IDEMPOTENT_TURNS.inc(endpoint="turn/stream", outcome="in_flight" if in_flight else "completed")
+                return StreamingResponse(_replay_turn_events(result), media_type="text/event-stream",
+                                         headers={"Idempotent-Replayed": "true"})
+
+    budget = TurnBudget(TURN_BUDGET_SECONDS)
+    try:
+        with use_budget(budget):
+            current_state = await _advance_conversation(
+                request.state.dict() if request.state else None, request.user_response, request.initial_data,
+                request.question_group_size, request.early_stopping
+            )
+    except BaseException:
+        if claim is not None:
+            idempotency_cache.fail(*claim)
+        raise
+    return StreamingResponse(_stream_turn(current_state, budget, claim), media_type="text/event-stream")
+
+
+async def _stream_turn(current_state: dict, budget: TurnBudget, claim=None):
+    # The events are produced after the endpoint has returned, so the turn's budget is re-entered here.
+    # A claimed idempotency key is completed with the done event, or released if the stream ends without one.
+    completed = False
+    try:
+        with use_budget(budget):
+            async for event, data in _stream_turn_events(current_state):
+                if event == "done" and claim is not None:
+                    idempotency_cache.complete(*claim, data)
+                    completed = True
+                yield _sse_event(event, data)
+    finally:
+        if claim is not None and not completed:
+            idempotency_cache.fail(*claim)
+
+
+async def _stream_turn_events(current_state: dict):
+    if "final_prediction" not in current_state:
+        response = _build_api_response(current_state, is_finished=False)
+        yield "token", {"text": response.ai_message}
+        yield "done", response.model_dump()
+        return
+
+    yield "prediction", {
+        "prediction": current_state['final_prediction'],
+        "confidence": current_state['prediction_confidence'],
+    }
+    chunks = []
+    try:
+        async for chunk in _stream_final_response(
+            current_state['final_prediction'],
+            current_state['prediction_confidence'],
+            current_state.get('answer_summary', [])
+        ):
+            chunks.append(chunk)
+            yield "token", {"text": chunk}
+    except Exception as e:
+        yield "error", {"detail": f"Could not generate the summary: {e}"}
+        return
+
+    current_state['conversation_history'] += [f"AI: {''.join(chunks)}"]
+    yield "done", _build_api_response(current_state, is_finished=True).model_dump()
+
+
+async def _replay_turn_events(result: dict):
+    """The events of a stored streamed turn, with its message as a single token."""
+    if result["is_finished"]:
+        yield _sse_event("prediction", {"prediction": result["prediction"], "confidence": result["confidence"]})
+    yield _sse_event("token", {"text": result["ai_message"]})
+    yield _sse_event("done", result)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/session/turn", response_model=SessionTurnResponse)
+async def take_session_turn(request: SessionTurnRequest, response: Response,
+                            idempotency_key: Optional[str] = Header(default=None)):
     """
-    if request.state is None: # First turn: Just ask the first question
-        if not request.initial_data:
+    Session mode for `/turn`: the server keeps the conversation state, so the
+    client only sends `session_id` and `user_response` (or `initial_data` and
+    no `session_id` to start) and only gets back what changed this turn.
+
+    Sending back the previous response's `turn` (or an `Idempotency-Key`)
+    makes a retried reply safe: it gets the first run's response, rather than
+    being stored as the answer to the next question.
+    """
+    key = _checked_idempotency_key(idempotency_key) if idempotency_key is not None else None
+    if key is None and request.session_id is not None and request.turn is not None:
+        key = f"{request.session_id}:{request.turn}"
+    fingerprint = _fingerprint(request)
+    return await _run_idempotent("session/turn", key, fingerprint, response, lambda: _take_session_turn(request))
+
+
+async def _take_session_turn(request: SessionTurnRequest) -> SessionTurnResponse:
+    if request.session_id is None:
+        session_id, state = new_session_id(), None
+    else:
+        session_id, state = request.session_id, session_store.get(request.session_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session.")
+        if request.turn is not None and request.turn != _turn_index(state):
+            # A retry whose first run is no longer remembered must not answer the next question
+            raise HTTPException(
+                status_code=409,
+                detail=f"Turn {request.turn} was already taken; the session is at turn {_turn_index(state)}.",
+            )
+
+    with use_budget(TurnBudget(TURN_BUDGET_SECONDS)):
+        current_state = await _advance_conversation(
+            state, request.user_response, request.initial_data, request.question_group_size,
+            request.early_stopping
+        )
+
+        is_finished = "final_prediction" in current_state
+        if is_finished:
+            prediction_text = await _format_final_response(
+                current_state['final_prediction'],
+                current_state['prediction_confidence'],
+                current_state.get('answer_summary', [])
+            )
+            current_state['conversation_history'] += [f"AI: {prediction_text}"]
+
+        response = _build_api_response(current_state, is_finished=is_finished)
+    if is_finished:
+        session_store.delete(session_id)
+    else:
+        session_store.put(session_id, response.state.model_dump())
+
+    return SessionTurnResponse(
+        session_id=session_id,
+        ai_message=response.ai_message,
+        is_finished=is_finished,
+        turn=_turn_index(current_state),
+        current_question_key=response.state.current_question_key,
+        current_question_keys=response.state.current_question_keys,
+        questions_remaining=len(response.state.question_keys_to_ask),
+        prediction=response.prediction,
+        confidence=response.confidence,
+        degraded=response.degraded,
+        degraded_steps=response.degraded_steps,
+    )
+
+
+# --- Idempotent Turns ---
+# Longest accepted Idempotency-Key header
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def _fingerprint(request: BaseModel) -> str:
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+
+
+def _turn_idempotency_key(request: ApiRequest, idempotency_key: Optional[str]):
+    """
+    The idempotency key of a `/turn` request and the fingerprint of its body.
+    Without a header, a turn that carries state is keyed by its body: the
+    state holds the whole history, so the same body means the same turn. A
+    first turn without a header is not deduplicated.
+    """
+    fingerprint = _fingerprint(request)
+    if idempotency_key is not None:
+        return _checked_idempotency_key(idempotency_key), fingerprint
+    return (fingerprint if request.state is not None else None), fingerprint
+
+
+def _checked_idempotency_key(idempotency_key: str) -> str:
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters.")
+    return idempotency_key
+
+
+def _turn_index(state: dict) -> int:
+    """Replies the conversation has taken so far; each turn adds exactly one to the history."""
+    return sum(entry.startswith("User: ") for entry in state.get("conversation_history", []))
+
+
+def _claim_idempotency_key(endpoint: str, key: str, fingerprint: str):
+    try:
+        return idempotency_cache.claim(key, fingerprint)
+    except IdempotencyConflict:
+        IDEMPOTENT_TURNS.inc(endpoint=endpoint, outcome="conflict")
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+
+
+async def _run_idempotent(endpoint: str, key: Optional[str], fingerprint: str, response: Response, compute):
+    """Runs `compute` once per idempotency key; retries get the stored result and an Idempotent-Replayed header."""
+    if key is None:
+        return await compute()
+    key = f"{endpoint}:{key}"
+    try:
+        result, source = await idempotency_cache.run(key, fingerprint, compute)
+    except IdempotencyConflict:
+        IDEMPOTENT_TURNS.inc(endpoint=endpoint, outcome="conflict")
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+    if source != "new":
+        IDEMPOTENT_TURNS.inc(endpoint=endpoint, outcome=source)
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+# --- WebSocket Conversation Channel ---
+class WebSocketStart(BaseModel):
+    initial_data: InitialData
+    question_group_size: Optional[int] = Field(None, ge=1)
+    early_stopping: Optional[bool] = None
+
+
+@app.websocket("/ws")
+async def conversation_socket(websocket: WebSocket):
+    """
+    The whole screening over one connection, with the state held by the
+    server. Frames are JSON objects. The client sends:
+
+    - `{"type": "start", "initial_data": {...}}` (optionally with
+      `question_group_size` and `early_stopping`), or
+      `{"type": "resume", "session_id": ...}` to continue a parked conversation
+    - `{"type": "reply", "text": ..., "turn": ...}` for each answer, where
+      `turn` (optional) is copied from the question being answered
+
+    and receives:
+
+    - `session`: `{"session_id": ...}` once, first
+    - `message`: the next question, with `turn`, `question_key`,
+      `question_keys`, `questions_remaining`, `degraded` and `degraded_steps`
+    - `prediction`, then `token` chunks of the final summary, then `done`
+      (the full summary, prediction and confidence), after which the server closes
+    - `error`: `{"detail": ...}`; a malformed reply can simply be sent again.
+      A reply whose `turn` is not the current one is dropped, and the error
+      carries the current `turn`
+
+    If the connection drops or stays idle for WEBSOCKET_IDLE_SECONDS, the
+    state is parked in the session store, where `resume` (or `/session/turn`)
+    picks it up again. A client that resends its reply after resuming should
+    first compare the resumed question's `turn` with the one it answered: if
+    the server is already past it, the reply was taken before the connection
+    dropped and the resumed question is its result.
+    """
+    await websocket.accept()
+    session_id, state, finished = None, None, False
+    try:
+        frame = await _receive_frame(websocket)
+        if frame.get("type") == "resume":
+            session_id = frame.get("session_id")
+            state = session_store.get(session_id) if isinstance(session_id, str) else None
+            if state is None:
+                await _send_error_and_close(websocket, "Unknown or expired session.")
+                return
+            # The connection holds the state from now on
+            session_store.delete(session_id)
+            await websocket.send_json({"type": "session", "session_id": session_id})
+            with use_budget(TurnBudget(TURN_BUDGET_SECONDS)):
+                await websocket.send_json(_socket_message(state))
+        elif frame.get("type") == "start":
+            try:
+                start = WebSocketStart.model_validate(frame)
+            except ValidationError as e:
+                await _send_error_and_close(websocket, f"Invalid start frame: {e.errors()}")
+                return
+            session_id = new_session_id()
+            await websocket.send_json({"type": "session", "session_id": session_id})
+            state, finished = await _socket_turn(
+                websocket, None, "", start.initial_data, start.question_group_size, start.early_stopping
+            )
+        else:
+            await _send_error_and_close(websocket, "The first frame must be a start or resume frame.")
+            return
+
+        while not finished:
+            frame = await _receive_frame(websocket)
+            turn = frame.get("turn")
+            if frame.get("type") != "reply" or not isinstance(frame.get("text"), str) or not (
+                turn is None or (isinstance(turn, int) and not isinstance(turn, bool))
+            ):
+                await websocket.send_json({"type": "error", "detail": 'Expected {"type": "reply", "text": ...}.'})
+                continue
+            if turn is not None and turn != _turn_index(state):
+                # A reply resent after a reconnect must not answer the next question
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": f"Turn {turn} was already taken; the conversation is at turn {_turn_index(state)}.",
+                    "turn": _turn_index(state),
+                })
+                continue
+            state, finished = await _socket_turn(websocket, state, frame["text"])
+        await websocket.close()
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        if state is not None and not finished:
+            session_store.put(session_id, _storable_state(state))
+        if websocket.client_state == WebSocketState.CONNECTED:
+            # Idle timeout; a client that disconnected needs no close frame
+            await websocket.close(code=1001)
+
+
+async def _receive_frame(websocket: WebSocket) -> dict:
+    """The next JSON object from the client; anything else counts as an empty frame."""
+    text = await asyncio.wait_for(websocket.receive_text(), WEBSOCKET_IDLE_SECONDS or None)
+    try:
+        frame = json.loads(text)
+    except ValueError:
+        return {}
+    return frame if isinstance(frame, dict) else {}
+
+
+async def _send_error_and_close(websocket: WebSocket, detail: str):
+    await websocket.send_json({"type": "error", "detail": detail})
+    await websocket.close(code=1008)
+
+
+def _storable_state(state: dict) -> dict:
+    return StateForAPI(**{k: v for k, v in state.items() if k in StateForAPI.model_fields}).model_dump()
+
+
+def _socket_message(state: dict) -> dict:
+    """The `message` frame for the question the conversation is waiting on."""
+    response = _build_api_response(state, is_finished=False)
+    return {
+        "type": "message",
+        "text": response.ai_message,
+        "turn": _turn_index(state),
+        "question_key": response.state.current_question_key,
+        "question_keys": response.state.current_question_keys,
+        "questions_remaining": len(response.state.question_keys_to_ask),
+        "degraded": response.degraded,
+        "degraded_steps": response.degraded_steps,
+    }
+
+
+async def _socket_turn(websocket: WebSocket, state: Optional[dict], user_response: str,
+                       initial_data: Optional[InitialData] = None, question_group_size: Optional[int] = None,
+                       early_stopping: Optional[bool] = None):
+    """Runs one turn and pushes its frames. Returns the new state and whether the screening finished."""
+    with use_budget(TurnBudget(TURN_BUDGET_SECONDS)):
+        state = await _advance_conversation(state, user_response, initial_data, question_group_size, early_stopping)
+        if "final_prediction" not in state:
+            await websocket.send_json(_socket_message(state))
+            return state, False
+
+        await websocket.send_json({
+            "type": "prediction",
+            "prediction": state['final_prediction'],
+            "confidence": state['prediction_confidence'],
+        })
+        chunks = []
+        try:
+            async for chunk in _stream_final_response(
+                state['final_prediction'], state['prediction_confidence'], state.get('answer_summary', [])
+            ):
+                chunks.append(chunk)
+                await websocket.send_json({"type": "token", "text": chunk})
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            await websocket.send_json({"type": "error", "detail": f"Could not generate the summary: {e}"})
+            return state, True
+
+        state['conversation_history'] += [f"AI: {''.join(chunks)}"]
+        response = _build_api_response(state, is_finished=True)
+        await websocket.send_json({
+            "type": "done",
+            "text": response.ai_message,
+            "prediction": response.prediction,
+            "confidence": response.confidence,
+            "degraded": response.degraded,
+            "degraded_steps": response.degraded_steps,
+        })
+        return state, True
+
+
+async def _advance_conversation(
+    state: Optional[dict], user_response: str, initial_data: Optional[InitialData],
+    question_group_size: Optional[int] = None, early_stopping: Optional[bool] = None
+) -> dict:
+    """
+    Runs every step of a turn, starting from `state` (None on the first turn),
+    except the final summary. When the screening is
+    complete, the returned state carries `final_prediction` and
+    `prediction_confidence` and the summary is left to the caller.
+
+    While the user's reply is being parsed, the phrasing of the next question
+    is generated speculatively so the two LLM calls overlap. The speculative
+    phrasing is thrown away if the reply comes back unsure, and its upstream
+    call is cancelled unless another turn is waiting on the same prompt.
+
+    `question_group_size` (first turn only) switches to multi-question turns,
+    see `_advance_question_group`. `early_stopping` (first turn only) ends the
+    questioning as soon as the remaining answers cannot change the prediction
+    and asks the most decisive questions first, see early_stopping.py.
+    """
+    if state is None:
+        tag_profile("start")
+    else:
+        tag_profile(",".join(state.get("current_question_keys") or []) or state.get("current_question_key") or "")
+    if state is None: # First turn: Just ask the first question
+        if not initial_data:
             raise HTTPException(status_code=400, detail="Initial data is required.")
 
         all_keys = list(QUESTIONS.keys())
+        group_size = min(question_group_size or DEFAULT_QUESTION_GROUP_SIZE, len(all_keys))
         current_state = {
-            "initial_user_data": request.initial_data.dict(),
+            "initial_user_data": initial_data.dict(),
             "collected_data": {},
             "question_keys_to_ask": all_keys,
             "current_question_key": all_keys[0],
             "conversation_history": [],
+            "answer_summary": [],
+            "question_group_size": group_size,
+            "current_question_keys": [],
+            "early_stopping": EARLY_STOPPING_DEFAULT if early_stopping is None else early_stopping,
         }
-        ask_result = nodes["ask_question"].invoke(current_state)
+        if current_state["early_stopping"]:
+            current_state.update(await run_in_threadpool(nodes["check_early_stop"].invoke, current_state))
+        if not current_state["question_keys_to_ask"]:
+            ask_result = await nodes["make_prediction"].ainvoke(current_state)
+        elif group_size > 1:
+            current_state["current_question_keys"] = next_question_group(
+                current_state["question_keys_to_ask"], group_size
+            )
+            ask_result = nodes["ask_question_group"].invoke(current_state)
+        else:
+            ask_result = await nodes["ask_question"].ainvoke(current_state)
         current_state.update(ask_result)
 
+    elif state.get("question_group_size", 1) > 1: # Subsequent turns, several questions at a time
+        current_state = state
+        current_state["user_response"] = user_response
+        current_state["conversation_history"] += [f"User: {user_response}"]
+        await _advance_question_group(current_state)
+
     else: # Subsequent turns
-        current_state = request.state.dict()
-        current_state["user_response"] = request.user_response
-        current_state["conversation_history"] += [f"User: {request.user_response}"]
+        current_state = state
+        current_state["user_response"] = user_response
+        current_state["conversation_history"] += [f"User: {user_response}"]
 
-        parse_result = nodes["parse_response"].invoke(current_state)
+        # Start phrasing the question that follows if this answer is accepted. With
+        # early stopping the order can still change once the answer is stored.
+        next_keys = current_state["question_keys_to_ask"][1:]
+        next_question = asyncio.create_task(aphrase_question(next_keys[0])) if next_keys else None
+
+        try:
+            parse_result = await nodes["parse_response"].ainvoke(current_state)
+        except BaseException:
+            _discard_speculation(next_question)
+            raise
         current_state.update(parse_result)
 
         if current_state["parsed_answer"] == "unsure":
+            _discard_speculation(next_question)
             handle_unsure_result = nodes["handle_unsure"].invoke(current_state)
             current_state.update(handle_unsure_result)
-            ask_result = nodes["ask_question"].invoke(current_state)
+            ask_result = await nodes["ask_question"].ainvoke(current_state)
             current_state.update(ask_result)
         else:
             store_result = nodes["store_answer"].invoke(current_state)
             current_state.update(store_result)
+            if current_state.get("early_stopping"):
+                current_state.update(await run_in_threadpool(nodes["check_early_stop"].invoke, current_state))
 
             if not current_state.get("question_keys_to_ask"):
-                prediction_result = nodes["make_prediction"].invoke(current_state)
+                _discard_speculation(next_question)
+                prediction_result = await nodes["make_prediction"].ainvoke(current_state)
                 current_state.update(prediction_result)
-
-                # Generate the final empathetic response
-                prediction_text = _format_final_response(
-                    current_state['final_prediction'],
-                    current_state['prediction_confidence'],
-                    current_state['conversation_history']
-                )
-                current_state['conversation_history'] += [f"AI: {prediction_text}"]
-
-                if current_state.get("current_question_key") is None:
-                    current_state["current_question_key"] = ""
-
-                ai_message = current_state['conversation_history'][-1].replace("AI: ", "")
-                response_state = StateForAPI(**{k: v for k, v in current_state.items() if k in StateForAPI.model_fields})
-                return ApiResponse(
-                    state=response_state,
-                    ai_message=ai_message,
-                    is_finished=True,
-                    prediction=current_state.get('final_prediction'),
-                    confidence=current_state.get('prediction_confidence')
-                )
+            elif current_state["current_question_key"] != next_keys[0]:
+                _discard_speculation(next_question)
+                next_phrasing = await aphrase_question(current_state["current_question_key"])
+                current_state["conversation_history"] += [f"AI: {next_phrasing}"]
             else:
-                ask_result = nodes["ask_question"].invoke(current_state)
-                current_state.update(ask_result)
+                # The next key is the one phrased speculatively above
+                next_phrasing = await next_question
+                current_state["conversation_history"] += [f"AI: {next_phrasing}"]
+
+    return current_state
 
+
+async def _advance_question_group(current_state: dict):
+    """
+    Multi-question turn: reads the answers to every question of the current
+    group from one reply with a single parser call, then presents either the
+    questions that came back unsure or the next group. Group messages are
+    built locally, so a turn costs at most one LLM call.
+    """
+    parse_result = await nodes["parse_group_response"].ainvoke(current_state)
+    current_state.update(parse_result)
+    store_result = nodes["store_group_answers"].invoke(current_state)
+    current_state.update(store_result)
+    if current_state.get("early_stopping"):
+        current_state.update(await run_in_threadpool(nodes["check_early_stop"].invoke, current_state))
+
+    if not current_state["question_keys_to_ask"]:
+        prediction_result = await nodes["make_prediction"].ainvoke(current_state)
+        current_state.update(prediction_result)
+    else:
+        ask_result = nodes["ask_question_group"].invoke(current_state)
+        current_state.update(ask_result)
+
+
+def _build_api_response(current_state: dict, is_finished: bool) -> ApiResponse:
     if current_state.get("current_question_key") is None:
         current_state["current_question_key"] = ""
 
     ai_message = current_state['conversation_history'][-1].replace("AI: ", "") if current_state['conversation_history'] else ""
     response_state = StateForAPI(**{k: v for k, v in current_state.items() if k in StateForAPI.model_fields})
+    # Steps of this turn that answered locally because the LLM was unavailable
+    budget = current_budget()
+    degraded_steps = list(budget.degraded_steps) if budget is not None else []
+
+    if not is_finished:
+        return ApiResponse(state=response_state, ai_message=ai_message, is_finished=False, prediction=None,
+                           degraded=bool(degraded_steps), degraded_steps=degraded_steps)
+    return ApiResponse(
+        state=response_state,
+        ai_message=ai_message,
+        is_finished=True,
+        prediction=current_state.get('final_prediction'),
+        confidence=current_state.get('prediction_confidence'),
+        degraded=bool(degraded_steps),
+        degraded_steps=degraded_steps,
+    )
+
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_batch(request: Request):
+    """
+    Scores many completed questionnaires at once. Accepts a JSON array of
+    user-data objects (or a columnar object of equal-length arrays), a raw
+    `text/csv` body, or a multipart CSV upload in the `file` field. Results
+    are returned in input order.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Upload the CSV file in a 'file' form field.")
+        records = _read_csv_records((await upload.read()).decode("utf-8-sig"))
+    elif "csv" in content_type:
+        records = _read_csv_records((await request.body()).decode("utf-8-sig"))
+    else:
+        try:
+            records = json.loads(await request.body())
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of objects or a CSV file.")
+        is_records = isinstance(records, list) and all(isinstance(r, dict) for r in records)
+        is_columnar = isinstance(records, dict) and all(isinstance(c, list) for c in records.values())
+        if not (is_records or is_columnar):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of objects or a CSV file.")
+
+    from model_pipeline import preprocess_and_predict_batch
+
+    try:
+        predictions, confidences = await run_in_threadpool(preprocess_and_predict_batch, records)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing required field: {e}")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {e}")
 
-    return ApiResponse(state=response_state, ai_message=ai_message, is_finished=False, prediction=None)
+    return BatchPredictionResponse(predictions=predictions, confidences=confidences)
 
 
-def _format_final_response(prediction: int, confidence: float, conversation_history: list) -> str:
-    """Generates the final response using Gemini."""
-    
-    # Format the conversation history for the prompt
-    history_str = "\n".join(conversation_history)
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-node and per-LLM-call latency, size, token and retry metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    prompt = FINAL_RESPONSE_PROMPT.format(
-        prediction= "some traits associated with ASD may be present" if prediction == 1 else "fewer traits associated with ASD were indicated",
+
+@app.get("/parser/stats")
+def parser_stats():
+    """Reports how many replies the local answer classifier handled without the LLM."""
+    return answer_classifier.stats()
+
+
+# --- Model Admin Endpoints ---
+class ModelReloadRequest(BaseModel):
+    # Default: reload the live model's directory, e.g. after replacing its files
+    model_dir: Optional[str] = None
+
+
+class ShadowRequest(BaseModel):
+    model_dir: str
+    sample_rate: float = Field(default=1.0, gt=0, le=1)
+
+
+def _require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+def _model_registry(token: Optional[str]):
+    _require_admin(token)
+    from model_pipeline import registry
+    return registry
+
+
+@app.get("/admin/model")
+def model_status(x_admin_token: Optional[str] = Header(default=None)):
+    """The live model version, the last reload and the shadow model's agreement statistics."""
+    return _model_registry(x_admin_token).describe()
+
+
+@app.post("/admin/model/reload", status_code=202)
+def reload_model(body: ModelReloadRequest, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Loads and validates a model in the background and swaps it in. Requests keep
+    being served by the live model meanwhile; poll GET /admin/model for the outcome.
+    """
+    registry = _model_registry(x_admin_token)
+    registry.reload_in_background(body.model_dir)
+    return {"status": "reloading", "active": registry.active.describe()}
+
+
+@app.post("/admin/model/shadow")
+def start_shadow(body: ShadowRequest, x_admin_token: Optional[str] = Header(default=None)):
+    """Scores a share of live traffic with the model in `model_dir` as well, without serving its results."""
+    from model_pipeline import ModelValidationError
+    registry = _model_registry(x_admin_token)
+    try:
+        shadow = registry.start_shadow(body.model_dir, body.sample_rate)
+    except (ModelValidationError, RuntimeError, OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return shadow.stats()
+
+
+@app.delete("/admin/model/shadow")
+def stop_shadow(x_admin_token: Optional[str] = Header(default=None)):
+    """Stops shadow scoring and returns its final statistics."""
+    stats = _model_registry(x_admin_token).stop_shadow()
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No shadow model is running.")
+    return stats
+
+
+# --- Profiling Endpoints ---
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+
+@app.get("/admin/profiles")
+def profiles(x_admin_token: Optional[str] = Header(default=None)):
+    """Recently profiled turns, newest first: endpoint, question key, duration and per-node sections."""
+    _require_admin(x_admin_token)
+    return list_profiles()
+
+
+@app.get("/admin/profiles/{profile_id}")
+def download_profile(profile_id: str, format: str = "pstats", sort: str = "cumulative", limit: int = 40,
+                     x_admin_token: Optional[str] = Header(default=None)):
+    """
+    The profile as a `.pstats` file (open it with `python -m pstats` or
+    snakeviz), or with `format=text` as a report of the `limit` most expensive
+    functions sorted by `sort` (cumulative, tottime or ncalls).
+    """
+    _require_admin(x_admin_token)
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile.")
+    if format == "text":
+        if sort not in PROFILE_SORT_KEYS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}.")
+        return PlainTextResponse(profile_report(path, limit=max(limit, 1), sort=sort))
+    if format != "pstats":
+        raise HTTPException(status_code=400, detail="format must be pstats or text.")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.pstats")
+
+
+def _read_csv_records(text: str) -> List[dict]:
+    """Parses CSV text into user-data dicts, turning numeric cells back into numbers."""
+    return [
+        {key: _parse_csv_value(value) for key, value in row.items()}
+        for row in csv.DictReader(io.StringIO(text))
+    ]
+
+
+def _parse_csv_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _discard_speculation(task: Optional[asyncio.Task]):
+    """Cancels a speculative LLM call whose result is no longer needed."""
+    if task is not None:
+        task.cancel()
+        # Retrieve any exception so an upstream error is not logged as unhandled
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+# The summary sent when Gemini cannot write one within the turn's budget
+FALLBACK_FINAL_RESPONSE = (
+    "Thank you for taking the time to answer these questions. "
+    "Based on your answers, the screening model suggests that {prediction}, "
+    "with a confidence of {confidence_score}.\n\n"
+    "Please remember that this is a **screening tool, not a diagnostic tool**, and this result is not a "
+    "medical diagnosis. {next_steps}\n\n"
+    "Thank you again, and take good care of yourself."
+)
+FALLBACK_NEXT_STEPS = {
+    1: "We strongly recommend speaking with a qualified healthcare professional, such as a psychologist or "
+       "psychiatrist, who can carry out a formal evaluation.",
+    0: "If you have any ongoing concerns about your well-being, a healthcare provider is always a good person "
+       "to talk to.",
+}
+
+
+def _prediction_text(prediction: int) -> str:
+    return "some traits associated with ASD may be present" if prediction == 1 else "fewer traits associated with ASD were indicated"
+
+
+def _final_response_prompt(prediction: int, confidence: float, answer_summary: list) -> str:
+    # The answers as stored turn by turn, within a fixed token budget, rather than the whole history
+    return FINAL_RESPONSE_PROMPT.format(
+        prediction=_prediction_text(prediction),
+        confidence_score=f"{confidence:.2%}",
+        answer_summary=render_answer_summary(answer_summary)
+    )
+
+
+def _fallback_final_response(prediction: int, confidence: float) -> str:
+    return FALLBACK_FINAL_RESPONSE.format(
+        prediction=_prediction_text(prediction),
         confidence_score=f"{confidence:.2%}",
-        conversation_history=history_str
+        next_steps=FALLBACK_NEXT_STEPS[1 if prediction == 1 else 0],
     )
-    
-    response = final_response_model.generate_content(prompt)
-    return response.text
+
+
+async def _format_final_response(prediction: int, confidence: float, answer_summary: list) -> str:
+    """Generates the final response using Gemini, or the templated one if it is unavailable."""
+    prompt = _final_response_prompt(prediction, confidence, answer_summary)
+    start = time.perf_counter()
+    try:
+        response = await gateway.generate(prompt, purpose="final_response")
+        return response.text
+    except DEGRADABLE_ERRORS as e:
+        mark_degraded("final_response", e)
+        return _fallback_final_response(prediction, confidence)
+    finally:
+        NODE_DURATION.observe(time.perf_counter() - start, node="final_response", question_key="")
+
+
+async def _stream_final_response(prediction: int, confidence: float, answer_summary: list):
+    """
+    Yields the final response text chunk by chunk as Gemini generates it. If
+    Gemini is unavailable before the first chunk, the templated summary is
+    sent instead; a failure after that is raised.
+    """
+    prompt = _final_response_prompt(prediction, confidence, answer_summary)
+    start = time.perf_counter()
+    started = False
+    try:
+        async for text in gateway.stream(prompt, purpose="final_response"):
+            started = True
+            yield text
+    except DEGRADABLE_ERRORS as e:
+        if started:
+            raise
+        mark_degraded("final_response", e)
+        yield _fallback_final_response(prediction, confidence)
+    finally:
+        NODE_DURATION.observe(time.perf_counter() - start, node="final_response", question_key="")
 
 
 if __name__ == "__main__":
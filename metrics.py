@@ -0,0 +1,312 @@
+# metrics.py
+"""
+In-process counters and histograms, rendered in the Prometheus text format on
+`GET /metrics`.
+
+The instruments are defined once below and updated from the graph nodes, the
+LLM gateway and the final-summary path. An update is one dict lookup and a
+short critical section, so they are cheap enough to stay on in production.
+Every uvicorn worker keeps its own numbers; scrape each worker (or run one
+worker per container) to see all of them.
+"""
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from profiling import current_profile
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{self._label_text(key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed cumulative buckets per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{self._label_text(key, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(key)} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{self._label_text(key)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+registry = MetricsRegistry()
+
+# --- Conversation ---
+NODE_DURATION = registry.histogram(
+    "screening_node_duration_seconds", "Wall time of each graph node and of the final summary.",
+    ("node", "question_key"),
+)
+PARSED_ANSWERS = registry.counter(
+    "screening_parsed_answers_total", "Replies classified per question, by answer and by which parser decided.",
+    ("question_key", "answer", "parser"),
+)
+
+# --- LLM calls (see llm_gateway.py) ---
+LLM_LABELS = ("purpose", "question_key")
+LLM_DURATION = registry.histogram(
+    "screening_llm_request_duration_seconds",
+    "Wall time of each LLM request as seen by the caller, including retries, cache hits and coalescing.",
+    LLM_LABELS + ("outcome",),
+)
+LLM_FIRST_CHUNK = registry.histogram(
+    "screening_llm_time_to_first_chunk_seconds", "Time until a streamed LLM response yields its first text.",
+    LLM_LABELS,
+)
+LLM_PROMPT_CHARS = registry.histogram(
+    "screening_llm_prompt_chars", "Size of each prompt sent upstream, in characters.", LLM_LABELS, SIZE_BUCKETS,
+)
+LLM_RESPONSE_CHARS = registry.histogram(
+    "screening_llm_response_chars", "Size of each upstream response, in characters.", LLM_LABELS, SIZE_BUCKETS,
+)
+LLM_TOKENS = registry.counter(
+    "screening_llm_tokens_total", "Tokens reported by the model's usage metadata, by direction.",
+    LLM_LABELS + ("direction",),
+)
+LLM_UPSTREAM_ATTEMPTS = registry.counter(
+    "screening_llm_upstream_attempts_total", "Calls actually made to the model, including retries.", LLM_LABELS,
+)
+LLM_RETRIES = registry.counter(
+    "screening_llm_retries_total", "Upstream attempts that failed and were retried, by error type.",
+    LLM_LABELS + ("error",),
+)
+LLM_CACHE_HITS = registry.counter(
+    "screening_llm_cache_hits_total", "Requests answered from the gateway's response cache.", LLM_LABELS,
+)
+LLM_COALESCED = registry.counter(
+    "screening_llm_coalesced_total", "Requests that shared an identical in-flight upstream call.", LLM_LABELS,
+)
+LLM_CIRCUIT_REJECTED = registry.counter(
+    "screening_llm_circuit_rejected_total", "Requests refused without a call because the circuit breaker was open.",
+    LLM_LABELS,
+)
+LLM_CIRCUIT_TRANSITIONS = registry.counter(
+    "screening_llm_circuit_transitions_total", "Circuit breaker state changes, by the state entered.", ("state",),
+)
+
+# --- Degraded mode (local fallbacks when the LLM is unavailable) ---
+DEGRADED_STEPS = registry.counter(
+    "screening_degraded_steps_total",
+    "Turn steps answered locally instead of by the LLM, by step and reason (timeout, budget, circuit_open, "
+    "upstream_error).",
+    ("step", "reason"),
+)
+
+# --- Memoized predictions (see prediction_table.py) ---
+PREDICTION_LOOKUPS = registry.counter(
+    "screening_predictions_total",
+    "Single predictions, by where the result came from (table, cache or model).", ("source",),
+)
+
+# --- Micro-batched predictions (see prediction_batcher.py) ---
+PREDICTION_BATCH_SIZE = registry.histogram(
+    "screening_prediction_batch_size", "Single predictions scored together in one model call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+PREDICTION_BATCH_QUEUE_DELAY = registry.histogram(
+    "screening_prediction_batch_queue_seconds", "Time a prediction waited in the batcher before being scored.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+PREDICTION_BATCH_FLUSHES = registry.counter(
+    "screening_prediction_batches_total",
+    "Prediction batches scored, by why they were closed (full, the wait ran out, or nothing else was queued).",
+    ("reason",),
+)
+
+# --- Idempotent turns (see idempotency.py) ---
+IDEMPOTENT_TURNS = registry.counter(
+    "screening_idempotent_turns_total",
+    "Retried turns answered with the first run's result (completed, or waited for while in_flight), "
+    "and keys reused for a different request (conflict).", ("endpoint", "outcome"),
+)
+
+# --- Model hot reload and shadow scoring (see model_pipeline.ModelRegistry) ---
+MODEL_RELOADS = registry.counter(
+    "screening_model_reloads_total", "Model reloads, by outcome (ok, or failed to load or validate).", ("outcome",),
+)
+SHADOW_COMPARISONS = registry.counter(
+    "screening_shadow_predictions_total",
+    "Rows scored by both the live and the shadow model, by whether their predictions agree.", ("outcome",),
+)
+SHADOW_DROPPED = registry.counter(
+    "screening_shadow_dropped_total", "Shadow scoring requests dropped because the shadow queue was full.",
+)
+SHADOW_DURATION = registry.histogram(
+    "screening_shadow_scoring_duration_seconds",
+    "Encode and score time of the same input on the live and on the shadow model.", ("model",),
+)
+
+
+def record_response_usage(response, purpose: str, question_key: str):
+    """Records the response size and, when the model reports it, token usage."""
+    try:
+        LLM_RESPONSE_CHARS.observe(len(response.text), purpose=purpose, question_key=question_key)
+    except (AttributeError, ValueError):
+        pass  # blocked or empty responses have no text
+    record_token_usage(getattr(response, "usage_metadata", None), purpose, question_key)
+
+
+def record_token_usage(usage, purpose: str, question_key: str):
+    if usage is None:
+        return
+    for direction, field in (("prompt", "prompt_token_count"), ("response", "candidates_token_count")):
+        tokens = getattr(usage, field, None)
+        if tokens:
+            LLM_TOKENS.inc(tokens, purpose=purpose, question_key=question_key, direction=direction)
+
+
+def timed_node(node: str):
+    """
+    Decorates a graph node (sync or async) so its wall time is observed under
+    `node`, tagged with the state's current question key. In a profiled turn
+    the node is also a section of the profile (see profiling.py).
+    """
+    def section(state):
+        profile = current_profile()
+        if profile is None:
+            return nullcontext()
+        return profile.section(node, state.get("current_question_key") or "")
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(state, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    with section(state):
+                        return await fn(state, *args, **kwargs)
+                finally:
+                    NODE_DURATION.observe(time.perf_counter() - start, node=node,
+                                          question_key=state.get("current_question_key") or "")
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with section(state):
+                    return fn(state, *args, **kwargs)
+            finally:
+                NODE_DURATION.observe(time.perf_counter() - start, node=node,
+                                      question_key=state.get("current_question_key") or "")
+        return wrapper
+    return decorator
@@ -0,0 +1,307 @@
+# model_artifact.py
+"""
+A compact, memory-mapped serving artifact for the screening model.
+
+Loading `saved_model/` the original way unpickles the SVM and the scaler with
+joblib (which imports scikit-learn and SciPy) and parses two JSON files, in
+every uvicorn worker, giving each worker a private copy of everything. This
+module compiles all of it into one read-only file that is mapped straight
+into memory, so workers on the same host share the physical pages and never
+import scikit-learn.
+
+File layout (all integers little-endian):
+
+    magic     8 bytes   b"ASDSVM\\0\\0"
+    version   uint32    ARTIFACT_VERSION
+    length    uint32    size of the JSON header in bytes
+    header    JSON      model parameters, column layout, category tables,
+                        source checksums and the offset/dtype/shape of each array
+    arrays    raw       C-ordered arrays, each aligned to ALIGNMENT bytes
+    checksum  32 bytes  SHA-256 of everything before it
+
+Build or refresh the artifact after retraining with:
+    python model_artifact.py
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+from typing import Dict, Optional
+
+import numpy as np
+
+ARTIFACT_MAGIC = b"ASDSVM\0\0"
+ARTIFACT_VERSION = 1
+ARTIFACT_FILENAME = "model.bin"
+ALIGNMENT = 64
+
+# The files the artifact is compiled from, relative to the model directory
+SOURCE_FILES = ("svm_model.joblib", "scaler.joblib", "model_columns.json", "data_info.json")
+
+_PREAMBLE = struct.Struct("<8sII")
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+class ArtifactError(RuntimeError):
+    """The artifact is missing, corrupt or was written by an incompatible version."""
+
+
+class ArtifactSVM:
+    """
+    The fitted attributes of a binary `SVC` that inference needs, backed by the
+    mapped file. It mirrors sklearn's attribute names so `SVMEngine` accepts it
+    in place of the unpickled model.
+    """
+
+    probability = True
+
+    def __init__(self, params: dict, arrays: Dict[str, np.ndarray], feature_names: list):
+        self.kernel = params["kernel"]
+        self._gamma = params["gamma"]
+        self.coef0 = params["coef0"]
+        self.degree = params["degree"]
+        self.classes_ = arrays["classes"]
+        self.support_vectors_ = arrays["support_vectors"]
+        self.dual_coef_ = arrays["dual_coef"]
+        self.intercept_ = arrays["intercept"]
+        self.probA_ = arrays["prob_a"]
+        self.probB_ = arrays["prob_b"]
+        self.feature_names_in_ = np.array(feature_names, dtype=object)
+        self.n_features_in_ = len(feature_names)
+
+
+class ArtifactScaler:
+    """The `StandardScaler` parameters, with the same `transform` arithmetic."""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X) -> np.ndarray:
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class ModelArtifact:
+    """A loaded artifact: the model and scaler parameters plus the column and category tables."""
+
+    def __init__(self, path: str, header: dict, arrays: Dict[str, np.ndarray], digest: str = ""):
+        self.path = path
+        self.header = header
+        # Hex SHA-256 stored at the end of the file, which identifies this build of the model
+        self.digest = digest
+        self.model_columns = header["model_columns"]
+        self.data_info = header["data_info"]
+        self.svm = ArtifactSVM(header["svm"], arrays, self.model_columns)
+        self.scaler = ArtifactScaler(arrays["scaler_mean"], arrays["scaler_scale"])
+
+    def is_stale(self, model_dir: str) -> bool:
+        """
+        True if any source file in `model_dir` differs from the one the artifact
+        was compiled from, i.e. the model was retrained without re-exporting.
+        Missing source files are ignored, so the artifact can be deployed alone.
+        """
+        for name, checksum in self.header["sources"].items():
+            path = os.path.join(model_dir, name)
+            if os.path.exists(path) and _file_sha256(path) != checksum:
+                return True
+        return False
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_joblib_model(model_dir: str):
+    """Loads the original training outputs: (svm, scaler, model_columns, data_info)."""
+    import joblib
+
+    # IMPORTANT: The SVM model must be saved with probability=True
+    svm = joblib.load(os.path.join(model_dir, "svm_model.joblib"))
+    scaler = joblib.load(os.path.join(model_dir, "scaler.joblib"))
+    with open(os.path.join(model_dir, "model_columns.json"), "r") as f:
+        model_columns = json.load(f)
+    with open(os.path.join(model_dir, "data_info.json"), "r") as f:
+        data_info = json.load(f)
+    return svm, scaler, model_columns, data_info
+
+
+def export_artifact(model_dir: str, path: str) -> dict:
+    """Compiles the joblib/JSON files in `model_dir` into an artifact at `path` and returns its header."""
+    svm, scaler, model_columns, data_info = load_joblib_model(model_dir)
+    if len(svm.classes_) != 2 or not getattr(svm, "probability", False):
+        raise ArtifactError("Only binary SVMs saved with probability=True can be exported.")
+    if hasattr(svm, "feature_names_in_") and list(svm.feature_names_in_) != list(model_columns):
+        raise ArtifactError("model_columns.json does not match the feature layout the SVM model was trained on.")
+
+    arrays = {
+        "classes": np.asarray(svm.classes_, dtype=np.int64),
+        "support_vectors": np.asarray(svm.support_vectors_, dtype=np.float64),
+        "dual_coef": np.asarray(svm.dual_coef_, dtype=np.float64),
+        "intercept": np.asarray(svm.intercept_, dtype=np.float64),
+        "prob_a": np.asarray(svm.probA_, dtype=np.float64),
+        "prob_b": np.asarray(svm.probB_, dtype=np.float64),
+        "scaler_mean": np.asarray(scaler.mean_, dtype=np.float64),
+        "scaler_scale": np.asarray(scaler.scale_, dtype=np.float64),
+    }
+
+    # Offsets are relative to the start of the array section, which is itself aligned
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = {
+        "svm": {
+            "kernel": svm.kernel,
+            "gamma": float(svm._gamma),
+            "coef0": float(svm.coef0),
+            "degree": int(svm.degree),
+        },
+        "model_columns": list(model_columns),
+        "data_info": data_info,
+        "sources": {
+            name: _file_sha256(os.path.join(model_dir, name)) for name in SOURCE_FILES
+        },
+        "arrays": layout,
+    }
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    data_start = -(-(_PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    body = bytearray(data_start + offset)
+    _PREAMBLE.pack_into(body, 0, ARTIFACT_MAGIC, ARTIFACT_VERSION, len(header_bytes))
+    body[_PREAMBLE.size:_PREAMBLE.size + len(header_bytes)] = header_bytes
+    for name, array in arrays.items():
+        start = data_start + layout[name]["offset"]
+        body[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    body += hashlib.sha256(body).digest()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return header
+
+
+def load_artifact(path: str, verify: bool = True) -> ModelArtifact:
+    """
+    Maps the artifact read-only and returns it. The arrays are views into the
+    mapping rather than copies, so every process that loads the same file
+    shares one copy of the pages. With `verify`, the trailing checksum is
+    checked first.
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:  # an empty file cannot be mapped
+            raise ArtifactError(f"{path} is not a model artifact.") from e
+
+    if len(buffer) < _PREAMBLE.size + _DIGEST_SIZE:
+        raise ArtifactError(f"{path} is not a model artifact.")
+    magic, version, header_size = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != ARTIFACT_MAGIC:
+        raise ArtifactError(f"{path} is not a model artifact.")
+    if version != ARTIFACT_VERSION:
+        raise ArtifactError(
+            f"{path} has artifact version {version}, expected {ARTIFACT_VERSION}. Re-run model_artifact.py."
+        )
+    if verify:
+        content = memoryview(buffer)[:-_DIGEST_SIZE]
+        digest = hashlib.sha256(content).digest()
+        content.release()
+        if digest != buffer[-_DIGEST_SIZE:]:
+            raise ArtifactError(f"{path} failed its checksum; it is corrupt or truncated.")
+
+    header = json.loads(buffer[_PREAMBLE.size:_PREAMBLE.size + header_size])
+    data_start = -(-(_PREAMBLE.size + header_size) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]
+        ).reshape(spec["shape"])
+    return ModelArtifact(path, header, arrays, digest=bytes(buffer[-_DIGEST_SIZE:]).hex())
+
+
+# Loads the model one way in a fresh interpreter and prints load time and memory as JSON.
+_BENCHMARK_SCRIPT = """
+import json, sys, time
+import numpy as np
+import model_artifact
+
+def rss_kib():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields[name] = int(value.split()[0]) if value.strip().endswith("kB") else None
+    return fields.get("RssAnon"), fields.get("VmRSS")
+
+anon_before, rss_before = rss_kib()
+start = time.perf_counter()
+if sys.argv[1] == "joblib":
+    model_artifact.load_joblib_model(sys.argv[2])
+else:
+    model_artifact.load_artifact(sys.argv[2])
+elapsed = time.perf_counter() - start
+anon_after, rss_after = rss_kib()
+print(json.dumps({"seconds": elapsed, "private_kib": anon_after - anon_before, "rss_kib": rss_after - rss_before}))
+"""
+
+
+def benchmark(model_dir: str, path: str, runs: int = 5) -> Dict[str, dict]:
+    """
+    Loads the model with joblib and from the artifact, each in `runs` fresh
+    interpreters (NumPy already imported), and returns the median load time and
+    growth in private (anonymous) and total resident memory. Only private
+    memory is paid again by every worker; mapped file pages are shared.
+    """
+    results = {}
+    for kind, target in (("joblib", model_dir), ("artifact", path)):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-W", "ignore", "-c", _BENCHMARK_SCRIPT, kind, target],
+                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        results[kind] = {
+            metric: float(np.median([sample[metric] for sample in samples])) for metric in samples[0]
+        }
+    return results
+
+
+def main():
+    default_dir = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_model"))
+    parser = argparse.ArgumentParser(description="Compile saved_model/ into a memory-mapped serving artifact.")
+    parser.add_argument("--model-dir", default=default_dir, help="Directory with the joblib and JSON model files.")
+    parser.add_argument("--output", help=f"Where to write the artifact (default: <model-dir>/{ARTIFACT_FILENAME}).")
+    parser.add_argument("--benchmark", action="store_true", help="Compare load time and memory against joblib.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per benchmark (medians are reported).")
+    args = parser.parse_args()
+    path = args.output or os.path.join(args.model_dir, ARTIFACT_FILENAME)
+
+    header = export_artifact(args.model_dir, path)
+    artifact = load_artifact(path)
+    print(f"Wrote {path} ({os.path.getsize(path):,} bytes, version {ARTIFACT_VERSION}, "
+          f"{artifact.svm.kernel} kernel, {len(artifact.svm.support_vectors_)} support vectors, "
+          f"{len(header['model_columns'])} features)")
+
+    if args.benchmark:
+        results = benchmark(args.model_dir, path, args.runs)
+        for kind, result in results.items():
+            print(f"{kind:>8}: load {result['seconds'] * 1e3:7.1f} ms, "
+                  f"private memory +{result['private_kib'] / 1024:6.1f} MiB, "
+                  f"resident +{result['rss_kib'] / 1024:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
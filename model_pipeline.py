@@ -1,26 +1,687 @@
 # model_pipeline.py
-import pandas as pd
-import joblib
-import json
-from typing import Tuple
+import numpy as np
+import concurrent.futures
+import os
+import random
+import threading
+import time
+import warnings
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from metrics import MODEL_RELOADS, PREDICTION_LOOKUPS, SHADOW_COMPARISONS, SHADOW_DROPPED, SHADOW_DURATION
+from model_artifact import ARTIFACT_FILENAME, SOURCE_FILES, ArtifactError, load_artifact, load_joblib_model
+from prediction_batcher import PredictionBatcher
+from prediction_table import TABLE_FILENAME, PredictionCache, TableError, load_table_for
+from profiling import profiled
+
+# Resolved next to this file rather than the working directory, so the app can
+# be started from anywhere. MODEL_DIR points it at another artifact directory.
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_model"))
+MODEL_ARTIFACT_PATH = os.getenv("MODEL_ARTIFACT_PATH", os.path.join(MODEL_DIR, ARTIFACT_FILENAME))
+
+# Memoized predictions (see prediction_table.py): LRU entries per model version
+# (0 = no cache), and whether to use a precomputed prediction table when the
+# model directory has one.
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+USE_PREDICTION_TABLE = os.getenv("PREDICTION_TABLE", "1").lower() in ("1", "true", "yes", "on")
+
+# Micro-batching of the single predictions that reach the model (see
+# prediction_batcher.py): the most requests scored in one call (1, the default,
+# = no batching) and how long the first of them may wait for others.
+PREDICTION_BATCH_MAX_SIZE = int(os.getenv("PREDICTION_BATCH_MAX_SIZE", "1"))
+PREDICTION_BATCH_WAIT_MS = float(os.getenv("PREDICTION_BATCH_WAIT_MS", "2"))
+
+
+def _artifact_path(model_dir: str) -> str:
+    return MODEL_ARTIFACT_PATH if model_dir == MODEL_DIR else os.path.join(model_dir, ARTIFACT_FILENAME)
+
+
+def _load_model_files(model_dir: str = MODEL_DIR):
+    """
+    Prefers the memory-mapped artifact built by model_artifact.py, which every
+    worker shares and which needs no scikit-learn. Falls back to unpickling the
+    joblib files when the artifact is missing or older than them. Returns
+    (model, scaler, model_columns, data_info, source).
+    """
+    artifact_path = _artifact_path(model_dir)
+    if os.path.exists(artifact_path):
+        try:
+            artifact = load_artifact(artifact_path)
+        except ArtifactError as e:
+            warnings.warn(f"{e} Loading the joblib model files instead.")
+        else:
+            if not artifact.is_stale(model_dir):
+                return (artifact.svm, artifact.scaler, artifact.model_columns, artifact.data_info,
+                        f"artifact:{artifact.digest[:12]}")
+            warnings.warn(
+                f"{artifact_path} is older than the model files in {model_dir}; loading those instead. "
+                "Re-run `python model_artifact.py` to rebuild it."
+            )
+    return (*load_joblib_model(model_dir), "joblib")
+
+
+CATEGORICAL_FEATURES = {
+    # input key -> (name of the column after renaming, top-75 list key in data_info)
+    'ethnicity': ('ethnicity', 'ethnicity_top_75'),
+    'country_of_residence': ('contry_of_res', 'country_top_75'),
+}
+COLS_TO_SCALE = ['age', 'result']
+# Inputs every scored user must have. The encoder zero-fills a missing one
+# instead of failing, which would silently score a different questionnaire.
+REQUIRED_FIELDS = ('age', 'gender', 'ethnicity', 'country_of_residence', 'jundice', 'austim',
+                   *(f"A{i}" for i in range(1, 11)))
+
+
+class FeatureEncoder:
+    """
+    Encodes a user-data dict straight into a model-ready NumPy row.
+
+    Everything that does not depend on the user is worked out once at load time:
+    the column positions, the top-75 category sets, the column each category
+    value one-hot encodes into, and the scaler parameters. The resulting rows are
+    bit-identical to the pandas path in `_preprocess_dataframe`.
+    """
+
+    def __init__(self, model_columns: list, data_info: dict, scaler):
+        self.columns = list(model_columns)
+        self.column_index = {col: i for i, col in enumerate(self.columns)}
+        self.n_features = len(self.columns)
+        self.jaundice_mode = data_info['jaundice_mode']
+
+        # Maps each input key to its category set and the column index each kept
+        # category lands in (None when `reindex` would drop the dummy column).
+        # Dummy names follow `pd.get_dummies`: "<renamed column>_processed_<value>".
+        self.categorical = {}
+        for key, (renamed, top_key) in CATEGORICAL_FEATURES.items():
+            top = frozenset(data_info[top_key])
+            prefix = f"{renamed}_processed_"
+            one_hot = {value: self.column_index.get(prefix + value) for value in top | {'Others'}}
+            self.categorical[key] = (top, one_hot)
+
+        # Plain columns are copied through as-is, except for the scaled ones.
+        skipped = set(CATEGORICAL_FEATURES) | {renamed for renamed, _ in CATEGORICAL_FEATURES.values()}
+        self.passthrough = {col: i for col, i in self.column_index.items() if col not in skipped}
+        self.scaling = {
+            self.column_index[col]: (float(scaler.mean_[j]), float(scaler.scale_[j]))
+            for j, col in enumerate(COLS_TO_SCALE)
+        }
+        self._scale_index = np.array(list(self.scaling), dtype=np.intp)
+        self._scale_mean = np.array([mean for mean, _ in self.scaling.values()])
+        self._scale_std = np.array([scale for _, scale in self.scaling.values()])
+
+    def prepare(self, user_data: dict) -> dict:
+        """Fills in the derived 'result' score and resolves an 'unsure' jaundice answer."""
+        user_data['result'] = sum(v for k, v in user_data.items() if k.startswith('A'))
+        if user_data.get('jundice') == 'unsure':
+            user_data['jundice'] = self.jaundice_mode
+        return user_data
+
+    def encode(self, user_data: dict, out: np.ndarray = None, scale: bool = True) -> np.ndarray:
+        """
+        Writes the encoded features of one prepared user into `out` (a zeroed
+        float64 row of length `n_features`) and returns it. With `scale=False`
+        the age/result columns are left raw for a later `scale_rows` call.
+        """
+        if out is None:
+            out = np.zeros(self.n_features, dtype=np.float64)
+
+        for key, (top, one_hot) in self.categorical.items():
+            value = user_data[key]
+            index = one_hot[value if value in top else 'Others']
+            if index is not None:
+                out[index] = 1.0
+
+        passthrough = self.passthrough
+        for key, value in user_data.items():
+            index = passthrough.get(key)
+            if index is not None:
+                out[index] = value
+
+        if scale:
+            for index, (mean, std) in self.scaling.items():
+                out[index] = (out[index] - mean) / std
+        return out
+
+    def scale_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Standardizes the age/result columns of a 2D block of encoded rows in place."""
+        rows[:, self._scale_index] = (rows[:, self._scale_index] - self._scale_mean) / self._scale_std
+        return rows
+
+    def encode_records(self, records: Sequence[dict]) -> np.ndarray:
+        """Encodes a list of user-data dicts into an (n, n_features) matrix."""
+        rows = np.zeros((len(records), self.n_features), dtype=np.float64)
+        for i, record in enumerate(records):
+            self.encode(self.prepare(dict(record)), out=rows[i], scale=False)
+        return self.scale_rows(rows)
+
+    def encode_columns(self, columns: Mapping[str, Sequence]) -> np.ndarray:
+        """
+        Encodes columnar user data (column name -> equal-length sequence, e.g. a
+        DataFrame or `DataFrame.to_dict('list')`) into an (n, n_features) matrix,
+        one column at a time.
+        """
+        values = {key: list(columns[key]) for key in columns.keys()}
+        lengths = {len(column) for column in values.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length.")
+        n_rows = lengths.pop() if lengths else 0
+        rows = np.zeros((n_rows, self.n_features), dtype=np.float64)
+
+        if 'jundice' in values:
+            values['jundice'] = [self.jaundice_mode if v == 'unsure' else v for v in values['jundice']]
+        score_keys = [key for key in values if key.startswith('A')]
+        values['result'] = [sum(scores) for scores in zip(*(values[key] for key in score_keys))] \
+            if score_keys else [0] * n_rows
+
+        for key, (top, one_hot) in self.categorical.items():
+            indices = [one_hot[v if v in top else 'Others'] for v in values[key]]
+            kept = [(i, index) for i, index in enumerate(indices) if index is not None]
+            if kept:
+                row_ids, col_ids = zip(*kept)
+                rows[list(row_ids), list(col_ids)] = 1.0
+
+        for key, column in values.items():
+            index = self.passthrough.get(key)
+            if index is not None:
+                rows[:, index] = np.asarray(column, dtype=np.float64)
+
+        return self.scale_rows(rows)
+
+
+class SVMEngine:
+    """
+    Single-pass inference for a binary sklearn `SVC` trained with probability=True.
+
+    The support vectors, dual coefficients, intercept, kernel parameters and
+    Platt `probA_`/`probB_` are pulled out of the fitted model once. Each call
+    then evaluates the kernel a single time to get the decision value and
+    derives both the class and its calibrated confidence from it, instead of
+    running the kernel once for `predict` and again for `predict_proba`. A
+    linear kernel collapses to one dot product with a precomputed weight vector.
+    """
+
+    # libsvm clips the pairwise sigmoid output to keep the coupling well-defined.
+    MIN_PROB = 1e-7
+    # Below this many rows, per-row Python floats beat NumPy's per-op overhead.
+    SCALAR_COUPLING_ROWS = 8
+
+    def __init__(self, svm):
+        if len(svm.classes_) != 2:
+            raise RuntimeError("SVMEngine only supports binary classifiers.")
+        if not getattr(svm, 'probability', False) or len(getattr(svm, 'probA_', ())) != 1:
+            raise RuntimeError("The SVM model must be saved with probability=True.")
+
+        self.classes = np.asarray(svm.classes_)
+        self.kernel = svm.kernel
+        self.gamma = float(svm._gamma)
+        self.coef0 = float(svm.coef0)
+        self.degree = svm.degree
+        self.intercept = float(svm.intercept_[0])
+        self.prob_a = float(svm.probA_[0])
+        self.prob_b = float(svm.probB_[0])
+
+        support_vectors = np.ascontiguousarray(svm.support_vectors_, dtype=np.float64)
+        dual_coef = np.ascontiguousarray(svm.dual_coef_[0], dtype=np.float64)
+        if self.kernel == 'linear':
+            self.weights = dual_coef @ support_vectors
+        elif self.kernel in ('rbf', 'poly', 'sigmoid'):
+            self.support_vectors = support_vectors
+            self.dual_coef = dual_coef
+            self.sv_sq_norms = np.einsum('ij,ij->i', support_vectors, support_vectors)
+        else:
+            raise RuntimeError(f"Unsupported SVM kernel: {self.kernel!r}")
+
+    def decision_function(self, features: np.ndarray) -> np.ndarray:
+        """Returns the signed distance to the hyperplane for each row, like `SVC.decision_function`."""
+        if self.kernel == 'linear':
+            return features @ self.weights + self.intercept
+
+        dot = features @ self.support_vectors.T
+        if self.kernel == 'rbf':
+            sq_dist = np.einsum('ij,ij->i', features, features)[:, None] - 2.0 * dot + self.sv_sq_norms
+            kernel = np.exp(-self.gamma * np.maximum(sq_dist, 0.0))
+        elif self.kernel == 'poly':
+            kernel = (self.gamma * dot + self.coef0) ** self.degree
+        else:
+            kernel = np.tanh(self.gamma * dot + self.coef0)
+        return kernel @ self.dual_coef + self.intercept
+
+    def predict_with_confidence(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the predicted class and the calibrated probability of that class
+        for each row, matching `SVC.predict` and `SVC.predict_proba`.
+        """
+        decision = self.decision_function(features)
+        positive = decision >= 0
+        prob_first = self._prob_first_class(decision)
+        confidence = np.where(positive, 1.0 - prob_first, prob_first)
+        return self.classes[positive.astype(np.intp)], confidence
+
+    def _prob_first_class(self, decision: np.ndarray) -> np.ndarray:
+        """
+        Probability of `classes_[0]`, reproducing libsvm's `svm_predict_probability`
+        for two classes: a clipped Platt sigmoid on libsvm's decision value (the
+        negated sklearn one), followed by the iterative pairwise coupling with
+        its early stopping, so the result tracks sklearn rather than the raw sigmoid.
+        """
+        f_apb = -decision * self.prob_a + self.prob_b
+        with np.errstate(over='ignore'):
+            sigmoid = np.where(
+                f_apb >= 0,
+                np.exp(-np.abs(f_apb)) / (1.0 + np.exp(-np.abs(f_apb))),
+                1.0 / (1.0 + np.exp(-np.abs(f_apb))),
+            )
+        r01 = np.clip(sigmoid, self.MIN_PROB, 1.0 - self.MIN_PROB)
+        if len(r01) <= self.SCALAR_COUPLING_ROWS:
+            return np.array([self._couple(r) for r in r01.tolist()])
+        r10 = 1.0 - r01
+
+        # multiclass_probability() with k = 2, one NumPy lane per row
+        q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+        p0 = np.full_like(decision, 0.5)
+        p1 = np.full_like(decision, 0.5)
+        eps = 0.005 / 2
+        active = np.ones(decision.shape, dtype=bool)
+        for _ in range(100):
+            qp0 = q00 * p0 + q01 * p1
+            qp1 = q01 * p0 + q11 * p1
+            pqp = p0 * qp0 + p1 * qp1
+            active &= np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= eps
+            if not active.any():
+                break
+
+            diff = (-qp0 + pqp) / q00
+            new_p0 = p0 + diff
+            pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+            qp0, qp1 = (qp0 + diff * q00) / (1 + diff), (qp1 + diff * q01) / (1 + diff)
+            new_p0, new_p1 = new_p0 / (1 + diff), p1 / (1 + diff)
+
+            diff = (-qp1 + pqp) / q11
+            new_p1 = new_p1 + diff
+            new_p0, new_p1 = new_p0 / (1 + diff), new_p1 / (1 + diff)
+
+            p0 = np.where(active, new_p0, p0)
+            p1 = np.where(active, new_p1, p1)
+        return p0
+
+    @staticmethod
+    def _couple(r01: float) -> float:
+        """Scalar version of the two-class pairwise coupling in `_prob_first_class`."""
+        r10 = 1.0 - r01
+        q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+        p0 = p1 = 0.5
+        for _ in range(100):
+            qp0 = q00 * p0 + q01 * p1
+            qp1 = q01 * p0 + q11 * p1
+            pqp = p0 * qp0 + p1 * qp1
+            if max(abs(qp0 - pqp), abs(qp1 - pqp)) < 0.005 / 2:
+                break
+
+            diff = (-qp0 + pqp) / q00
+            p0 += diff
+            pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+            qp1 = (qp1 + diff * q01) / (1 + diff)
+            p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+
+            diff = (-qp1 + pqp) / q11
+            p1 += diff
+            p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+        return p0
+
+
+# --- Model Versions and Hot Reload ---
+# The live model is whatever `registry.active` points to. A new model directory
+# is loaded and validated off the request path and then swapped in with one
+# reference assignment, so a request always scores with a single consistent
+# version and none is dropped. `encoder`, `engine`, `model`, `scaler`,
+# `model_columns` and `data_info` are still importable from this module and
+# resolve to the active version at the time of the import.
+
+class ModelValidationError(RuntimeError):
+    pass
+
+
+class ModelVersion:
+    """One loaded model: the encoder and engine that score with it, and where it came from."""
+
+    def __init__(self, number: int, model_dir: str, source: str, model, scaler, model_columns: list,
+                 data_info: dict):
+        self.number = number
+        self.model_dir = model_dir
+        self.source = source
+        self.model = model
+        self.scaler = scaler
+        self.model_columns = model_columns
+        self.data_info = data_info
+        self.encoder = FeatureEncoder(model_columns, data_info, scaler)
+        self.engine = SVMEngine(model)
+        if hasattr(model, 'feature_names_in_') and list(model.feature_names_in_) != self.encoder.columns:
+            raise RuntimeError("model_columns.json does not match the feature layout the SVM model was trained on.")
+        self.cache = PredictionCache(PREDICTION_CACHE_SIZE) if PREDICTION_CACHE_SIZE > 0 else None
+        self.table = None
+        if USE_PREDICTION_TABLE:
+            try:
+                self.table = load_table_for(model_dir, self.encoder, self.engine)
+            except TableError as e:
+                warnings.warn(f"{e} Scoring without it.")
+        self.loaded_at = time.time()
+        self.fingerprint = _source_fingerprint(model_dir)
+
+    def predict_one(self, user_data: dict) -> Tuple[int, float]:
+        """
+        Scores one prepared user: from the prediction table when it covers the
+        input, else from the cache, else with the engine (and caches the result).
+        """
+        hit, features = self.lookup(user_data)
+        if hit is not None:
+            return hit
+        result = self.score_rows(features)[0]
+        self.remember(features, result)
+        return result
+
+    def lookup(self, user_data: dict) -> Tuple[Optional[Tuple[int, float]], Optional[np.ndarray]]:
+        """
+        The memoized result for one prepared user from the table or the cache,
+        or None and the user's encoded row (1 x features) to score.
+        """
+        if self.table is not None:
+            hit = self.table.lookup(user_data)
+            if hit is not None:
+                PREDICTION_LOOKUPS.inc(source="table")
+                return hit, None
+
+        features = self.encoder.encode(user_data).reshape(1, -1)
+        if self.cache is not None:
+            hit = self.cache.get(features.tobytes())
+            if hit is not None:
+                PREDICTION_LOOKUPS.inc(source="cache")
+                return hit, None
+        return None, features
+
+    def score_rows(self, features: np.ndarray) -> List[Tuple[int, float]]:
+        predictions, confidences = self.engine.predict_with_confidence(features)
+        return list(zip(predictions.astype(int).tolist(), confidences.astype(float).tolist()))
+
+    def remember(self, features: np.ndarray, result: Tuple[int, float]):
+        """Caches the engine's result for a row that `lookup` missed."""
+        if self.cache is not None:
+            self.cache.put(features.tobytes(), result)
+        PREDICTION_LOOKUPS.inc(source="model")
+
+    def describe(self) -> dict:
+        return {
+            "version": self.number, "model_dir": self.model_dir, "source": self.source,
+            "loaded_at": self.loaded_at,
+            "prediction_table": {"path": self.table.path, "cells": self.table.size} if self.table else None,
+            "prediction_cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+def _source_fingerprint(model_dir: str) -> tuple:
+    """Size and modification time of every file a model is loaded from, to notice a redeploy."""
+    paths = [_artifact_path(model_dir), os.path.join(model_dir, TABLE_FILENAME)]
+    paths += [os.path.join(model_dir, name) for name in SOURCE_FILES]
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+def validation_records() -> List[dict]:
+    """
+    Complete questionnaires every new model must score sanely: each possible
+    `result` score with every jaundice/family-history/gender combination, at a
+    few ages and category values.
+    """
+    records = []
+    rng = random.Random(0)
+    score_keys = [f"A{i}" for i in range(1, 11)]
+    for score in range(len(score_keys) + 1):
+        for jundice in (0, 1, 'unsure'):
+            for austim in (0, 1):
+                for gender in (0, 1):
+                    for age in (18, 30, 45, 64):
+                        answers = dict.fromkeys(score_keys, 0)
+                        answers.update(dict.fromkeys(rng.sample(score_keys, score), 1))
+                        records.append({
+                            'age': age, 'gender': gender, 'jundice': jundice, 'austim': austim,
+                            'ethnicity': rng.choice(['White-European', 'Asian', 'Others', 'Unknown']),
+                            'country_of_residence': rng.choice(['United States', 'India', 'Others', 'Atlantis']),
+                            **answers,
+                        })
+    return records
+
+
+def validate_model_version(version: ModelVersion, reference: Optional[ModelVersion] = None,
+                           min_agreement: float = 0.0) -> dict:
+    """
+    Scores `validation_records()` with `version` and raises ModelValidationError
+    unless every prediction is one of the model's classes with a finite
+    confidence in [0, 1]. With a `reference`, also reports (and with
+    `min_agreement`, enforces) the share of predictions they agree on.
+    """
+    records = validation_records()
+    try:
+        predictions, confidences = version.engine.predict_with_confidence(version.encoder.encode_records(records))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ModelValidationError(f"The model in {version.model_dir} cannot score the validation set: {e}") from e
+    if not np.all(np.isin(predictions, version.engine.classes)):
+        raise ModelValidationError(f"The model in {version.model_dir} predicts unknown classes.")
+    if not np.all(np.isfinite(confidences)) or np.any(confidences < 0) or np.any(confidences > 1):
+        raise ModelValidationError(f"The model in {version.model_dir} returns invalid confidences.")
+
+    report = {"rows": len(records), "positive_rate": float(np.mean(predictions == version.engine.classes[1]))}
+    if reference is not None:
+        reference_predictions, _ = reference.engine.predict_with_confidence(reference.encoder.encode_records(records))
+        report["agreement"] = float(np.mean(predictions == reference_predictions))
+        if report["agreement"] < min_agreement:
+            raise ModelValidationError(
+                f"The model in {version.model_dir} agrees with the live model on {report['agreement']:.1%} "
+                f"of the validation set, below the required {min_agreement:.1%}."
+            )
+    return report
+
+
+def load_model_version(model_dir: str = MODEL_DIR, number: int = 1) -> ModelVersion:
+    try:
+        model, scaler, model_columns, data_info, source = _load_model_files(model_dir)
+    except FileNotFoundError:
+        raise RuntimeError("Model files not found. Please run the training notebook to generate them, ensuring the model is saved with probability=True.")
+    return ModelVersion(number, model_dir, source, model, scaler, model_columns, data_info)
+
+
+class ShadowScorer:
+    """
+    Scores the same inputs as the live model with a candidate model on a
+    background thread, and keeps agreement and latency statistics. Requests
+    only pay for handing the input over; when the queue is full, inputs are
+    dropped instead of slowing requests down.
+    """
+
+    def __init__(self, candidate: ModelVersion, sample_rate: float = 1.0, max_pending: int = 256):
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.started_at = time.time()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"rows": 0, "agreed": 0, "dropped": 0, "errors": 0, "confidence_abs_diff": 0.0,
+                       "live_seconds": 0.0, "candidate_seconds": 0.0}
+
+    def submit(self, records, live_predictions: np.ndarray, live_confidences: np.ndarray, live_seconds: float):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["dropped"] += 1
+                SHADOW_DROPPED.inc()
+                return
+            self._pending += 1
+        try:
+            self._executor.submit(self._score, records, live_predictions, live_confidences, live_seconds)
+        except RuntimeError:  # shut down while this request was in flight
+            with self._lock:
+                self._pending -= 1
+
+    def _score(self, records, live_predictions, live_confidences, live_seconds):
+        try:
+            start = time.perf_counter()
+            encoder = self.candidate.encoder
+            features = encoder.encode_columns(records) if hasattr(records, 'keys') else encoder.encode_records(records)
+            predictions, confidences = self.candidate.engine.predict_with_confidence(features)
+            candidate_seconds = time.perf_counter() - start
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            SHADOW_COMPARISONS.inc(len(live_predictions), outcome="error")
+            return
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        agreed = int(np.sum(predictions == live_predictions))
+        with self._lock:
+            self._stats["rows"] += len(predictions)
+            self._stats["agreed"] += agreed
+            self._stats["confidence_abs_diff"] += float(np.sum(np.abs(confidences - live_confidences)))
+            self._stats["live_seconds"] += live_seconds
+            self._stats["candidate_seconds"] += candidate_seconds
+        SHADOW_COMPARISONS.inc(agreed, outcome="agree")
+        SHADOW_COMPARISONS.inc(len(predictions) - agreed, outcome="disagree")
+        SHADOW_DURATION.observe(live_seconds, model="live")
+        SHADOW_DURATION.observe(candidate_seconds, model="candidate")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        rows = stats["rows"]
+        return {
+            "candidate": self.candidate.describe(),
+            "sample_rate": self.sample_rate,
+            "started_at": self.started_at,
+            "rows": rows,
+            "agreement": stats["agreed"] / rows if rows else None,
+            "mean_confidence_abs_diff": stats["confidence_abs_diff"] / rows if rows else None,
+            "live_seconds": stats["live_seconds"],
+            "candidate_seconds": stats["candidate_seconds"],
+            "dropped": stats["dropped"],
+            "errors": stats["errors"],
+            "pending": stats["pending"],
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ModelRegistry:
+    """Holds the live model version, swaps in new ones, and runs an optional shadow candidate."""
+
+    def __init__(self, active: ModelVersion, min_agreement: float = 0.0):
+        self._active = active
+        self._next_number = active.number + 1
+        self.min_agreement = min_agreement
+        self.shadow: Optional[ShadowScorer] = None
+        self.last_reload: Optional[dict] = None
+        # Files that already failed to load or validate, so they are not retried until they change again
+        self._rejected_fingerprint = None
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-reload")
+
+    @property
+    def active(self) -> ModelVersion:
+        return self._active
+
+    def load(self, model_dir: Optional[str] = None) -> Tuple[ModelVersion, dict]:
+        """Loads and validates a model directory without touching the live version."""
+        with self._lock:
+            number, self._next_number = self._next_number, self._next_number + 1
+        version = load_model_version(model_dir or self._active.model_dir, number)
+        report = validate_model_version(version, self._active, self.min_agreement)
+        return version, report
+
+    def reload(self, model_dir: Optional[str] = None) -> ModelVersion:
+        """
+        Loads and validates `model_dir` (default: the live one again, e.g. after
+        a redeploy) and swaps it in. The live model keeps serving throughout,
+        and stays live if the new one fails to load or validate.
+        """
+        start = time.perf_counter()
+        try:
+            version, report = self.load(model_dir)
+        except Exception as e:
+            MODEL_RELOADS.inc(outcome="failed")
+            self._rejected_fingerprint = _source_fingerprint(model_dir or self._active.model_dir)
+            self.last_reload = {"ok": False, "error": str(e), "at": time.time()}
+            raise
+        previous, self._active = self._active, version
+        MODEL_RELOADS.inc(outcome="ok")
+        self.last_reload = {"ok": True, "at": time.time(), "seconds": time.perf_counter() - start,
+                            "previous_version": previous.number, "version": version.number, "validation": report}
+        return version
+
+    def reload_in_background(self, model_dir: Optional[str] = None) -> concurrent.futures.Future:
+        """Schedules `reload` on the registry's own thread; reloads run one at a time."""
+        return self._executor.submit(self.reload, model_dir)
+
+    def source_changed(self) -> bool:
+        """True if the live model's files have changed on disk since it was loaded (or last failed to)."""
+        fingerprint = _source_fingerprint(self._active.model_dir)
+        return fingerprint != self._active.fingerprint and fingerprint != self._rejected_fingerprint
+
+    def start_shadow(self, model_dir: str, sample_rate: float = 1.0) -> ShadowScorer:
+        """Loads and validates a candidate and starts scoring live traffic with it in the background."""
+        candidate, _ = self.load(model_dir)
+        shadow, self.shadow = self.shadow, ShadowScorer(candidate, sample_rate)
+        if shadow is not None:
+            shadow.close()
+        return self.shadow
+
+    def stop_shadow(self) -> Optional[dict]:
+        shadow, self.shadow = self.shadow, None
+        if shadow is None:
+            return None
+        shadow.close()
+        return shadow.stats()
+
+    def describe(self) -> dict:
+        return {
+            "active": self._active.describe(),
+            "source_changed": self.source_changed(),
+            "last_reload": self.last_reload,
+            "shadow": self.shadow.stats() if self.shadow is not None else None,
+        }
+
 
 # Load all the necessary files once when the module is imported
-try:
-    # IMPORTANT: The SVM model must be saved with probability=True
-    model = joblib.load('./saved_model/svm_model.joblib')
-    scaler = joblib.load('./saved_model/scaler.joblib')
-    with open('./saved_model/model_columns.json', 'r') as f:
-        model_columns = json.load(f)
-    with open('./saved_model/data_info.json', 'r') as f:
-        data_info = json.load(f)
-except FileNotFoundError:
-    raise RuntimeError("Model files not found. Please run the training notebook to generate them, ensuring the model is saved with probability=True.")
+registry = ModelRegistry(
+    load_model_version(MODEL_DIR),
+    min_agreement=float(os.getenv("MODEL_RELOAD_MIN_AGREEMENT", "0")),
+)
 
-def preprocess_and_predict(user_data: dict) -> Tuple[int, float]:
+
+def __getattr__(name: str):
+    if name in ('encoder', 'engine', 'model', 'scaler', 'model_columns', 'data_info'):
+        return getattr(registry.active, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _preprocess_dataframe(user_data: dict):
     """
-    Takes the final dictionary of user data, preprocesses it,
-    and returns the model's prediction and its confidence score.
+    Reference pandas implementation of the preprocessing. It is kept to check
+    the encoder against (see check_pipeline.py) and is not used for serving,
+    which is why pandas is only imported here.
     """
+    import pandas as pd
+
+    active = registry.active
+    data_info, model_columns, scaler = active.data_info, active.model_columns, active.scaler
+
     # 1. Calculate 'result' score
     result_score = sum(v for k, v in user_data.items() if k.startswith('A'))
     user_data['result'] = result_score
@@ -55,14 +716,143 @@ def preprocess_and_predict(user_data: dict) -> Tuple[int, float]:
     df_aligned = df.reindex(columns=model_columns, fill_value=0)
 
     # 7. Scale numerical features
-    cols_to_scale = ['age', 'result']
-    df_aligned[cols_to_scale] = scaler.transform(df_aligned[cols_to_scale])
+    df_aligned[COLS_TO_SCALE] = scaler.transform(df_aligned[COLS_TO_SCALE])
+    return df_aligned
+
+
+def _score_batched(items: List[Tuple[ModelVersion, np.ndarray]]) -> List[Tuple[Tuple[int, float], float]]:
+    """
+    Scores the rows queued in the batcher with one engine call per model
+    version among them. Each result comes with its row's share of the call's
+    time, which is what the shadow comparison counts rather than the wait.
+    """
+    results = [None] * len(items)
+    by_version: Dict[ModelVersion, List[int]] = {}
+    for i, (version, _) in enumerate(items):
+        by_version.setdefault(version, []).append(i)
+    for version, indices in by_version.items():
+        start = time.perf_counter()
+        scored = version.score_rows(np.vstack([items[i][1] for i in indices]))
+        seconds = (time.perf_counter() - start) / len(indices)
+        for i, result in zip(indices, scored):
+            results[i] = result, seconds
+    return results
+
+
+prediction_batcher = PredictionBatcher(
+    _score_batched, PREDICTION_BATCH_MAX_SIZE, PREDICTION_BATCH_WAIT_MS / 1000
+) if PREDICTION_BATCH_MAX_SIZE > 1 else None
+
+
+class _Prediction:
+    """
+    One call of `preprocess_and_predict` or `apreprocess_and_predict`: the
+    steps before and after the model is reached, which both share.
+    """
+
+    __slots__ = ("version", "shadow", "shadow_input", "seconds", "result", "features")
+
+    def __init__(self, user_data: dict):
+        # One version for the whole call, even if a new model is swapped in meanwhile
+        self.version, self.shadow = registry.active, registry.shadow
+        self.shadow_input = [dict(user_data)] if self.shadow is not None else None
+        start = time.perf_counter()
+
+        # 1. Derive 'result' and resolve an unsure jaundice answer
+        self.version.encoder.prepare(user_data)
+
+        # 2. Look the result up, or encode and scale the row to score
+        self.result, self.features = self.version.lookup(user_data)
+        # Time spent preparing, looking up and scoring, but not waiting in the
+        # batcher's queue, is what the shadow model is compared against
+        self.seconds = time.perf_counter() - start
+
+    def score(self) -> Tuple[Tuple[int, float], float]:
+        """Scores the row on its own; returns the result and the time it took, like `_score_batched`."""
+        start = time.perf_counter()
+        result = self.version.score_rows(self.features)[0]
+        return result, time.perf_counter() - start
+
+    def finish(self, scored: Optional[Tuple[Tuple[int, float], float]] = None) -> Tuple[int, float]:
+        """Caches the model's result, if it was scored, and hands the call to the shadow model."""
+        if scored is not None:
+            self.result, seconds = scored
+            self.seconds += seconds
+            self.version.remember(self.features, self.result)
+        if self.shadow is not None:
+            self.shadow.submit(self.shadow_input, np.array([self.result[0]]), np.array([self.result[1]]),
+                               self.seconds)
+        return self.result
+
+
+@profiled("preprocess_and_predict")
+def preprocess_and_predict(user_data: dict) -> Tuple[int, float]:
+    """
+    Takes the final dictionary of user data, preprocesses it,
+    and returns the model's prediction and its confidence score.
+    """
+    prediction = _Prediction(user_data)
+    if prediction.result is not None:
+        return prediction.finish()
+    # 3. Score it together with whatever other predictions are waiting in the batcher
+    if prediction_batcher is not None:
+        return prediction.finish(prediction_batcher.predict((prediction.version, prediction.features)))
+    return prediction.finish(prediction.score())
+
+
+@profiled("preprocess_and_predict")
+async def apreprocess_and_predict(user_data: dict) -> Tuple[int, float]:
+    """`preprocess_and_predict` for the event loop: waits for the batcher without holding a thread."""
+    prediction = _Prediction(user_data)
+    if prediction.result is not None:
+        return prediction.finish()
+    if prediction_batcher is not None:
+        return prediction.finish(await prediction_batcher.apredict((prediction.version, prediction.features)))
+    return prediction.finish(prediction.score())
+
+
+def _check_required_fields(records: Union[Sequence[dict], Mapping[str, Sequence]]):
+    """Raises ValueError naming the first record that lacks a required field (or has it empty)."""
+    if hasattr(records, 'keys'):
+        missing = [field for field in REQUIRED_FIELDS if field not in records]
+        if missing:
+            raise ValueError(f"Missing required fields: {', '.join(missing)}")
+        for field in REQUIRED_FIELDS:
+            for i, value in enumerate(records[field]):
+                if value is None or value == '':
+                    raise ValueError(f"Record {i} is missing required field '{field}'.")
+        return
+    for i, record in enumerate(records):
+        for field in REQUIRED_FIELDS:
+            value = record.get(field)
+            if value is None or value == '':
+                raise ValueError(f"Record {i} is missing required field '{field}'.")
+
+
+def preprocess_and_predict_batch(
+    records: Union[Sequence[dict], Mapping[str, Sequence]]
+) -> Tuple[List[int], List[float]]:
+    """
+    Batch version of `preprocess_and_predict`. Takes either a list of user-data
+    dicts or columnar data (column name -> sequence) and scores every row with
+    one vectorized encode, scale and model pass. Results keep the input order.
+    """
+    version, shadow = registry.active, registry.shadow
+    start = time.perf_counter()
+    _check_required_fields(records)
+    if hasattr(records, 'keys'):
+        features = version.encoder.encode_columns(records)
+    else:
+        features = version.encoder.encode_records(records)
+    if len(features) == 0:
+        return [], []
+    finite = np.isfinite(features).all(axis=1)
+    if not finite.all():
+        raise ValueError(f"Record {int(np.flatnonzero(~finite)[0])} has a non-finite numeric value.")
+
+    predictions, confidences = version.engine.predict_with_confidence(features)
 
-    # 8. Make prediction and get probabilities
-    prediction = model.predict(df_aligned)[0]
-    probabilities = model.predict_proba(df_aligned)[0]
-    
-    # Get the confidence score for the predicted class
-    confidence = probabilities[prediction]
+    if shadow is not None:
+        shadow.submit(records, predictions, confidences, time.perf_counter() - start)
+    return predictions.astype(int).tolist(), confidences.astype(float).tolist()
 
-    return int(prediction), float(confidence)
\ No newline at end of file
@@ -0,0 +1,166 @@
+# phrasing_pool.py
+"""
+Precomputed conversational phrasings for the screening questions.
+
+`node_ask_question` used to send SYSTEM_PROMPT to Gemini on every turn just to
+rephrase one of the fixed QUESTIONS. Instead, this module builds a pool of
+vetted phrasings per question key offline and stores it on disk, so the graph
+can pick one locally and only call the LLM when the pool has nothing fresh for
+that key.
+
+Build or refresh the pool with:
+    python phrasing_pool.py --per-question 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from prompts import QUESTIONS, SYSTEM_PROMPT
+
+POOL_VERSION = 1
+DEFAULT_POOL_PATH = os.getenv(
+    "PHRASING_POOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrasing_pool.json")
+)
+
+# A phrasing may add a short conversational lead-in, but nothing close to a paragraph.
+MAX_EXTRA_CHARS = 200
+
+
+def question_fingerprint(key: str) -> str:
+    """
+    Hashes the exact prompt a phrasing was generated from, so pool entries go
+    stale as soon as the question text or SYSTEM_PROMPT changes.
+    """
+    prompt = SYSTEM_PROMPT.format(question=QUESTIONS[key])
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _normalize(text: str) -> str:
+    text = text.replace("’", "'").replace("‘", "'").replace("“", '"').replace("”", '"')
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def is_valid_phrasing(phrasing: str, key: str) -> bool:
+    """A phrasing is kept only if it quotes the question verbatim and stays short."""
+    question = QUESTIONS[key]
+    phrasing = phrasing.strip()
+    return (
+        bool(phrasing)
+        and _normalize(question).rstrip(".?") in _normalize(phrasing)
+        and len(phrasing) <= len(question) + MAX_EXTRA_CHARS
+    )
+
+
+def load_pool(path: str = DEFAULT_POOL_PATH) -> Dict[str, List[str]]:
+    """
+    Reads the pool from disk and returns the phrasings for every key that is
+    still fresh. A missing, unreadable or older-version file yields an empty
+    pool, which simply sends every key back to the LLM.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != POOL_VERSION:
+        return {}
+
+    pool = {}
+    for key, entry in data.get("questions", {}).items():
+        if key in QUESTIONS and entry.get("fingerprint") == question_fingerprint(key):
+            phrasings = [p for p in entry.get("phrasings", []) if is_valid_phrasing(p, key)]
+            if phrasings:
+                pool[key] = phrasings
+    return pool
+
+
+def pick_phrasing(pool: Dict[str, List[str]], key: str) -> Optional[str]:
+    """Returns a random pooled phrasing for `key`, or None if the LLM has to be asked."""
+    phrasings = pool.get(key)
+    return random.choice(phrasings) if phrasings else None
+
+
+def generate_phrasings(llm, key: str, count: int, max_attempts: int) -> List[str]:
+    """Asks the LLM gateway for up to `count` distinct, vetted phrasings of one question."""
+    prompt = SYSTEM_PROMPT.format(question=QUESTIONS[key])
+    phrasings: List[str] = []
+    seen = set()
+    for _ in range(max_attempts):
+        if len(phrasings) >= count:
+            break
+        # Every attempt needs a fresh sample, so bypass the gateway's response cache
+        response = llm.generate_sync(
+            prompt, cache=False, purpose="phrasing_pool", question_key=key, generation_config={"temperature": 1.0}
+        )
+        phrasing = response.text.strip()
+        if is_valid_phrasing(phrasing, key) and _normalize(phrasing) not in seen:
+            seen.add(_normalize(phrasing))
+            phrasings.append(phrasing)
+    return phrasings
+
+
+def build_pool(llm, per_question: int, keys: Iterable[str], path: str = DEFAULT_POOL_PATH) -> Dict[str, int]:
+    """
+    Regenerates the phrasings for `keys` and writes the pool back to `path`,
+    keeping the fresh entries of every other key. Returns how many phrasings
+    each rebuilt key got.
+    """
+    fresh = load_pool(path)
+    questions = {
+        key: {"fingerprint": question_fingerprint(key), "phrasings": phrasings}
+        for key, phrasings in fresh.items()
+    }
+
+    built = {}
+    for key in keys:
+        phrasings = generate_phrasings(llm, key, per_question, max_attempts=per_question * 3)
+        questions[key] = {"fingerprint": question_fingerprint(key), "phrasings": phrasings}
+        built[key] = len(phrasings)
+
+    data = {
+        "version": POOL_VERSION,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "questions": {key: questions[key] for key in QUESTIONS if key in questions},
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precomputed question-phrasing pool.")
+    parser.add_argument("--per-question", type=int, default=8, help="Phrasings to keep per question.")
+    parser.add_argument("--output", default=DEFAULT_POOL_PATH, help="Where to write the pool.")
+    parser.add_argument("--keys", nargs="+", choices=list(QUESTIONS), help="Only rebuild these question keys.")
+    parser.add_argument("--all", action="store_true", help="Rebuild every key, not just missing or stale ones.")
+    args = parser.parse_args()
+
+    if args.keys:
+        keys = args.keys
+    elif args.all:
+        keys = list(QUESTIONS)
+    else:
+        fresh = load_pool(args.output)
+        keys = [key for key in QUESTIONS if len(fresh.get(key, [])) < args.per_question]
+
+    if not keys:
+        print(f"All {len(QUESTIONS)} questions already have fresh phrasings in {args.output}.")
+        return
+
+    from llm_gateway import gateway
+
+    built = build_pool(gateway, args.per_question, keys, args.output)
+    for key, count in built.items():
+        print(f"{key}: {count} phrasings")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# prediction_batcher.py
+"""
+Micro-batching of single predictions.
+
+When many screenings finish at about the same time, each one would score its
+single row with its own small model call. `PredictionBatcher` queues those
+calls instead: a background thread takes the first waiting request and, if
+others are already queued behind it, collects more for up to
+`max_wait_seconds` (counted from when the first one was queued) or until
+`max_batch_size` are waiting, scores them all with one call and resolves each
+caller's future. A request that finds nothing else queued is scored at once,
+so a lone prediction pays no wait; under load, requests pile up while the
+previous batch is scored and are taken together.
+
+Callers block on `predict` (from worker threads) or await `apredict` (on the
+event loop, without holding a thread). The batch size, the queueing delay of
+every request and the reason each batch was flushed are exported as metrics,
+to tune the two limits against each other.
+"""
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Sequence
+
+from metrics import PREDICTION_BATCH_FLUSHES, PREDICTION_BATCH_QUEUE_DELAY, PREDICTION_BATCH_SIZE
+
+_STOP = object()
+
+
+class PredictionBatcher:
+    """Collects single requests into batches for `score_batch`, which returns one result per item, in order."""
+
+    def __init__(self, score_batch: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 32,
+                 max_wait_seconds: float = 0.002):
+        self.score_batch = score_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait_seconds = max(max_wait_seconds, 0.0)
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, item) -> concurrent.futures.Future:
+        """Queues `item` and returns the future its result is delivered to."""
+        future = concurrent.futures.Future()
+        # Checked and queued under the lock, so nothing is queued behind `close`'s stop marker
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The prediction batcher is closed.")
+            if self._thread is None:
+                # Started on first use rather than at import, so forked uvicorn workers each get their own
+                self._thread = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+                self._thread.start()
+            self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def predict(self, item):
+        return self.submit(item).result()
+
+    async def apredict(self, item):
+        return await asyncio.wrap_future(self.submit(item))
+
+    def close(self):
+        """Scores what is already queued, then stops the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = [first], False
+            # Nothing else waiting means no burst to wait for: score it alone straight away
+            if self._queue.empty():
+                self._flush(batch, "idle")
+                continue
+            deadline = first[2] + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._flush(batch, "full" if len(batch) >= self.max_batch_size else "timeout")
+            if stop:
+                return
+
+    def _flush(self, batch: list, reason: str):
+        now = time.perf_counter()
+        # Callers that gave up (a cancelled apredict) are left out
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        for _, _, queued_at in batch:
+            PREDICTION_BATCH_QUEUE_DELAY.observe(now - queued_at)
+        PREDICTION_BATCH_SIZE.observe(len(batch))
+        PREDICTION_BATCH_FLUSHES.inc(reason=reason)
+
+        try:
+            results = self.score_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,335 @@
+# prediction_table.py
+"""
+Memoized predictions for the screening model.
+
+Everything the model sees is discrete: age is a whole number of years, gender,
+jaundice and family history are 0/1, the answers only reach the model through
+their sum `result` (0-10), and ethnicity and country fold into a handful of
+one-hot columns. So the prediction is a pure function of a small key, and two
+things can skip the SVM kernel:
+
+- `PredictionCache`, a bounded LRU of (prediction, confidence) keyed on the
+  encoded feature row. It is exact and always on (PREDICTION_CACHE_SIZE).
+- `PredictionTable`, the whole key space (or an age range of it) scored ahead
+  of time into a memory-mapped file of class plus float16 confidence, so a
+  prediction is one array lookup. Confidences are rounded to float16, about
+  three significant digits.
+
+Build or refresh the table after retraining with:
+    python prediction_table.py
+    python prediction_table.py --min-age 18 --max-age 40
+
+File layout (all integers little-endian), like model.bin:
+
+    magic     8 bytes   b"ASDTBL\\0\\0"
+    version   uint32    TABLE_VERSION
+    length    uint32    size of the JSON header in bytes
+    header    JSON      axes, category groups, model columns and source checksums
+    cells     raw       one (int8 class, float16 confidence) per key, C-ordered
+                        over the axes, aligned to ALIGNMENT bytes
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from model_artifact import ALIGNMENT, SOURCE_FILES, _file_sha256
+from prompts import QUESTIONS
+
+TABLE_MAGIC = b"ASDTBL\0\0"
+TABLE_VERSION = 1
+TABLE_FILENAME = "prediction_table.bin"
+
+CELL_DTYPE = np.dtype([("prediction", "i1"), ("confidence", "<f2")])
+# float16 keeps 10 bits of mantissa, so a confidence is off by at most this much
+CONFIDENCE_TOLERANCE = 2.0 ** -11
+
+SCORE_KEYS = [key for key in QUESTIONS if key.startswith('A')]
+BINARY_KEYS = ('gender', 'jundice', 'austim')
+CATEGORY_KEYS = ('ethnicity', 'country_of_residence')
+# Rows scored per engine call while building, to bound memory
+BUILD_CHUNK_ROWS = 65536
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+class TableError(RuntimeError):
+    """The table is missing, corrupt, or does not belong to the loaded model."""
+
+
+class PredictionCache:
+    """Thread-safe LRU of (prediction, confidence) keyed on the encoded feature row."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # row bytes -> (prediction, confidence)
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: bytes, entry: Tuple[int, float]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _category_groups(encoder, key: str) -> Tuple[Dict[str, int], int, list]:
+    """
+    Groups the values of a categorical input by the one-hot column they encode
+    into. Returns value -> group for the kept values, the group of every other
+    value, and the column of each group (None when no column is set).
+    """
+    top, one_hot = encoder.categorical[key]
+    columns = sorted(set(one_hot.values()), key=lambda index: -1 if index is None else index)
+    group_of_column = {index: group for group, index in enumerate(columns)}
+    groups = {value: group_of_column[one_hot[value]] for value in sorted(top)}
+    return groups, group_of_column[one_hot['Others']], columns
+
+
+class PredictionTable:
+    """The scored key space, backed by a mapped file or an in-memory array."""
+
+    def __init__(self, header: dict, cells: np.ndarray, path: Optional[str] = None):
+        self.header = header
+        self.cells = cells
+        self.path = path
+        self.min_age, self.max_age = header["age"]
+        self.n_results = header["n_results"]
+        self.categories = {
+            key: (spec["groups"], spec["other"]) for key, spec in header["categories"].items()
+        }
+        # The encoder copies these straight into the row, so inputs carrying
+        # them cannot be looked up (see `lookup`)
+        self.foreign_keys = frozenset(header["foreign_keys"])
+        # Flat index = sum of axis position * stride
+        self.strides = [int(np.prod(cells.shape[axis + 1:])) for axis in range(cells.ndim)]
+        flat = cells.reshape(-1)
+        self._predictions, self._confidences = flat["prediction"], flat["confidence"]
+
+    @property
+    def size(self) -> int:
+        return self.cells.size
+
+    def is_stale(self, model_dir: str) -> bool:
+        """True if a model source file in `model_dir` changed since the table was built."""
+        for name, checksum in self.header["sources"].items():
+            path = os.path.join(model_dir, name)
+            if os.path.exists(path) and _file_sha256(path) != checksum:
+                return True
+        return False
+
+    def lookup(self, user_data: dict) -> Optional[Tuple[int, float]]:
+        """
+        The (prediction, confidence) of a prepared user, or None when the input
+        falls outside the table (e.g. an age it was not built for, a non-binary
+        answer, or an unusual extra field), so the caller scores it normally.
+        """
+        if not self.foreign_keys.isdisjoint(user_data):
+            return None
+        try:
+            age = user_data['age']
+            position = int(age) - self.min_age
+            if position != age - self.min_age or not 0 <= position <= self.max_age - self.min_age:
+                return None
+            index = position * self.strides[0]
+            for axis, key in enumerate(BINARY_KEYS, start=1):
+                value = user_data[key]
+                if value != 0 and value != 1:
+                    return None
+                index += int(value) * self.strides[axis]
+            result = user_data['result']
+            if result != int(result) or not 0 <= result < self.n_results:
+                return None
+            index += int(result) * self.strides[4]
+            for axis, key in enumerate(CATEGORY_KEYS, start=5):
+                groups, other = self.categories[key]
+                index += groups.get(user_data[key], other) * self.strides[axis]
+        except (KeyError, TypeError, ValueError):
+            return None
+        return int(self._predictions[index]), float(self._confidences[index])
+
+    def spot_check(self, encoder, engine, samples: int = 64, seed: int = 0) -> int:
+        """Rescores `samples` random cells with the model and returns how many disagree."""
+        rng = np.random.default_rng(seed)
+        flat = rng.choice(self.size, size=min(samples, self.size), replace=False)
+        keys = np.stack(np.unravel_index(flat, self.cells.shape), axis=1)
+        rows = _encode_keys(encoder, self.header, keys)
+        predictions, confidences = engine.predict_with_confidence(rows)
+        expected = self.cells.reshape(-1)[flat]
+        return int(np.sum((expected["prediction"] != predictions)
+                          | (np.abs(expected["confidence"].astype(np.float64) - confidences) > CONFIDENCE_TOLERANCE)))
+
+
+def _encode_keys(encoder, header: dict, keys: np.ndarray) -> np.ndarray:
+    """Encodes table keys (one row of axis positions each) into scaled model rows."""
+    rows = np.zeros((len(keys), encoder.n_features), dtype=np.float64)
+    values = {
+        'age': keys[:, 0] + header["age"][0],
+        **{key: keys[:, axis] for axis, key in enumerate(BINARY_KEYS, start=1)},
+        'result': keys[:, 4],
+    }
+    for key, column in values.items():
+        index = encoder.passthrough.get(key)
+        if index is not None:
+            rows[:, index] = column
+    for axis, key in enumerate(CATEGORY_KEYS, start=5):
+        columns = header["categories"][key]["columns"]
+        for group, index in enumerate(columns):
+            if index is not None:
+                rows[keys[:, axis] == group, index] = 1.0
+    return encoder.scale_rows(rows)
+
+
+def build_table(encoder, engine, min_age: int = 18, max_age: int = 64, model_dir: Optional[str] = None) -> PredictionTable:
+    """Scores every key for ages `min_age`..`max_age` into an in-memory table."""
+    used_scores = [key for key in SCORE_KEYS if key in encoder.passthrough]
+    if used_scores:
+        raise TableError(f"The model uses individual answers ({', '.join(used_scores)}), not just their sum.")
+    if min_age > max_age:
+        raise TableError("--min-age must not be greater than --max-age.")
+
+    categories = {}
+    for key in CATEGORY_KEYS:
+        groups, other, columns = _category_groups(encoder, key)
+        categories[key] = {"groups": groups, "other": other, "columns": columns}
+    covered = {'age', 'result', *BINARY_KEYS}
+    header = {
+        "age": [min_age, max_age],
+        "n_results": len(SCORE_KEYS) + 1,
+        "categories": categories,
+        "foreign_keys": sorted(key for key in encoder.passthrough if key not in covered),
+        "model_columns": list(encoder.columns),
+        "sources": {
+            name: _file_sha256(os.path.join(model_dir, name))
+            for name in SOURCE_FILES if model_dir and os.path.exists(os.path.join(model_dir, name))
+        },
+    }
+    shape = (max_age - min_age + 1, 2, 2, 2, len(SCORE_KEYS) + 1,
+             len(categories['ethnicity']['columns']), len(categories['country_of_residence']['columns']))
+    header["shape"] = list(shape)
+
+    cells = np.empty(int(np.prod(shape)), dtype=CELL_DTYPE)
+    all_keys = np.indices(shape).reshape(len(shape), -1).T
+    for start in range(0, len(cells), BUILD_CHUNK_ROWS):
+        keys = all_keys[start:start + BUILD_CHUNK_ROWS]
+        predictions, confidences = engine.predict_with_confidence(_encode_keys(encoder, header, keys))
+        cells["prediction"][start:start + len(keys)] = predictions
+        cells["confidence"][start:start + len(keys)] = confidences
+    return PredictionTable(header, cells.reshape(shape))
+
+
+def save_table(table: PredictionTable, path: str):
+    header_bytes = json.dumps(table.header, sort_keys=True).encode("utf-8")
+    data_start = -(-(_PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    body = bytearray(data_start)
+    _PREAMBLE.pack_into(body, 0, TABLE_MAGIC, TABLE_VERSION, len(header_bytes))
+    body[_PREAMBLE.size:_PREAMBLE.size + len(header_bytes)] = header_bytes
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+        f.write(np.ascontiguousarray(table.cells).tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_table(path: str) -> PredictionTable:
+    """Maps the table read-only; every worker on the host shares its pages."""
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:  # an empty file cannot be mapped
+            raise TableError(f"{path} is not a prediction table.") from e
+
+    if len(buffer) < _PREAMBLE.size:
+        raise TableError(f"{path} is not a prediction table.")
+    magic, version, header_size = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != TABLE_MAGIC:
+        raise TableError(f"{path} is not a prediction table.")
+    if version != TABLE_VERSION:
+        raise TableError(f"{path} has table version {version}, expected {TABLE_VERSION}. Re-run prediction_table.py.")
+
+    header = json.loads(buffer[_PREAMBLE.size:_PREAMBLE.size + header_size])
+    data_start = -(-(_PREAMBLE.size + header_size) // ALIGNMENT) * ALIGNMENT
+    shape = tuple(header["shape"])
+    count = int(np.prod(shape))
+    if len(buffer) != data_start + count * CELL_DTYPE.itemsize:
+        raise TableError(f"{path} is truncated.")
+    cells = np.frombuffer(buffer, dtype=CELL_DTYPE, count=count, offset=data_start).reshape(shape)
+    return PredictionTable(header, cells, path)
+
+
+def load_table_for(model_dir: str, encoder, engine) -> Optional[PredictionTable]:
+    """
+    The table in `model_dir` if there is one and it belongs to this model:
+    same column layout, unchanged source files, and a sample of its cells
+    rescored identically. Raises TableError otherwise.
+    """
+    path = os.path.join(model_dir, TABLE_FILENAME)
+    if not os.path.exists(path):
+        return None
+    table = load_table(path)
+    if table.header["model_columns"] != list(encoder.columns) or table.is_stale(model_dir):
+        raise TableError(f"{path} was built for another model. Re-run prediction_table.py.")
+    if table.spot_check(encoder, engine):
+        raise TableError(f"{path} does not match the model's predictions. Re-run prediction_table.py.")
+    return table
+
+
+def main():
+    default_dir = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_model"))
+    parser = argparse.ArgumentParser(description="Precompute the model's prediction for every possible input.")
+    parser.add_argument("--model-dir", default=default_dir, help="Directory with the model files.")
+    parser.add_argument("--output", help=f"Where to write the table (default: <model-dir>/{TABLE_FILENAME}).")
+    parser.add_argument("--min-age", type=int, default=18, help="Youngest age in the table.")
+    parser.add_argument("--max-age", type=int, default=64, help="Oldest age in the table.")
+    args = parser.parse_args()
+    path = args.output or os.path.join(args.model_dir, TABLE_FILENAME)
+
+    from model_pipeline import load_model_version
+
+    version = load_model_version(args.model_dir)
+    start = time.perf_counter()
+    table = build_table(version.encoder, version.engine, args.min_age, args.max_age, args.model_dir)
+    save_table(table, path)
+    elapsed = time.perf_counter() - start
+
+    table = load_table(path)
+    mismatches = table.spot_check(version.encoder, version.engine, samples=1024)
+    if mismatches:
+        raise SystemExit(f"{mismatches} of 1024 sampled cells disagree with the model.")
+    axes = " x ".join(str(n) for n in table.cells.shape)
+    print(f"Wrote {path} ({os.path.getsize(path):,} bytes, {table.size:,} cells = {axes}) in {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
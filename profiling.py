@@ -0,0 +1,231 @@
+# profiling.py
+"""
+Opt-in profiling of single conversation turns.
+
+A profiled turn runs under cProfile from the moment the request arrives until
+its last byte is sent, streamed summaries included. Before Python 3.12, the
+request's profiler only sees its own thread, so graph nodes and
+`preprocess_and_predict` that run on worker threads are profiled on their own
+thread and merged in. From 3.12 on, cProfile is built on `sys.monitoring`,
+which covers every thread and allows one profiler at a time, so the request's
+profiler already sees them.
+Each node is also timed as a section. The result is written to PROFILE_DIR as
+a `.pstats` file, with a `.json` file next to it that holds the endpoint, the
+question key being answered, the duration and the section timings. Only the
+newest PROFILE_MAX_FILES profiles are kept.
+
+Turns are profiled either at random (PROFILE_SAMPLE_RATE) or on request with
+an `X-Profile: 1` header (see main.ProfilingMiddleware). Only one turn is
+profiled at a time per worker, because cProfile sees the whole event loop
+thread: while the profiled turn waits on Gemini, other requests' work on the
+same loop shows up in its profile too.
+
+Load a profile with:
+    python -m pstats profiles/<id>.pstats
+    snakeviz profiles/<id>.pstats
+"""
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+# Whether worker threads need a profiler of their own (see above)
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+
+class TurnProfile:
+    """The profilers, sections and tags of one profiled request."""
+
+    def __init__(self, endpoint: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.endpoint = endpoint
+        self.question_key = ""
+        self.started_at = time.time()
+        self.duration_seconds = None
+        self.sections: List[Dict] = []
+        self._profiler = cProfile.Profile()
+        self._thread_id = None
+        self._thread_profilers: List[cProfile.Profile] = []
+        self._thread_depth = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._start = time.perf_counter()
+        self._profiler.enable()
+
+    def stop(self):
+        self._profiler.disable()
+        self.duration_seconds = time.perf_counter() - self._start
+
+    @contextmanager
+    def section(self, name: str, question_key: str = ""):
+        """
+        Times a step of the turn. Off the request's own thread, the step is
+        also profiled on its thread (once, however deeply sections nest) where
+        the request's profiler cannot see it.
+        """
+        profiler = None
+        depth = getattr(self._thread_depth, "value", 0)
+        if PER_THREAD_PROFILERS and depth == 0 and threading.get_ident() != self._thread_id:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active; the step is only timed
+                profiler = None
+        self._thread_depth.value = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._thread_depth.value = depth
+            if profiler is not None:
+                profiler.disable()
+            with self._lock:
+                if profiler is not None:
+                    self._thread_profilers.append(profiler)
+                self.sections.append({
+                    "name": name, "question_key": question_key, "ms": round(elapsed * 1000, 3),
+                    "thread": "request" if threading.get_ident() == self._thread_id else "worker",
+                })
+
+    def metadata(self) -> dict:
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "question_key": self.question_key,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_seconds * 1000, 3) if self.duration_seconds is not None else None,
+            "sections": self.sections,
+        }
+
+    def save(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES) -> str:
+        """Writes `<id>.pstats` and `<id>.json` to `directory`, then drops the oldest beyond `max_files`."""
+        os.makedirs(directory, exist_ok=True)
+        stats = pstats.Stats(self._profiler)
+        with self._lock:
+            for profiler in self._thread_profilers:
+                stats.add(profiler)
+        path = os.path.join(directory, f"{self.id}.pstats")
+        stats.dump_stats(path)
+        with open(os.path.join(directory, f"{self.id}.json"), "w") as f:
+            json.dump(self.metadata(), f)
+        prune_profiles(directory, max_files)
+        return path
+
+
+_current_profile: ContextVar[Optional[TurnProfile]] = ContextVar("turn_profile", default=None)
+# cProfile sees everything on the event loop thread, so profiles must not overlap
+_profiling = threading.Lock()
+
+
+@contextmanager
+def profile_turn(endpoint: str):
+    """
+    Profiles the request in this context and yields its TurnProfile, or None
+    if another turn is being profiled already. The caller saves it.
+    """
+    if not _profiling.acquire(blocking=False):
+        yield None
+        return
+    profile = TurnProfile(endpoint)
+    token = _current_profile.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _current_profile.reset(token)
+        _profiling.release()
+
+
+def current_profile() -> Optional[TurnProfile]:
+    return _current_profile.get()
+
+
+def tag_profile(question_key: str):
+    """Records the question being answered in the current turn's profile, if it is profiled."""
+    profile = _current_profile.get()
+    if profile is not None and not profile.question_key:
+        profile.question_key = question_key
+
+
+def profiled(name: str):
+    """Decorates a function (sync or async) so it runs as a section of the current turn's profile, if there is one."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                profile = _current_profile.get()
+                if profile is None:
+                    return await fn(*args, **kwargs)
+                with profile.section(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            with profile.section(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def prune_profiles(directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+    profiles = list_profiles(directory)
+    for entry in profiles[max_files:]:
+        for extension in (".pstats", ".json"):
+            try:
+                os.remove(os.path.join(directory, entry["id"] + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[dict]:
+    """Metadata of the saved profiles, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                entries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(entries, key=lambda entry: entry.get("started_at", 0), reverse=True)
+
+
+def profile_path(profile_id: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """The `.pstats` file of a saved profile, or None for an unknown (or malformed) id."""
+    if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+        return None
+    path = os.path.join(directory, f"{profile_id}.pstats")
+    return path if os.path.isfile(path) else None
+
+
+def profile_report(path: str, limit: int = 40, sort: str = "cumulative") -> str:
+    """A plain-text pstats report of the `limit` most expensive functions."""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
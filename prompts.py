@@ -54,6 +54,27 @@ Provide your output ONLY in JSON format, like this:
 }}
 """
 
+GROUP_PARSER_PROMPT = """You are an expert at interpreting user responses to yes/no questions.
+The user was shown the following numbered statements and asked whether each one applies to them.
+Each statement is followed by its ID in brackets:
+{questions}
+
+The user responded with:
+"{user_response}"
+
+Your task is to classify the user's answer to each statement as "yes", "no" or "unsure".
+- Respond "yes" if the user agrees, confirms, or indicates the statement applies to them.
+- Respond "no" if the user disagrees, denies, or indicates the statement does not apply.
+- Respond "unsure" if the response says nothing about that statement, or is too ambiguous to tell.
+- A blanket answer ("yes to all", "none of them") applies to every statement it covers.
+
+Provide your output ONLY in JSON format, with one entry per ID, like this:
+{{
+  "A1": "yes",
+  "A2": "unsure"
+}}
+"""
+
 FINAL_RESPONSE_PROMPT = """You are a caring and empathetic AI health assistant.
 You have just completed an autism screening with a user.
 Your task is to provide a final summary and recommendation.
@@ -61,13 +82,13 @@ Your task is to provide a final summary and recommendation.
 **Screening Result:** The screening model suggests that {prediction}.
 **Model Confidence:** The model's confidence in this result is {confidence_score}.
 
-**User's Conversation History:**
-{conversation_history}
+**User's Answers** (question, answer, and the user's own words where available):
+{answer_summary}
 
 **Your Instructions:**
 1.  **Acknowledge and Thank:** Start by thanking the user for their time and for answering the questions.
 2.  **State the Result Empathetically, but Clearly:** Present the screening result and the confidence score. Use gentle and non-alarming, but definitive language.
-3.  **Personalize the Response (Subtly):** Briefly and sensitively reference one or two of the user's answers from the conversation history to show you've been listening.
+3.  **Personalize the Response (Subtly):** Briefly and sensitively reference one or two of the user's answers above to show you've been listening.
 4.  **Crucial Disclaimer:** Stress that this is a **screening tool, not a diagnostic tool**. The results are not a medical diagnosis. This is the most important part of your message.
 5.  **Recommend Next Steps:**
     *   If the result turns out positive, strongly recommend consulting a qualified healthcare professional (like a psychologist or psychiatrist) for a formal evaluation.
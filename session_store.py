@@ -0,0 +1,154 @@
+# session_store.py
+"""
+Server-side storage for conversation state, keyed by an opaque session id.
+
+In session mode the client only sends `session_id` and `user_response` each
+turn instead of round-tripping the whole, ever-growing state. Two backends are
+available, chosen with the SESSION_BACKEND environment variable:
+
+- "memory" (default): an in-process LRU with TTL eviction. Fastest, but every
+  uvicorn worker has its own sessions.
+- "sqlite": a SQLite file (SESSION_DB_PATH) that several workers on the same
+  host can share.
+"""
+import copy
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+DEFAULT_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class SessionStore(ABC):
+    """Stores conversation state dicts by session id. Expired sessions read as missing."""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[dict]:
+        """Returns a private copy of the session's state, or None if unknown or expired."""
+
+    @abstractmethod
+    def put(self, session_id: str, state: dict):
+        """Saves the state and refreshes the session's TTL."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Forgets the session, if it exists."""
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU of session states with TTL eviction."""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        super().__init__(ttl_seconds)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (expires_at, state)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[session_id]
+                return None
+        # Callers mutate the state while running a turn, so a failed turn must
+        # not leave half-applied changes behind in the store.
+        return copy.deepcopy(state)
+
+    def put(self, session_id: str, state: dict):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + self.ttl_seconds, state)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self):
+        now = time.monotonic()
+        # Every put moves its session to the end with a fresh expiry, so the
+        # entries are in both least-recently-written and expiry order
+        while self._sessions:
+            oldest_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session states stored as JSON in a SQLite file shared between worker processes."""
+
+    # Expired rows are purged on roughly one write in this many
+    PURGE_EVERY = 100
+
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT state FROM sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, session_id: str, state: dict):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), now + self.ttl_seconds),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, session_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+def create_session_store() -> SessionStore:
+    """Builds the backend selected by SESSION_BACKEND ("memory" or "sqlite")."""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_DB_PATH", "./sessions.db"))
+    raise RuntimeError(f"Unknown SESSION_BACKEND: {backend!r} (expected 'memory' or 'sqlite').")
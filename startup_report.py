@@ -0,0 +1,128 @@
+# startup_report.py
+"""
+Shows where the backend's cold-start time goes.
+
+Run with `python startup_report.py` from anywhere. Each run starts a fresh
+interpreter, so results do not depend on what is already imported or cached in
+this process. It reports:
+
+- the median time to `import main`, and the top-level packages that account
+  for it, taken from `python -X importtime`;
+- the median time of each warm-up step the lifespan hook runs before traffic
+  is accepted (model load, first prediction, Gemini client construction).
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Times each warm-up step in a fresh interpreter and prints the results as JSON.
+PHASES_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+import model_pipeline
+t2 = time.perf_counter()
+model_pipeline.preprocess_and_predict(dict(main.WARMUP_USER_DATA))
+t3 = time.perf_counter()
+main.gateway.model
+t4 = time.perf_counter()
+print(json.dumps({
+    "import main": t1 - t0,
+    "load model (import model_pipeline)": t2 - t1,
+    "first prediction": t3 - t2,
+    "build Gemini client": t4 - t3,
+}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # No calls are made, but the Gemini client wants a key to be configured
+    env.setdefault("GOOGLE_API_KEY", "startup-report")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+def measure_imports() -> tuple:
+    """Returns (total seconds, {top-level package: self seconds}) for one `import main`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_DIR, env=_env(), capture_output=True, text=True, check=True,
+    )
+    per_package = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+        per_package[name.split(".")[0]] += self_us / 1e6
+        if name == "main" and len(indent) <= 1:
+            total = cumulative_us / 1e6
+    return total, per_package
+
+
+def measure_phases() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PHASES_SCRIPT],
+        cwd=REPO_DIR, env=_env(), capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report where backend startup time goes.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to sample (medians are reported).")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    totals, packages, phases = [], defaultdict(list), defaultdict(list)
+    for _ in range(args.runs):
+        total, per_package = measure_imports()
+        totals.append(total)
+        for name, seconds in per_package.items():
+            packages[name].append(seconds)
+        for name, seconds in measure_phases().items():
+            phases[name].append(seconds)
+
+    def median(values):
+        # Packages missing from some runs count as 0 there
+        return statistics.median(values + [0.0] * (args.runs - len(values)))
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_main_seconds": statistics.median(totals),
+        "top_packages_seconds": dict(sorted(
+            ((name, median(values)) for name, values in packages.items()), key=lambda item: -item[1]
+        )[:args.top]),
+        "warm_up_seconds": {name: statistics.median(values) for name, values in phases.items()},
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Python {report['python']}, median of {args.runs} fresh interpreters\n")
+    print(f"import main: {report['import_main_seconds'] * 1e3:.0f} ms")
+    print("Top packages by self import time:")
+    for name, seconds in report["top_packages_seconds"].items():
+        print(f"  {name:<30} {seconds * 1e3:8.1f} ms")
+    print("\nWarm-up steps (run by the lifespan hook before serving):")
+    for name, seconds in report["warm_up_seconds"].items():
+        print(f"  {name:<40} {seconds * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()